@@ -1,2 +1,25 @@
 """Aero Language v0.0.2 - Fast, fluid, lightweight."""
 __version__ = "0.0.3a"
+
+from importlib import import_module
+
+__all__ = ['CompiledProgram', 'RunResult', 'BatchRunner', 'run_many', 'AsyncVM', 'Scheduler',
+           'IncrementalParser', 'Edit']
+
+# The embedding API is imported on first use, so that the `aero` command
+# can hand a script to a running daemon without loading the compiler
+_EXPORTS = {
+    'CompiledProgram': '.program',
+    'RunResult': '.program',
+    'BatchRunner': '.batch',
+    'run_many': '.batch',
+    'AsyncVM': '.asyncvm',
+    'Scheduler': '.asyncvm',
+    'IncrementalParser': '.incremental',
+    'Edit': '.incremental',
+}
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module 'aero' has no attribute {name!r}")
+    return getattr(import_module(_EXPORTS[name], __name__), name)
@@ -0,0 +1,205 @@
+import os
+import operator
+from array import array
+from .strings import StringBuilder, concat
+
+# Arrays of 64-bit signed integers. The elements live in a NumPy int64
+# buffer, so an operator runs over the whole array in one vectorized call;
+# without NumPy, or with AERO_NO_NUMPY set, they live in an array('q') and
+# the operators loop in Python. Both give the same results: arithmetic
+# wraps around at 64 bits, `/` and `%` round towards negative infinity as
+# they do on ints, and comparisons give arrays of 0s and 1s.
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+_numpy = None
+_numpy_loaded = False
+
+def numpy_module():
+    # Imported on first use, so scripts without arrays never pay for it;
+    # None when NumPy is missing or disabled
+    global _numpy, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        if not os.environ.get("AERO_NO_NUMPY"):
+            try:
+                import numpy
+                _numpy = numpy
+            except ImportError:
+                pass
+    return _numpy
+
+# NumPy ufunc and Python function per operator
+OPERATIONS = {
+    '+': ('add', operator.add),
+    '-': ('subtract', operator.sub),
+    '*': ('multiply', operator.mul),
+    '/': ('floor_divide', operator.floordiv),
+    '%': ('remainder', operator.mod),
+    '==': ('equal', operator.eq),
+    '!=': ('not_equal', operator.ne),
+    '<': ('less', operator.lt),
+    '<=': ('less_equal', operator.le),
+    '>': ('greater', operator.gt),
+    '>=': ('greater_equal', operator.ge),
+}
+COMPARISONS = frozenset({'==', '!=', '<', '<=', '>', '>='})
+
+def type_name(value):
+    # The name Aero gives the type of a value in error messages
+    if type(value) is IntArray:
+        return "array"
+    if type(value) is StringBuilder:
+        return "str"
+    return type(value).__name__
+
+def _wrap(value):
+    return (value - INT64_MIN) % (1 << 64) + INT64_MIN
+
+def _pack(values):
+    try:
+        return array('q', values)
+    except OverflowError:
+        return array('q', map(_wrap, values))
+
+def _element(value, message):
+    if type(value) is not int and type(value) is not bool:
+        raise TypeError(message)
+    value = int(value)
+    if not INT64_MIN <= value <= INT64_MAX:
+        raise OverflowError(f"{value} does not fit in a 64-bit array element")
+    return value
+
+def _buffer(values):
+    numpy = numpy_module()
+    if numpy is not None:
+        return numpy.array(values, dtype=numpy.int64)
+    return array('q', values)
+
+def make_array(values):
+    # An array literal; the elements must be ints or bools
+    return IntArray(_buffer([_element(value, f"Array elements must be ints, not '{type_name(value)}'")
+                             for value in values]))
+
+def arange(start, stop, step):
+    numpy = numpy_module()
+    if numpy is not None:
+        return IntArray(numpy.arange(start, stop, step, dtype=numpy.int64))
+    return IntArray(array('q', range(start, stop, step)))
+
+def elementwise(symbol, left, right):
+    # `left symbol right` where at least one operand is an IntArray and the
+    # other is an IntArray of the same length or an int
+    if symbol in COMPARISONS:
+        message = f"'{symbol}' not supported between instances of '{type_name(left)}' and '{type_name(right)}'"
+    else:
+        message = f"unsupported operand type(s) for {symbol}: '{type_name(left)}' and '{type_name(right)}'"
+    a = left.data if type(left) is IntArray else _element(left, message)
+    b = right.data if type(right) is IntArray else _element(right, message)
+    if type(a) is not int and type(b) is not int and len(a) != len(b):
+        raise ValueError(f"Array lengths differ: {len(a)} and {len(b)}")
+    if symbol == '/' or symbol == '%':
+        if (b == 0) if type(b) is int else (0 in b):
+            raise ZeroDivisionError("integer division or modulo by zero")
+    ufunc, func = OPERATIONS[symbol]
+    numpy = numpy_module()
+    if numpy is not None:
+        with numpy.errstate(all='ignore'):
+            result = getattr(numpy, ufunc)(a, b)
+        if symbol in COMPARISONS:
+            result = result.astype(numpy.int64)
+        return IntArray(result)
+    if type(a) is int:
+        values = [func(a, y) for y in b]
+    elif type(b) is int:
+        values = [func(x, b) for x in a]
+    else:
+        values = list(map(func, a, b))
+    return IntArray(_pack(values))
+
+def _operator(symbol):
+    def forward(self, other):
+        return elementwise(symbol, self, other)
+
+    def reflected(self, other):
+        return elementwise(symbol, other, self)
+    return forward, reflected
+
+class IntArray:
+    # An immutable array of 64-bit ints; `data` is its NumPy int64 array or
+    # array('q'). Operators with another array of the same length or with
+    # an int apply element by element (see elementwise), except that `+`
+    # with a string concatenates as it does for every other value. An array
+    # has no truth value: a condition has to say whether it wants any
+    # element (max) or every element (min) to hold.
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __bool__(self):
+        raise TypeError("The truth value of an array is ambiguous; use min() or max()")
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (make_array, (self.tolist(),))
+
+    def tolist(self):
+        return self.data.tolist()
+
+    def __str__(self):
+        return "[" + ", ".join(map(str, self.tolist())) + "]"
+
+    def __repr__(self):
+        return str(self)
+
+    def item(self, index):
+        size = len(self.data)
+        if not -size <= index < size:
+            raise IndexError("array index out of range")
+        return int(self.data[index])
+
+    def total(self):
+        if numpy_module() is not None:
+            return int(self.data.sum())
+        return _wrap(sum(self.data))
+
+    def minimum(self):
+        if not len(self.data):
+            raise ValueError("min() of an empty array")
+        return int(self.data.min()) if numpy_module() is not None else min(self.data)
+
+    def maximum(self):
+        if not len(self.data):
+            raise ValueError("max() of an empty array")
+        return int(self.data.max()) if numpy_module() is not None else max(self.data)
+
+    def __add__(self, other):
+        if isinstance(other, (str, StringBuilder)):
+            return concat(self, other)
+        return elementwise('+', self, other)
+
+    def __radd__(self, other):
+        if isinstance(other, (str, StringBuilder)):
+            return concat(other, self)
+        return elementwise('+', other, self)
+
+    __sub__, __rsub__ = _operator('-')
+    __mul__, __rmul__ = _operator('*')
+    __floordiv__, __rfloordiv__ = _operator('/')
+    __mod__, __rmod__ = _operator('%')
+    # A reflected comparison comes back as the mirrored one on the array
+    __eq__ = _operator('==')[0]
+    __ne__ = _operator('!=')[0]
+    __lt__ = _operator('<')[0]
+    __le__ = _operator('<=')[0]
+    __gt__ = _operator('>')[0]
+    __ge__ = _operator('>=')[0]
@@ -1,53 +1,158 @@
 class ASTNode:
-    pass
+    # Statements get the source offsets of their first and last token from
+    # the parser (see SourceMap for lines and columns); other nodes keep None.
+    # Nodes use __slots__: a generated program can have millions of them.
+    __slots__ = ('pos', 'end')
 
 class Program(ASTNode):
+    __slots__ = ('statements',)
+
     def __init__(self, statements):
+        self.pos = self.end = None
         self.statements = statements
 
 class Assign(ASTNode):
+    __slots__ = ('name', 'value')
+
     def __init__(self, name, value):
+        self.pos = self.end = None
         self.name = name
         self.value = value
 
 class Number(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
+        self.pos = self.end = None
         self.value = value
 
 class String(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
+        self.pos = self.end = None
         self.value = value
 
 class Bool(ASTNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
+        self.pos = self.end = None
         self.value = value
 
 class Identifier(ASTNode):
+    __slots__ = ('name',)
+
     def __init__(self, name):
+        self.pos = self.end = None
         self.name = name
 
 class BinaryOp(ASTNode):
+    __slots__ = ('op', 'left', 'right')
+
     def __init__(self, op, left, right):
+        self.pos = self.end = None
         self.op = op
         self.left = left
         self.right = right
 
 class Call(ASTNode):
+    __slots__ = ('func', 'args')
+
     def __init__(self, func, args):
+        self.pos = self.end = None
         self.func = func
         self.args = args
 
+class Array(ASTNode):
+    __slots__ = ('elements',)
+
+    def __init__(self, elements):
+        self.pos = self.end = None
+        self.elements = elements
+
+class Index(ASTNode):
+    __slots__ = ('value', 'index')
+
+    def __init__(self, value, index):
+        self.pos = self.end = None
+        self.value = value
+        self.index = index
+
 class Block(ASTNode):
+    __slots__ = ('statements',)
+
     def __init__(self, statements):
+        self.pos = self.end = None
         self.statements = statements
 
 class If(ASTNode):
+    __slots__ = ('condition', 'then_branch', 'else_branch')
+
     def __init__(self, condition, then_branch, else_branch=None):
+        self.pos = self.end = None
         self.condition = condition
         self.then_branch = then_branch
         self.else_branch = else_branch
 
 class While(ASTNode):
+    __slots__ = ('condition', 'body')
+
     def __init__(self, condition, body):
+        self.pos = self.end = None
         self.condition = condition
         self.body = body
+
+class CountedWhile(While):
+    # A While the optimizer proved to be a counted loop: `var` is compared
+    # with `op` against the loop-invariant expression `bound` and changes
+    # only in the last statement of the body, `var = var + step` (a negative
+    # step counts down). `statements` is the body without that increment.
+    # When every other statement has the form `x = x + operand` or
+    # `x = x - operand`, `accumulators` lists them as (x, sign, operand) and
+    # the loop has a closed form; otherwise it is None. Engines that do not
+    # know this node run it as the plain While it still is.
+    __slots__ = ('var', 'op', 'bound', 'step', 'statements', 'accumulators')
+
+    def __init__(self, condition, body, var, op, bound, step, statements, accumulators=None):
+        super().__init__(condition, body)
+        self.var = var
+        self.op = op
+        self.bound = bound
+        self.step = step
+        self.statements = statements
+        self.accumulators = accumulators
+
+def dump(node, indent=0):
+    pad = "  " * indent
+    if isinstance(node, (Program, Block)):
+        lines = [f"{pad}{type(node).__name__}"]
+        lines.extend(dump(stmt, indent + 1) for stmt in node.statements)
+        return "\n".join(lines)
+    elif isinstance(node, If):
+        lines = [f"{pad}If {_dump_expr(node.condition)}", dump(node.then_branch, indent + 1)]
+        if node.else_branch:
+            lines.append(f"{pad}Else")
+            lines.append(dump(node.else_branch, indent + 1))
+        return "\n".join(lines)
+    elif isinstance(node, While):
+        return f"{pad}{type(node).__name__} {_dump_expr(node.condition)}\n{dump(node.body, indent + 1)}"
+    elif isinstance(node, Assign):
+        return f"{pad}Assign {node.name} = {_dump_expr(node.value)}"
+    return pad + _dump_expr(node)
+
+def _dump_expr(node):
+    if isinstance(node, (Number, String, Bool)):
+        return f"{type(node).__name__}({node.value!r})"
+    elif isinstance(node, Identifier):
+        return f"Identifier({node.name})"
+    elif isinstance(node, BinaryOp):
+        return f"BinaryOp({node.op.name}, {_dump_expr(node.left)}, {_dump_expr(node.right)})"
+    elif isinstance(node, Call):
+        args = ", ".join(_dump_expr(arg) for arg in node.args)
+        return f"Call({_dump_expr(node.func)}, [{args}])"
+    elif isinstance(node, Array):
+        return f"Array([{', '.join(_dump_expr(element) for element in node.elements)}])"
+    elif isinstance(node, Index):
+        return f"Index({_dump_expr(node.value)}, {_dump_expr(node.index)})"
+    return repr(node)
@@ -0,0 +1,118 @@
+import asyncio
+from .ast import Program
+from .bytecode import Code, AWAIT
+from .compiler import compile_program
+from .output import Output
+from .program import RunResult
+from .quicken import quicken
+from .runtime import make_array
+from .vm import BytecodeVM
+
+# Instructions a script runs between two yields to the event loop
+DEFAULT_YIELD_EVERY = 1000
+DEFAULT_MAX_RUNNING = 1000
+
+class AsyncVM(BytecodeVM):
+    # Runs cooperative bytecode as a coroutine: `await vm.run(program)`.
+    # Every loop iteration charges the length of the loop's code in
+    # instructions (an upper bound of what it ran; straight-line code is
+    # bounded by the program's size and never charged). After
+    # `yield_every` of them the VM yields to the event loop, and past
+    # `budget` in total the run fails with a RuntimeError. A builtin may
+    # return an awaitable, for instance by being an async function; the
+    # script then waits for its result while other tasks run. Cancelling
+    # the task running `run` stops the script at its next yield or await.
+    def __init__(self, output=None, yield_every=DEFAULT_YIELD_EVERY, budget=None, builtins=None, quickening=True):
+        super().__init__(output, quickening)
+        if builtins:
+            self.globals.update(builtins)
+        self.yield_every = yield_every
+        self.budget = budget
+        self.executed = 0
+
+    def compile(self, program, inputs=()):
+        # Cooperative code for this VM's builtins; `inputs` name variables
+        # run() may seed
+        return compile_program(program, inputs=inputs, builtins=self.globals, cooperative=True)
+
+    async def run(self, program, inputs=None):
+        # `program` is a Program or Code from compile(); returns the final
+        # variables like CompiledProgram.run
+        if isinstance(program, Program):
+            program = self.compile(program, tuple(inputs or ()))
+        if not isinstance(program, Code):
+            raise TypeError("Expected Program AST node or Code object")
+        if not program.cooperative:
+            # It would never yield, await or count against the budget
+            raise TypeError("Code must be compiled with AsyncVM.compile or Scheduler.compile")
+        code = program
+        self._bind(code)
+        self.executed = 0
+        for name, value in (inputs or {}).items():
+            if name not in code.names:
+                raise NameError(f"Unknown input: {name}")
+            self.slots[code.names.index(name)] = make_array(value) if isinstance(value, (list, tuple)) else value
+        if self.quickening:
+            instructions, sites = quicken(code)
+        else:
+            instructions, sites = code.instructions, ()
+        stack = []
+        pc = 0
+        try:
+            while True:
+                self.ticks = self.yield_every
+                if self.budget is not None:
+                    self.ticks = min(self.ticks, self.budget - self.executed)
+                granted = self.ticks
+                pc = self._dispatch(code, instructions, sites, pc, stack)
+                self.executed += granted - self.ticks
+                if pc is None:
+                    return self.variables
+                if instructions[pc - 2] == AWAIT:
+                    stack[-1] = await stack[-1]
+                elif self.budget is not None and self.executed > self.budget:
+                    raise RuntimeError(f"Instruction budget of {self.budget} exceeded")
+                else:
+                    await asyncio.sleep(0)
+        finally:
+            if self.quickening:
+                self.stats.add_code(code)
+            self.output.flush()
+
+class Scheduler:
+    # Runs many scripts concurrently on one event loop, each on its own
+    # AsyncVM with the same yield interval, budget and extra builtins, and
+    # at most `max_running` of them at a time; the rest wait for a turn.
+    # Results are RunResults, as from CompiledProgram.capture. Compile a
+    # script that runs many times once, with compile(), and pass the Code.
+    def __init__(self, max_running=DEFAULT_MAX_RUNNING, yield_every=DEFAULT_YIELD_EVERY, budget=None, builtins=None):
+        self.max_running = max_running
+        self.yield_every = yield_every
+        self.budget = budget
+        self.builtins = dict(builtins or {})
+        self._turns = None
+
+    def _vm(self, output=None):
+        return AsyncVM(output, self.yield_every, self.budget, self.builtins)
+
+    def compile(self, program, inputs=()):
+        return self._vm().compile(program, inputs)
+
+    async def run(self, program, inputs=None):
+        if self._turns is None:
+            # Created here, inside the running loop
+            self._turns = asyncio.Semaphore(self.max_running)
+        async with self._turns:
+            chunks = []
+            vm = self._vm(Output(chunks.append, line_buffered=False))
+            try:
+                variables = await vm.run(program, inputs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return RunResult("".join(chunks), vm.variables, str(e))
+            return RunResult("".join(chunks), variables)
+
+    async def run_all(self, jobs):
+        # `jobs` are (program, inputs) pairs; results come back in order
+        return await asyncio.gather(*(self.run(program, inputs) for program, inputs in jobs))
@@ -0,0 +1,73 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+DEFAULT_CHUNKSIZE = 64
+
+# Programs of the current worker process, installed once by _init_worker
+_programs = ()
+
+def _init_worker(programs):
+    global _programs
+    _programs = programs
+
+def _run_chunk(chunk):
+    return [_programs[index].capture(inputs) for index, inputs in chunk]
+
+def _chunks(jobs, size):
+    jobs = iter(jobs)
+    while True:
+        chunk = list(islice(jobs, size))
+        if not chunk:
+            return
+        yield chunk
+
+class BatchRunner:
+    # Runs (program index, inputs) jobs across worker processes. Every
+    # worker receives the compiled programs once, when it starts; after that
+    # only job chunks and RunResults cross process boundaries. Results come
+    # back in job order, and at most a few chunks per worker are in flight,
+    # so jobs can be an unbounded iterator.
+    def __init__(self, programs, max_workers=None, chunksize=DEFAULT_CHUNKSIZE):
+        self.programs = tuple(programs)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunksize = max(1, chunksize)
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def run(self, jobs):
+        if self.max_workers == 1:
+            # Not worth a process pool: run in this process
+            for index, inputs in jobs:
+                yield self.programs[index].capture(inputs)
+            return
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.max_workers, initializer=_init_worker,
+                                                 initargs=(self.programs,))
+        window = self.max_workers * 4
+        pending = deque()
+        for chunk in _chunks(jobs, self.chunksize):
+            pending.append(self._executor.submit(_run_chunk, chunk))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def run_many(programs, jobs=None, max_workers=None, chunksize=DEFAULT_CHUNKSIZE):
+    # Without jobs, every program runs once with no inputs
+    programs = tuple(programs)
+    if jobs is None:
+        jobs = ((index, None) for index in range(len(programs)))
+    with BatchRunner(programs, max_workers, chunksize) as runner:
+        yield from runner.run(jobs)
@@ -0,0 +1,2 @@
+from .workloads import WORKLOADS
+from .runner import PHASES, bench_source, run_benchmarks, compare_results, main
@@ -0,0 +1,5 @@
+import sys
+from .runner import main
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:], prog="python -m aero.bench"))
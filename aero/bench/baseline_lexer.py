@@ -0,0 +1,162 @@
+# The character-at-a-time lexer Aero had before the master regex, kept as
+# the reference for the "lex-old" benchmark phase. Only what the language
+# has gained since is added, so that it accepts the whole corpus: a lone
+# '/' lexes as SLASH instead of failing, '[' and ']' are delimiters, and
+# an identifier at the very end of the source no longer reads past it.
+# Otherwise it does the same work per character and per token as it did.
+from ..lexer import TokenType
+
+class Token:
+    def __init__(self, type_, value):
+        self.type = type_
+        self.value = value
+
+    def __repr__(self):
+        return f"Token({self.type}, {self.value})"
+
+class BaselineLexer:
+    def __init__(self, source):
+        self.source = source
+        self.pos = 0
+        self.keywords = {
+            'if': TokenType.IF,
+            'else': TokenType.ELSE,
+            'while': TokenType.WHILE,
+            'true': TokenType.TRUE,
+            'false': TokenType.FALSE,
+        }
+
+    def _peek(self):
+        if self.pos + 1 < len(self.source):
+            return self.source[self.pos + 1]
+        return '\0'
+
+    def tokenize(self):
+        tokens = []
+        while self.pos < len(self.source):
+            char = self.source[self.pos]
+
+            if char.isspace():
+                self.pos += 1
+            elif char == '/':
+                if self._peek() == '/':
+                    while self.pos < len(self.source) and self.source[self.pos] != '\n':
+                        self.pos += 1
+                else:
+                    tokens.append(Token(TokenType.SLASH, '/'))
+                    self.pos += 1
+            elif char.isdigit():
+                tokens.append(self._read_number())
+            elif char.isalpha() or char == '_':
+                tokens.append(self._read_identifier())
+            elif char == '"':
+                tokens.append(self._read_string())
+            elif char == '+':
+                tokens.append(Token(TokenType.PLUS, '+'))
+                self.pos += 1
+            elif char == '-':
+                tokens.append(Token(TokenType.MINUS, '-'))
+                self.pos += 1
+            elif char == '*':
+                tokens.append(Token(TokenType.STAR, '*'))
+                self.pos += 1
+            elif char == '%':
+                tokens.append(Token(TokenType.PERCENT, '%'))
+                self.pos += 1
+            elif char == '=':
+                if self._peek() == '=':
+                    tokens.append(Token(TokenType.EQUAL, '=='))
+                    self.pos += 2
+                else:
+                    tokens.append(Token(TokenType.ASSIGN, '='))
+                    self.pos += 1
+            elif char == '!':
+                if self._peek() == '=':
+                    tokens.append(Token(TokenType.NOT_EQUAL, '!='))
+                    self.pos += 2
+                else:
+                    raise SyntaxError(f"Unexpected character: {char}")
+            elif char == '<':
+                if self._peek() == '=':
+                    tokens.append(Token(TokenType.LESS_EQUAL, '<='))
+                    self.pos += 2
+                else:
+                    tokens.append(Token(TokenType.LESS, '<'))
+                    self.pos += 1
+            elif char == '>':
+                if self._peek() == '=':
+                    tokens.append(Token(TokenType.GREATER_EQUAL, '>='))
+                    self.pos += 2
+                else:
+                    tokens.append(Token(TokenType.GREATER, '>'))
+                    self.pos += 1
+            elif char == '&':
+                if self._peek() == '&':
+                    tokens.append(Token(TokenType.AND, '&&'))
+                    self.pos += 2
+                else:
+                    raise SyntaxError(f"Unexpected character: {char}")
+            elif char == '|':
+                if self._peek() == '|':
+                    tokens.append(Token(TokenType.OR, '||'))
+                    self.pos += 2
+                else:
+                    raise SyntaxError(f"Unexpected character: {char}")
+            elif char == '(':
+                tokens.append(Token(TokenType.LPAREN, '('))
+                self.pos += 1
+            elif char == ')':
+                tokens.append(Token(TokenType.RPAREN, ')'))
+                self.pos += 1
+            elif char == '{':
+                tokens.append(Token(TokenType.LBRACE, '{'))
+                self.pos += 1
+            elif char == '}':
+                tokens.append(Token(TokenType.RBRACE, '}'))
+                self.pos += 1
+            elif char == '[':
+                tokens.append(Token(TokenType.LBRACKET, '['))
+                self.pos += 1
+            elif char == ']':
+                tokens.append(Token(TokenType.RBRACKET, ']'))
+                self.pos += 1
+            elif char == ',':
+                tokens.append(Token(TokenType.COMMA, ','))
+                self.pos += 1
+            elif char == ';':
+                tokens.append(Token(TokenType.SEMICOLON, ';'))
+                self.pos += 1
+            else:
+                raise SyntaxError(f"Unexpected character: {char}")
+        tokens.append(Token(TokenType.EOF, None))
+        return tokens
+
+    def _read_number(self):
+        start = self.pos
+        while self.pos < len(self.source) and self.source[self.pos].isdigit():
+            self.pos += 1
+        return Token(TokenType.NUMBER, int(self.source[start:self.pos]))
+
+    def _read_identifier(self):
+        start = self.pos
+        while self.pos < len(self.source) and (self.source[self.pos].isalnum() or self.source[self.pos] == '_'):
+            self.pos += 1
+        name = self.source[start:self.pos]
+        token_type = self.keywords.get(name, TokenType.IDENTIFIER)
+        if token_type in (TokenType.TRUE, TokenType.FALSE):
+            return Token(TokenType.BOOL, name == 'true')
+        return Token(token_type, name)
+
+    def _read_string(self):
+        self.pos += 1
+        start = self.pos
+        while self.pos < len(self.source) and self.source[self.pos] != '"':
+            if self.source[self.pos] == '\\':
+                self.pos += 2
+            else:
+                self.pos += 1
+        if self.pos >= len(self.source):
+            raise SyntaxError("Unterminated string")
+        value = self.source[start:self.pos]
+        self.pos += 1
+        return Token(TokenType.STRING, value)
@@ -0,0 +1,249 @@
+import os
+import gc
+import sys
+import json
+import time
+import argparse
+import itertools
+import platform
+import tracemalloc
+import contextlib
+from .. import __version__
+from ..lexer import Lexer
+from ..parser import Parser
+from ..flat import FlatProgram
+from ..incremental import IncrementalParser, Edit
+from ..optimizer import optimize
+from ..compiler import compile_program
+from ..vm import VirtualMachine, BytecodeVM
+from ..closures import ClosureVM
+from ..transpiler import PythonVM
+from .workloads import WORKLOADS
+from .baseline_lexer import BaselineLexer
+
+PHASES = ("lex", "lex-old", "parse", "flat", "reparse", "compile", "tree", "closure", "bytecode", "py")
+
+def _phases(source, opt_level=1):
+    # Each phase gets its input prepared outside the timed call. The engines
+    # run the optimized AST, as the CLI does; "closure" includes turning the
+    # AST into closures and "bytecode" excludes compile_program, which is
+    # timed on its own as "compile". "py" includes generating and compiling
+    # the Python code. "flat" parses into a FlatProgram; compare its memory
+    # peak with that of "parse". "reparse" is one incremental update after
+    # a line break is inserted in the middle of the source, or removed again.
+    # "lex-old" runs the character-at-a-time lexer the master regex replaced
+    # (see baseline_lexer), so both report tokens/s on the same source.
+    tokens = Lexer(source).tokenize()
+    program = optimize(Parser(tokens).parse(), opt_level)
+    code = compile_program(program)
+    incremental = IncrementalParser()
+    incremental.parse(source)
+    middle = source.find("\n", len(source) // 2) + 1
+    edits = itertools.cycle([Edit(middle, middle, "\n"), Edit(middle, middle + 1, "")])
+    return {
+        "lex": lambda: Lexer(source).tokenize(),
+        "lex-old": lambda: BaselineLexer(source).tokenize(),
+        "parse": lambda: Parser(tokens).parse(),
+        "flat": lambda: FlatProgram(Parser(tokens).parse_statements()),
+        "reparse": lambda: incremental.apply(next(edits)),
+        "compile": lambda: compile_program(program),
+        "tree": lambda: VirtualMachine().execute(program),
+        "closure": lambda: ClosureVM().execute(program),
+        "bytecode": lambda: BytecodeVM().execute(code),
+        "py": lambda: PythonVM().execute(program),
+    }, len(tokens)
+
+def time_call(func, repeat=5, warmup=1):
+    # Like timeit: the collector is off while the call is timed
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return times
+
+def peak_memory(func):
+    # Traced allocation peak of one call, on top of what was live before
+    gc.collect()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak - baseline
+
+def bench_source(source, phases=PHASES, repeat=5, warmup=1, memory=True, opt_level=1):
+    funcs, token_count = _phases(source, opt_level)
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for phase in phases:
+            times = time_call(funcs[phase], repeat, warmup)
+            result = {
+                "min": min(times),
+                "median": sorted(times)[len(times) // 2],
+                "mean": sum(times) / len(times),
+            }
+            if memory:
+                result["peak_bytes"] = peak_memory(funcs[phase])
+            results[phase] = result
+    for phase in ("lex", "lex-old"):
+        if phase in results:
+            results[phase]["tokens_per_s"] = token_count / results[phase]["min"]
+    return {"bytes": len(source), "tokens": token_count, "phases": results}
+
+def run_benchmarks(workloads=None, phases=PHASES, scale=1.0, repeat=5, warmup=1, memory=True,
+                   opt_level=1, files=(), progress=None):
+    sources = [(name, WORKLOADS[name](scale)) for name in (workloads or WORKLOADS)]
+    for filepath in files:
+        with open(filepath, 'r') as f:
+            sources.append((os.path.basename(filepath), f.read()))
+    results = {}
+    for name, source in sources:
+        if progress:
+            progress(name)
+        results[name] = bench_source(source, phases, repeat, warmup, memory, opt_level)
+    return {
+        "aero_version": __version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "scale": scale,
+        "repeat": repeat,
+        "opt_level": opt_level,
+        "workloads": results,
+    }
+
+SCALING_STEPS = (0.25, 0.5, 1.0)
+
+def run_scaling(workloads, phases=PHASES, scale=1.0, repeat=5, warmup=1, opt_level=1, progress=None):
+    # Times each workload at SCALING_STEPS of `scale`; the growth of a
+    # phase is its time at full size over its time at half size, about 2
+    # for linear and 4 for quadratic work
+    rows = []
+    for name in workloads:
+        times = {phase: [] for phase in phases}
+        for step in SCALING_STEPS:
+            if progress:
+                progress(f"{name} x{scale * step:g}")
+            result = bench_source(WORKLOADS[name](scale * step), phases, repeat, warmup, False, opt_level)
+            for phase in phases:
+                times[phase].append(result["phases"][phase]["min"])
+        for phase in phases:
+            rows.append((name, phase, times[phase], times[phase][-1] / times[phase][-2]))
+    return rows
+
+def format_scaling(rows, scale):
+    header = "".join(f"{f'x{scale * step:g} ms':>11}" for step in SCALING_STEPS)
+    lines = [f"{'workload':<14} {'phase':<9}{header} {'growth':>7}"]
+    for name, phase, times, growth in rows:
+        columns = "".join(f"{t * 1e3:>11.2f}" for t in times)
+        lines.append(f"{name:<14} {phase:<9}{columns} {growth:>6.2f}x")
+    lines.append("")
+    lines.append("growth: time at full size over time at half size (2 is linear, 4 quadratic)")
+    return "\n".join(lines)
+
+def compare_results(baseline, current, threshold=0.10):
+    # Compares best times phase by phase; a phase regresses when it is more
+    # than `threshold` (a fraction) slower than in the baseline
+    rows = []
+    for name, workload in current["workloads"].items():
+        base_workload = baseline.get("workloads", {}).get(name)
+        if base_workload is None:
+            continue
+        for phase, result in workload["phases"].items():
+            base = base_workload["phases"].get(phase)
+            if base is None:
+                continue
+            ratio = result["min"] / base["min"] if base["min"] else 1.0
+            rows.append((name, phase, base["min"], result["min"], ratio, ratio > 1.0 + threshold))
+    return rows
+
+def format_results(results):
+    lines = [f"Aero {results['aero_version']} on {results['implementation']} {results['python']} "
+             f"(scale {results['scale']}, best of {results['repeat']}, -O{results['opt_level']})", ""]
+    lines.append(f"{'workload':<14} {'phase':<9} {'best ms':>10} {'median ms':>10} {'peak KiB':>10}")
+    for name, workload in results["workloads"].items():
+        for phase, result in workload["phases"].items():
+            peak = f"{result['peak_bytes'] / 1024:,.0f}" if "peak_bytes" in result else "-"
+            extra = ""
+            if "tokens_per_s" in result:
+                extra = f"  {workload['tokens']:,} tokens, {result['tokens_per_s']:,.0f} tokens/s"
+            lines.append(f"{name:<14} {phase:<9} {result['min'] * 1e3:>10.2f} "
+                         f"{result['median'] * 1e3:>10.2f} {peak:>10}{extra}")
+    return "\n".join(lines)
+
+def format_comparison(rows, threshold):
+    lines = [f"{'workload':<14} {'phase':<9} {'base ms':>10} {'new ms':>10} {'change':>8}"]
+    for name, phase, base, new, ratio, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        lines.append(f"{name:<14} {phase:<9} {base * 1e3:>10.2f} {new * 1e3:>10.2f} "
+                     f"{(ratio - 1) * 100:>+7.1f}%{flag}")
+    regressions = sum(1 for row in rows if row[5])
+    lines.append("")
+    lines.append(f"{regressions} of {len(rows)} phases slower than the {threshold * 100:g}% threshold")
+    return "\n".join(lines)
+
+def _choices(text, allowed):
+    names = [name.strip() for name in text.split(",") if name.strip()]
+    for name in names:
+        if name not in allowed:
+            raise argparse.ArgumentTypeError(f"unknown name {name!r} (choose from {', '.join(allowed)})")
+    return names
+
+def main(argv=None, prog="aero bench"):
+    parser = argparse.ArgumentParser(prog=prog, description="Time the Aero lexer, parser and engines on a workload corpus")
+    parser.add_argument("files", nargs="*", help="also benchmark these source files")
+    parser.add_argument("-w", "--workloads", type=lambda text: _choices(text, list(WORKLOADS)),
+                        help=f"comma-separated workloads (default: all of {', '.join(WORKLOADS)}, or none when files are given)")
+    parser.add_argument("-p", "--phases", type=lambda text: _choices(text, PHASES), default=list(PHASES),
+                        help=f"comma-separated phases (default: {','.join(PHASES)})")
+    parser.add_argument("--scale", type=float, default=1.0, help="workload size multiplier (default: 1)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed repetitions, best is compared (default: 5)")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed runs before timing (default: 1)")
+    parser.add_argument("-O", dest="opt_level", type=int, choices=(0, 1, 2), default=1,
+                        help="optimization level of the executed AST (default: 1)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced memory peak runs")
+    parser.add_argument("--scaling", action="store_true",
+                        help="time each workload at a quarter, half and full scale and report how time grows")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against a JSON file written by --json")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="percent slowdown against --compare that fails the run (default: 10)")
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    workloads = args.workloads
+    if workloads is None:
+        workloads = [] if args.files else list(WORKLOADS)
+    progress = lambda name: print(f"running {name}...", file=sys.stderr, flush=True)
+    if args.scaling:
+        if args.files or args.json or args.compare:
+            parser.error("--scaling only runs the built-in workloads and cannot be combined with --json or --compare")
+        print(format_scaling(run_scaling(workloads, args.phases, args.scale, args.repeat, args.warmup,
+                                         args.opt_level, progress), args.scale))
+        return 0
+    results = run_benchmarks(workloads, args.phases, args.scale, args.repeat, args.warmup,
+                             not args.no_memory, args.opt_level, args.files, progress)
+    print(format_results(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        threshold = args.threshold / 100
+        rows = compare_results(baseline, results, threshold)
+        print()
+        print(format_comparison(rows, threshold))
+        if any(row[5] for row in rows):
+            return 1
+    return 0
@@ -0,0 +1,124 @@
+# Benchmark corpus. Every workload is a generated Aero program whose size
+# grows linearly with `scale` (1 is the default corpus); programs write
+# through print() so the engines do the same work as for a real script.
+
+FIZZBUZZ = '''i = 1
+while (i <= {limit}) {{
+    if (i % 15 == 0) {{
+        print("FizzBuzz")
+    }} else if (i % 3 == 0) {{
+        print("Fizz")
+    }} else if (i % 5 == 0) {{
+        print("Buzz")
+    }} else {{
+        print(i)
+    }}
+    i = i + 1
+}}
+'''
+
+MIXED = '''// generated workload
+i = 1
+total = 0
+while (i <= 100) {
+    if (i % 15 == 0) {
+        print("FizzBuzz")
+    } else if (i % 3 == 0 && total != 7) {
+        total = total + (i * 2 - 1) / 3
+    } else {
+        label = "item " + i; print(label, total >= 10 || i < 5)
+    }
+    i = i + 1
+}
+'''
+
+def fizzbuzz(scale=1):
+    return FIZZBUZZ.format(limit=int(3000 * scale))
+
+def else_if_chain(scale=1, depth=100):
+    # Every iteration falls through most of a long else-if ladder
+    iterations = int(500 * scale)
+    lines = ["i = 0", "hits = 0", f"while (i < {iterations}) {{", "    n = i % " + str(depth + 1)]
+    for branch in range(depth):
+        keyword = "if" if branch == 0 else "} else if"
+        lines.append(f"    {keyword} (n == {branch}) {{")
+        lines.append(f"        hits = hits + {branch}")
+    lines.append("    } else {")
+    lines.append("        hits = hits - 1")
+    lines.append("    }")
+    lines.append("    i = i + 1")
+    lines.append("}")
+    lines.append("print(hits)")
+    return "\n".join(lines) + "\n"
+
+def string_concat(scale=1):
+    iterations = int(5000 * scale)
+    return (f'''s = ""
+i = 0
+while (i < {iterations}) {{
+    s = s + "x" + i
+    i = i + 1
+}}
+print(s == "")
+''')
+
+def report(scale=1):
+    # Builds one long string a line at a time, which takes quadratic time
+    # if every `+` copies what has been built so far
+    steps = int(100000 * scale)
+    return (f'''out = ""
+i = 0
+while (i < {steps}) {{
+    out = out + "line " + i + ": ok"
+    i = i + 1
+}}
+print(out == "")
+''')
+
+def scoring(scale=1):
+    # Per-record scores computed as whole-array expressions, so the work
+    # per record happens inside the array operators
+    records = int(100000 * scale)
+    return (f'''amounts = range({records}) * 37 % 1000
+visits = range({records}) * 11 % 50
+round = 0
+best = 0
+while (round < 20) {{
+    score = amounts / 10 + visits * 3 - (amounts > 500) * 25 + round
+    best = best + max(score) + sum(score % 7 == 0)
+    round = round + 1
+}}
+print(best)
+''')
+
+def straight_line(scale=1):
+    # A large file with no loops: lexing and parsing dominate
+    lines = []
+    for n in range(int(5000 * scale)):
+        lines.append(f"v{n % 500} = {n} * 7 + (v{(n * 13) % 500} - {n % 11}) / 3" if n >= 500 else f"v{n} = {n}")
+        if n % 1000 == 999:
+            lines.append(f'print("line", {n}, v{n % 500})')
+    return "\n".join(lines) + "\n"
+
+def mixed(scale=1):
+    return MIXED * max(1, int(50 * scale))
+
+def many_variables(scale=1, iterations=20000):
+    # Thousands of live variables while a loop runs: the traced memory
+    # peak is dominated by how values are stored
+    lines = [f"v{n} = {n} * 7 + 1000" for n in range(int(2000 * scale))]
+    lines.append("i = 0")
+    lines.append(f"while (i < {iterations}) {{ i = i + 1 }}")
+    lines.append("print(i)")
+    return "\n".join(lines) + "\n"
+
+WORKLOADS = {
+    'fizzbuzz': fizzbuzz,
+    'else_if': else_if_chain,
+    'concat': string_concat,
+    'report': report,
+    'scoring': scoring,
+    'straight_line': straight_line,
+    'mixed': mixed,
+    'variables': many_variables,
+}
@@ -0,0 +1,129 @@
+import os
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from . import __version__
+from .cache import CACHE_DIR, CACHE_FORMAT, source_hash, cache_path, store_cached
+from .compiler import compile_source
+from .optimizer import optimize
+
+SOURCE_SUFFIX = ".aero"
+
+def find_sources(root):
+    # Every .aero file below root, skipping cache and hidden directories
+    sources = []
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if name != CACHE_DIR and not name.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.endswith(SOURCE_SUFFIX):
+                sources.append(os.path.join(directory, filename))
+    return sources
+
+def manifest_path(root, opt_level):
+    return os.path.join(root, CACHE_DIR, f"build.{__version__}-O{opt_level}.json")
+
+def load_manifest(path):
+    try:
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('format') != CACHE_FORMAT:
+        return {}
+    return manifest.get('files', {})
+
+def save_manifest(path, files):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({'version': __version__, 'format': CACHE_FORMAT, 'files': files}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+class BuildError:
+    __slots__ = ('path', 'message', 'line', 'col')
+
+    def __init__(self, path, message, line=None, col=None):
+        self.path = path
+        self.message = message
+        self.line = line
+        self.col = col
+
+    def __str__(self):
+        if self.line is None:
+            return f"{self.path}: {self.message}"
+        return f"{self.path}:{self.line}:{self.col}: {self.message}"
+
+    def __reduce__(self):
+        return (BuildError, (self.path, self.message, self.line, self.col))
+
+def build_file(path, source, digest, opt_level=1):
+    # Lexes, parses and optimizes one file and writes its cache entry.
+    # Returns a BuildError instead of raising so a batch can report them all.
+    try:
+        program = optimize(compile_source(source, path), opt_level)
+    except SyntaxError as e:
+        return BuildError(path, e.msg, e.lineno, e.offset)
+    except Exception as e:
+        return BuildError(path, str(e))
+    if not store_cached(cache_path(path, opt_level), digest, program):
+        return BuildError(path, "could not write compiled artifact")
+    return None
+
+def _build_chunk(chunk, opt_level):
+    return [build_file(path, source, digest, opt_level) for path, source, digest in chunk]
+
+class BuildResult:
+    def __init__(self, built, unchanged, errors, elapsed):
+        self.built = built
+        self.unchanged = unchanged
+        self.errors = errors
+        self.elapsed = elapsed
+
+def build(root, opt_level=1, max_workers=None, force=False):
+    # Files whose source hash matches the last successful build and whose
+    # artifact still exists are skipped. Failed files are never recorded,
+    # so their errors are reported again on every build.
+    start = time.perf_counter()
+    manifest_file = manifest_path(root, opt_level)
+    previous = {} if force else load_manifest(manifest_file)
+    files = {}
+    stale = []
+    errors = []
+    for path in find_sources(root):
+        try:
+            with open(path, 'r') as f:
+                source = f.read()
+        except OSError as e:
+            errors.append(BuildError(path, f"could not read source: {e.strerror or e}"))
+            continue
+        except UnicodeDecodeError as e:
+            errors.append(BuildError(path, f"could not decode source: {e}"))
+            continue
+        digest = source_hash(source)
+        key = os.path.relpath(path, root)
+        if previous.get(key) == digest and os.path.exists(cache_path(path, opt_level)):
+            files[key] = digest
+        else:
+            stale.append((path, source, digest))
+    unchanged = len(files)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(stale) < 2:
+        outcomes = _build_chunk(stale, opt_level)
+    else:
+        # A few chunks per worker keeps the pool busy without sending
+        # every file as its own task
+        size = max(1, len(stale) // (max_workers * 4))
+        chunks = [stale[i:i + size] for i in range(0, len(stale), size)]
+        with ProcessPoolExecutor(max_workers) as executor:
+            outcomes = [error for result in executor.map(_build_chunk, chunks, [opt_level] * len(chunks))
+                        for error in result]
+
+    unreadable = len(errors)
+    for (path, source, digest), error in zip(stale, outcomes):
+        if error is None:
+            files[os.path.relpath(path, root)] = digest
+        else:
+            errors.append(error)
+    save_manifest(manifest_file, files)
+    return BuildResult(len(stale) - len(errors) + unreadable, unchanged, errors, time.perf_counter() - start)
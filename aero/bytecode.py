@@ -0,0 +1,140 @@
+LOAD_CONST = 0
+LOAD_SLOT = 1
+STORE_SLOT = 2
+POP_TOP = 3
+BINARY_ADD = 4
+BINARY_SUB = 5
+BINARY_MUL = 6
+BINARY_DIV = 7
+BINARY_MOD = 8
+COMPARE_EQ = 9
+COMPARE_NE = 10
+COMPARE_LT = 11
+COMPARE_LE = 12
+COMPARE_GT = 13
+COMPARE_GE = 14
+TO_BOOL = 15
+JUMP = 16
+POP_JUMP_IF_FALSE = 17
+POP_JUMP_IF_TRUE = 18
+JUMP_IF_FALSE_OR_POP = 19
+JUMP_IF_TRUE_OR_POP = 20
+# Fused compare-and-branch: pop two operands and jump unless the comparison
+# holds, without materializing the intermediate bool
+JUMP_IF_NOT_EQ = 21
+JUMP_IF_NOT_NE = 22
+JUMP_IF_NOT_LT = 23
+JUMP_IF_NOT_LE = 24
+JUMP_IF_NOT_GT = 25
+JUMP_IF_NOT_GE = 26
+CALL = 27
+LOAD_BUILTIN = 28
+# Counted loops (see CountedWhile): the argument indexes Code.loops
+FOR_RANGE_SETUP = 29
+FOR_RANGE_NEXT = 30
+# Quickened operations (see aero.quicken). The compiler never emits these;
+# they replace a LOAD_SLOT or LOAD_CONST in a VM's adaptive copy of the
+# instructions, and the argument indexes that copy's operation sites.
+QUICK_SLOT_CONST = 31
+QUICK_SLOT_SLOT = 32
+QUICK_CONST_SLOT = 33
+# Arrays: BUILD_ARRAY pops `arg` elements and pushes the array of them
+BUILD_ARRAY = 34
+BINARY_INDEX = 35
+# Emitted only in cooperative code (see aero.asyncvm). YIELD_POINT starts
+# every loop body and charges the loop's length in instructions, `arg`, to
+# the VM's ticks; the VM stops once they run out. AWAIT follows every CALL
+# and stops the VM when the call returned an awaitable. Either way the VM
+# can be resumed at the next instruction.
+YIELD_POINT = 36
+AWAIT = 37
+
+OPNAMES = {
+    value: name for name, value in list(globals().items())
+    if name.isupper() and isinstance(value, int)
+}
+
+# Opcodes whose argument is an absolute index into the instruction array
+JUMP_OPS = frozenset({
+    JUMP, POP_JUMP_IF_FALSE, POP_JUMP_IF_TRUE,
+    JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP,
+    JUMP_IF_NOT_EQ, JUMP_IF_NOT_NE, JUMP_IF_NOT_LT,
+    JUMP_IF_NOT_LE, JUMP_IF_NOT_GT, JUMP_IF_NOT_GE,
+})
+
+class CountedLoop:
+    # Operand of FOR_RANGE_SETUP and FOR_RANGE_NEXT. FOR_RANGE_SETUP pops
+    # the start value and the bound. With two ints it either applies the
+    # closed form and jumps past next_pc, or pushes the final value and a
+    # range iterator and jumps to next_pc. Otherwise it pushes the bound and
+    # None, and FOR_RANGE_NEXT increments and compares with the generic
+    # operators. FOR_RANGE_NEXT jumps back to body_pc while the loop goes
+    # on. `slots` maps the names the closed form reads to their slots.
+    __slots__ = ('slot', 'op', 'step', 'var', 'accumulators', 'slots', 'body_pc', 'next_pc')
+
+    def __init__(self, slot, op, step, var, accumulators, slots, body_pc=0, next_pc=0):
+        self.slot = slot
+        self.op = op
+        self.step = step
+        self.var = var
+        self.accumulators = accumulators
+        self.slots = slots
+        self.body_pc = body_pc
+        self.next_pc = next_pc
+
+    def __reduce__(self):
+        return (CountedLoop, (self.slot, self.op, self.step, self.var, self.accumulators,
+                              self.slots, self.body_pc, self.next_pc))
+
+class Code:
+    # Instructions are stored flat as [op, arg, op, arg, ...]; ops without
+    # an argument carry a 0 so every instruction is exactly two slots wide.
+    # Variables live in slots resolved at compile time: `names[i]` is the
+    # variable stored in slot i and `builtins[i]` the builtin loaded by
+    # LOAD_BUILTIN i. CALL's argument indexes into `calls`, a list of
+    # (argc, callee name) pairs; the name is only used for error messages.
+    # The FOR_RANGE ops index `loops`, a list of CountedLoop records.
+    # `cooperative` code has YIELD_POINT and AWAIT instructions.
+    def __init__(self, instructions, constants, names, builtins, calls, loops=(), cooperative=False):
+        self.instructions = instructions
+        self.constants = constants
+        self.names = names
+        self.builtins = builtins
+        self.calls = calls
+        self.loops = loops
+        self.cooperative = cooperative
+        # Quickened instructions and operation sites, filled in on first run
+        self.adaptive = None
+
+    def __reduce__(self):
+        return (Code, (self.instructions, self.constants, self.names, self.builtins, self.calls, self.loops,
+                       self.cooperative))
+
+    def __repr__(self):
+        return f"Code({len(self.instructions) // 2} instructions)"
+
+    def disassemble(self):
+        lines = []
+        for pc in range(0, len(self.instructions), 2):
+            op = self.instructions[pc]
+            arg = self.instructions[pc + 1]
+            name = OPNAMES[op]
+            if op == LOAD_CONST:
+                detail = f"{arg} ({self.constants[arg]!r})"
+            elif op in (LOAD_SLOT, STORE_SLOT):
+                detail = f"{arg} ({self.names[arg]})"
+            elif op == LOAD_BUILTIN:
+                detail = f"{arg} ({self.builtins[arg]})"
+            elif op == CALL:
+                argc, callee = self.calls[arg]
+                detail = f"{argc} ({callee})"
+            elif op in (BUILD_ARRAY, YIELD_POINT):
+                detail = str(arg)
+            elif op in (FOR_RANGE_SETUP, FOR_RANGE_NEXT):
+                detail = f"{arg} ({self.loops[arg].var})"
+            elif op in JUMP_OPS:
+                detail = str(arg)
+            else:
+                detail = ""
+            lines.append(f"{pc:>6} {name:<20} {detail}".rstrip())
+        return "\n".join(lines)
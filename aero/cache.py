@@ -0,0 +1,95 @@
+import os
+import pickle
+import hashlib
+import secrets
+from array import array, _array_reconstructor
+from . import __version__, ast
+from .lexer import TokenType
+from .flat import _rebuild
+from .compiler import compile_source
+from .optimizer import optimize
+
+CACHE_DIR = "__aerocache__"
+# Bumped whenever the pickled AST changes shape within one Aero version
+CACHE_FORMAT = 5
+# The only globals a cached program refers to. A cache file may have been
+# planted next to a script, so loading one resolves nothing else and
+# therefore cannot run code.
+CACHE_GLOBALS = {(obj.__module__, obj.__name__): obj for obj in
+                 [TokenType, _rebuild, array, _array_reconstructor] +
+                 [cls for cls in vars(ast).values() if isinstance(cls, type) and issubclass(cls, ast.ASTNode)]}
+
+class _CacheUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        try:
+            return CACHE_GLOBALS[module, name]
+        except KeyError:
+            raise pickle.UnpicklingError(f"{module}.{name} is not allowed in a cached program") from None
+
+def source_hash(source):
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+def cache_path(filepath, opt_level, flat=False, inputs=()):
+    directory, filename = os.path.split(os.path.abspath(filepath))
+    suffix = ".flat" if flat else ""
+    if inputs and opt_level >= 2:
+        # -O2 infers types differently when the caller seeds some names
+        suffix = "-" + source_hash("\0".join(sorted(inputs)))[:16] + suffix
+    return os.path.join(directory, CACHE_DIR, f"{filename}.{__version__}-O{opt_level}{suffix}.aeroc")
+
+def load_cached(path, digest):
+    try:
+        with open(path, 'rb') as f:
+            entry = _CacheUnpickler(f).load()
+    except Exception:
+        # Missing, truncated, written by an incompatible build or not by
+        # Aero at all: recompile
+        return None
+    if not isinstance(entry, dict):
+        return None
+    if entry.get('version') != __version__ or entry.get('format') != CACHE_FORMAT:
+        return None
+    if entry.get('hash') != digest:
+        return None
+    return entry.get('program')
+
+def store_cached(path, digest, program):
+    entry = {'version': __version__, 'format': CACHE_FORMAT, 'hash': digest, 'program': program}
+    try:
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file of our own and rename it into place so that
+        # concurrent runs never observe a partially written entry. Unlike
+        # mkstemp's private files, it gets the mode open() would give it,
+        # so a cache written by one user (a deploy or CI job) can be read
+        # by others.
+        tmp_path = os.path.join(directory, f".tmp-{secrets.token_hex(8)}.aeroc")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except Exception:
+        # The cache is an optimization; read-only trees or oversized ASTs
+        # simply run uncached
+        return False
+    return True
+
+def compile_cached(filepath, opt_level=1, use_cache=True, flat=False, inputs=()):
+    # flat=True compiles to a FlatProgram, cached separately; its pickle is
+    # a handful of arrays, so even deeply nested programs can be cached.
+    # `inputs` are passed on to optimize.
+    with open(filepath, 'r') as f:
+        source = f.read()
+    if not use_cache:
+        return optimize(compile_source(source, filepath, flat), opt_level, inputs)
+    digest = source_hash(source)
+    path = cache_path(filepath, opt_level, flat, inputs)
+    program = load_cached(path, digest)
+    if program is None:
+        program = optimize(compile_source(source, filepath, flat), opt_level, inputs)
+        store_cached(path, digest, program)
+    return program
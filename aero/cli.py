@@ -1,20 +1,378 @@
+import os
 import sys
+import json
 import argparse
-from .compiler import compile_file
-from .vm import VirtualMachine
+import signal
+import time
+from .compiler import compile_program
+from .cache import compile_cached
+from .optimizer import optimize
+from .incremental import IncrementalParser
+from .vm import VirtualMachine, BytecodeVM
+from .closures import ClosureVM
+from .transpiler import PythonVM, PythonProgram
+from .ast import dump
+from .stream import run_stream_file
+from .output import Output
+from .runtime import BUILTIN_FUNCS
+from .profiler import ProfilingVM, Profile
+from .bench import main as bench_main
+from .program import CompiledProgram
+from .batch import BatchRunner
+from .build import build
+from .serve import Server, ProgramCache, DEFAULT_MAX_PROGRAMS
 
-def main():
-    parser = argparse.ArgumentParser(description="Aero Language Compiler & Runtime")
-    parser.add_argument("file", help="Aero source file (.aero)")
-    args = parser.parse_args()
+ENGINES = ("bytecode", "closure", "tree", "py")
+# Seconds between two checks of a watched script
+WATCH_INTERVAL = 0.2
+
+def _read_records(path):
+    with open(path, 'r') as f:
+        for number, line in enumerate(f, 1):
+            if line.strip():
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError(f"{path}:{number}: expected a JSON object")
+                yield record
+
+def run_many_main(argv):
+    parser = argparse.ArgumentParser(prog="aero run-many",
+                                     description="Run many scripts, or one set of scripts over many inputs, on all cores")
+    parser.add_argument("files", nargs="+", help="Aero source files")
+    parser.add_argument("--inputs", metavar="FILE",
+                        help="JSON Lines file of input variables; every script runs once per line, "
+                             "with the input names taken from the first line")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="runs sent to a worker at a time (default: 1 per script, 256 with --inputs)")
+    parser.add_argument("-O", dest="opt_level", type=int, choices=(0, 1, 2), default=1,
+                        help="AST optimization level (default: 1)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use __aerocache__")
+    parser.add_argument("--json", action="store_true",
+                        help="print one JSON object per run with its output, variables and error")
+    args = parser.parse_args(argv)
 
     try:
-        ast = compile_file(args.file)
-        vm = VirtualMachine()
-        vm.execute(ast)
+        records = None
+        names = ()
+        if args.inputs:
+            records = _read_records(args.inputs)
+            first = next(records, None)
+            if first is None:
+                return 0
+            names = tuple(first)
+            records = _prepend(first, records)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    # Scripts that fail to compile are reported and left out of the batch
+    failed = False
+    scripts = []
+    programs = []
+    for path in args.files:
+        try:
+            programs.append(CompiledProgram.from_file(path, names, args.opt_level, not args.no_cache))
+        except Exception as e:
+            print(f"Error in {path}: {e}", file=sys.stderr)
+            failed = True
+            continue
+        scripts.append(path)
+    if not programs:
+        return 1
+
+    # Jobs run record by record, every script per record, and come back in
+    # that order
+    if records is None:
+        jobs = ((index, None) for index in range(len(programs)))
+        chunksize = args.chunksize or 1
+    else:
+        jobs = ((index, record) for record in records for index in range(len(programs)))
+        chunksize = args.chunksize or 256
+
+    with BatchRunner(programs, args.jobs, chunksize) as runner:
+        for position, result in enumerate(runner.run(jobs)):
+            number, index = divmod(position, len(programs))
+            number = number + 1 if records is not None else None
+            script = scripts[index]
+            if args.json:
+                print(json.dumps({"script": script, "record": number, "output": result.output,
+                                  "variables": result.variables, "error": result.error}, default=_json_value))
+            else:
+                sys.stdout.write(result.output)
+            if result.error is not None:
+                failed = True
+                where = script if number is None else f"{script} (record {number})"
+                sys.stdout.flush()
+                print(f"Error in {where}: {result.error}", file=sys.stderr)
+    return 1 if failed else 0
+
+def _json_value(value):
+    # Variables can hold what JSON cannot: a builtin assigned with `f = len`
+    # is written as "<builtin len>", anything else by its type
+    if getattr(value, '__func__', None) is Output.print:
+        return "<builtin print>"
+    for name, func in BUILTIN_FUNCS.items():
+        if value is func:
+            return f"<builtin {name}>"
+    return f"<{type(value).__name__}>"
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+def build_main(argv):
+    parser = argparse.ArgumentParser(prog="aero build",
+                                     description="Compile every .aero file under a directory into __aerocache__")
+    parser.add_argument("directory", help="project root to search for .aero files")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("-O", dest="opt_level", type=int, choices=(0, 1, 2), default=1,
+                        help="AST optimization level (default: 1)")
+    parser.add_argument("--force", action="store_true", help="rebuild files even if they are unchanged")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.directory):
+        parser.error(f"not a directory: {args.directory}")
+
+    result = build(args.directory, args.opt_level, args.jobs, args.force)
+    for error in result.errors:
+        print(error, file=sys.stderr)
+    print(f"Built {result.built} files, {result.unchanged} unchanged, "
+          f"{len(result.errors)} failed in {result.elapsed:.2f}s")
+    return 1 if result.errors else 0
+
+def serve_main(argv):
+    parser = argparse.ArgumentParser(prog="aero serve",
+                                     description="Keep a warm interpreter running and execute scripts for aero "
+                                                 "commands sent over a Unix domain socket")
+    parser.add_argument("--socket", metavar="PATH", default=None,
+                        help="socket path (default: $AERO_SOCKET, else aero-<uid>.sock in $XDG_RUNTIME_DIR, "
+                             "else /tmp/aero-<uid>/aero.sock)")
+    parser.add_argument("--max-programs", type=int, default=DEFAULT_MAX_PROGRAMS,
+                        help=f"compiled programs kept in memory (default: {DEFAULT_MAX_PROGRAMS})")
+    args = parser.parse_args(argv)
+
+    programs = ProgramCache(args.max_programs)
+
+    def run(script_argv):
+        try:
+            return run_script(parse_script_args(script_argv), programs)
+        except SystemExit as e:
+            # argparse errors and --help
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code, file=sys.stderr)
+            return 1
+
+    def prepare(script_argv):
+        # Runs in the worker before the script. A program the daemon did not
+        # have cached, or not yet as bytecode, is compiled here and returned
+        # to the daemon for the runs after this one (see adopt)
+        args = parse_script_args(script_argv)
+        if args.stream or args.no_cache:
+            return None
+        key = programs.key(args.file, args.opt_level, args.flat_ast)
+        known = programs.get(key)
+        program = programs.load(args.file, args.opt_level, args.flat_ast)
+        fresh = program is not known
+        if args.engine == "bytecode" and not (args.dump_ast or args.dump_py or args.profile) and not program.compiled:
+            program.compile()
+            fresh = True
+        return (key, program) if fresh else None
+
+    def adopt(entry):
+        # Runs in the daemon with what a worker's prepare returned
+        programs.add(*entry)
+
+    server = Server(run, args.socket, prepare, adopt)
+    print(f"aero daemon listening on {server.path}", file=sys.stderr)
+    # Let `kill` stop the daemon the way Ctrl-C does, removing the socket
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
-        sys.exit(1)
+        return 1
+    return 0
+
+# Subcommands take precedence over a script of the same name; run such a
+# script with an explicit path (aero ./bench)
+COMMANDS = {
+    "bench": bench_main,
+    "run-many": run_many_main,
+    "build": build_main,
+    "serve": serve_main,
+}
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        sys.exit(COMMANDS[argv[0]](argv[1:]))
+    status = run_script(parse_script_args(argv))
+    if status:
+        sys.exit(status)
+
+def parse_script_args(argv):
+    parser = argparse.ArgumentParser(prog="aero", description="Aero Language Compiler & Runtime",
+                                     epilog="commands: aero build, aero run-many, aero bench, aero serve "
+                                            "(see aero <command> --help)")
+    parser.add_argument("file", help="Aero source file (.aero)")
+    parser.add_argument("--engine", choices=ENGINES, default="bytecode",
+                        help="execution engine (default: bytecode; 'tree' is the original AST walker, "
+                             "'py' compiles to Python code)")
+    parser.add_argument("-O", dest="opt_level", type=int, choices=(0, 1, 2), default=1,
+                        help="AST optimization level: -O0 off, -O1 folding and dead branches (default), -O2 also algebraic simplification")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="do not read or write compiled programs in __aerocache__")
+    parser.add_argument("--stream", action="store_true",
+                        help="lex, parse and run top-level statements incrementally with bounded memory (bytecode engine)")
+    parser.add_argument("--flat-ast", action="store_true",
+                        help="keep the parsed program in compact arrays instead of node objects (less memory for large scripts)")
+    parser.add_argument("-u", "--unbuffered", action="store_true",
+                        help="flush after every print even when stdout is not a terminal")
+    parser.add_argument("--no-quicken", action="store_true",
+                        help="do not specialize operation sites while running (bytecode engine)")
+    parser.add_argument("--quicken-stats", action="store_true",
+                        help="report quickened and specialized operation sites to stderr (bytecode engine)")
+    parser.add_argument("--dump-ast", action="store_true",
+                        help="print the optimized AST instead of running the program")
+    parser.add_argument("--dump-py", action="store_true",
+                        help="print the Python code the py engine generates instead of running the program")
+    parser.add_argument("--profile", action="store_true",
+                        help="run on the tree walker and report per-line and per-node timings to stderr")
+    parser.add_argument("--profile-out", metavar="FILE",
+                        help="with --profile, also write the profile as JSON (*.json) or collapsed stacks (any other name)")
+    parser.add_argument("--watch", action="store_true",
+                        help="run the script again whenever it changes, re-parsing only the edited statements")
+    args = parser.parse_args(argv)
+    if args.watch and (args.stream or args.flat_ast):
+        parser.error("--watch cannot be combined with --stream or --flat-ast")
+    if args.stream and (args.engine != "bytecode" or args.dump_ast or args.dump_py):
+        parser.error("--stream only runs on the bytecode engine and cannot be combined with --dump-ast or --dump-py")
+    if args.profile_out:
+        args.profile = True
+    if args.profile and (args.stream or args.dump_ast):
+        parser.error("--profile cannot be combined with --stream or --dump-ast")
+    return args
+
+def run_script(args, programs=None, ast=None):
+    # Returns the exit status. `programs` is the in-memory ProgramCache of
+    # a running `aero serve`; it is bypassed, like __aerocache__, with
+    # --no-cache. An optimized `ast` is run instead of the file's.
+    if args.watch and ast is None:
+        return watch_script(args)
+    output = Output(line_buffered=True if args.unbuffered else None)
+    program = None
+    vm = None
+    try:
+        if args.stream:
+            vm = BytecodeVM(output, quickening=not args.no_quicken)
+            run_stream_file(args.file, vm, opt_level=args.opt_level)
+            return 0
+        if ast is not None:
+            pass
+        elif programs is not None and not args.no_cache:
+            program = programs.load(args.file, args.opt_level, args.flat_ast)
+            ast = program.ast
+        else:
+            ast = compile_cached(args.file, args.opt_level, use_cache=not args.no_cache, flat=args.flat_ast)
+        if args.dump_ast:
+            print(dump(ast))
+            return 0
+        if args.dump_py:
+            sys.stdout.write(PythonProgram(ast, _read_source(args.file), args.file).annotated_source())
+            return 0
+        if args.profile:
+            run_profiled(ast, args.file, args.profile_out, output)
+        elif args.engine == "tree":
+            vm = VirtualMachine(output)
+            vm.execute(ast)
+        elif args.engine == "closure":
+            vm = ClosureVM(output)
+            vm.execute(ast)
+        elif args.engine == "py":
+            vm = PythonVM(output)
+            vm.execute(ast, _read_source(args.file), args.file)
+        else:
+            vm = BytecodeVM(output, quickening=not args.no_quicken)
+            vm.execute(program.code if program is not None else compile_program(ast))
+    except Exception as e:
+        print(f"Error: {e}{_location(e)}", file=sys.stderr)
+        return 1
+    finally:
+        if args.quicken_stats and isinstance(vm, BytecodeVM):
+            print(vm.stats.report(), file=sys.stderr)
+    return 0
+
+def watch_script(args, interval=WATCH_INTERVAL):
+    # Runs the script, then runs it again each time it is saved until
+    # Ctrl-C. Every version is parsed incrementally from the previous one
+    # (see IncrementalParser); the cache is not involved.
+    parser = IncrementalParser(args.file)
+    seen = None
+    print(f"Watching {args.file} (Ctrl-C to stop)", file=sys.stderr)
+    try:
+        while True:
+            source = None
+            try:
+                stat = os.stat(args.file)
+                if (stat.st_mtime_ns, stat.st_size) != seen:
+                    seen = (stat.st_mtime_ns, stat.st_size)
+                    source = _read_source(args.file)
+            except UnicodeDecodeError as e:
+                # A save caught halfway or a stray byte: report it and read
+                # the file again once it changes
+                print(f"Error: {e}", file=sys.stderr)
+            except OSError as e:
+                # Editors may replace the file rather than rewrite it, so it
+                # can be missing for a moment; only at the start is that fatal
+                if seen is None:
+                    print(f"Error: {e}", file=sys.stderr)
+                    return 1
+            if source is not None:
+                reparsed = parser.program is not None
+                try:
+                    ast, changed = parser.update(source)
+                except SyntaxError as e:
+                    print(f"Error: {e}", file=sys.stderr)
+                else:
+                    if reparsed:
+                        print(f"--- {args.file}: {len(changed)} statements changed", file=sys.stderr)
+                    try:
+                        run_script(args, ast=optimize(ast, args.opt_level))
+                    except Exception as e:
+                        # Undefined names are reported by optimize(); this
+                        # and anything else run_script lets through waits
+                        # for the next save, like a syntax error
+                        print(f"Error: {e}", file=sys.stderr)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return 0
+
+def _read_source(filepath):
+    with open(filepath, 'r') as f:
+        return f.read()
+
+def _location(error):
+    # Runtime errors the py engine traced back to a line; a SyntaxError
+    # already names its line in its message
+    if isinstance(error, SyntaxError) or getattr(error, 'lineno', None) is None:
+        return ""
+    return f" ({os.path.basename(error.filename)}, line {error.lineno})"
+
+def run_profiled(ast, filepath, profile_path=None, output=None):
+    source = _read_source(filepath)
+    vm = ProfilingVM(output)
+    try:
+        vm.execute(ast)
+    finally:
+        # A failing program still gets the profile up to the error
+        profile = Profile(vm, source, os.path.basename(filepath))
+        print(profile.report(), file=sys.stderr)
+        if profile_path:
+            profile.write(profile_path)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,120 @@
+import os
+import sys
+import socket
+import struct
+from . import __version__
+
+# Entry point of the `aero` command. Script runs go to a running
+# `aero serve` when there is one and run in this process otherwise; the
+# heavy modules are only imported on the fallback path, so a daemon run
+# costs little more than interpreter startup.
+
+# Messages in both directions are frames: a type byte, the payload length
+# and the payload. The client sends one REQUEST frame holding the Aero
+# version, its working directory, whether its stdout is a terminal and then
+# the command line arguments, separated by NUL characters. The server
+# answers with an ACCEPTED frame, then STDOUT and STDERR frames and a final
+# EXIT frame holding the exit status; or with a single REFUSED frame.
+FRAME_HEADER = struct.Struct(">cI")
+REQUEST = b'q'
+ACCEPTED = b'a'
+STDOUT = b'o'
+STDERR = b'e'
+EXIT = b'x'
+REFUSED = b'r'
+
+# Subcommands always run in the client's own process, and so do scripts
+# with options that never finish on their own
+LOCAL_COMMANDS = frozenset({"bench", "run-many", "build", "serve"})
+LOCAL_OPTIONS = frozenset({"--watch"})
+# Seconds to wait for a daemon to accept a run before running in-process
+CONNECT_TIMEOUT = 2
+# pid, uid and gid of a socket's peer
+PEER_CREDENTIALS = struct.Struct("3i")
+
+def runs_locally(argv):
+    return bool(argv) and (argv[0] in LOCAL_COMMANDS or not LOCAL_OPTIONS.isdisjoint(argv))
+
+def default_socket_path():
+    path = os.environ.get("AERO_SOCKET")
+    if path:
+        return path
+    directory = os.environ.get("XDG_RUNTIME_DIR")
+    if directory:
+        return os.path.join(directory, f"aero-{os.getuid()}.sock")
+    return os.path.join(shared_socket_directory(), "aero.sock")
+
+def shared_socket_directory():
+    # Without a runtime directory the socket goes in /tmp, inside a
+    # directory only its owner can enter (see Server)
+    return f"/tmp/aero-{os.getuid()}"
+
+def _owned_by_user(sock, path):
+    # Whether the daemon runs as this user: it reads our files and we print
+    # whatever it sends
+    if hasattr(socket, 'SO_PEERCRED'):
+        credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CREDENTIALS.size)
+        return PEER_CREDENTIALS.unpack(credentials)[1] == os.getuid()
+    return os.stat(path).st_uid == os.getuid()
+
+def recv_frame(sock):
+    kind, size = FRAME_HEADER.unpack(_recv_exactly(sock, FRAME_HEADER.size))
+    return kind, _recv_exactly(sock, size).decode() if size else ""
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("aero daemon closed the connection")
+        data += chunk
+    return data
+
+def run_in_daemon(argv, path=None, timeout=CONNECT_TIMEOUT):
+    # Returns the exit status of the run, or None when no daemon of this
+    # user accepted it within `timeout` seconds
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+    path = path or default_socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            if not _owned_by_user(sock, path):
+                return None
+            fields = [__version__, os.getcwd(), "1" if sys.stdout.isatty() else ""] + argv
+            request = "\0".join(fields).encode()
+            sock.sendall(FRAME_HEADER.pack(REQUEST, len(request)) + request)
+            if recv_frame(sock)[0] != ACCEPTED:
+                return None
+        except OSError:
+            return None
+        # Scripts may run for as long as they like once accepted
+        sock.settimeout(None)
+        while True:
+            kind, payload = recv_frame(sock)
+            if kind == STDOUT:
+                sys.stdout.write(payload)
+                sys.stdout.flush()
+            elif kind == STDERR:
+                sys.stderr.write(payload)
+                sys.stderr.flush()
+            elif kind == EXIT:
+                return int(payload)
+    except ConnectionError as e:
+        sys.stdout.flush()
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        sock.close()
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and not runs_locally(argv) and not os.environ.get("AERO_NO_DAEMON"):
+        status = run_in_daemon(argv)
+        if status is not None:
+            sys.exit(status)
+    from .cli import main as cli_main
+    cli_main(argv)
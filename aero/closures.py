@@ -0,0 +1,331 @@
+from .lexer import TokenType
+from .ast import *
+from .runtime import BINARY_FUNCS, BUILTIN_FUNCS, UNBOUND, concat, make_array, subscript
+from .resolver import resolve
+from .loops import counted_range, closed_form
+from .output import make_output
+
+class ClosureCompiler:
+    # Turns each AST node into a zero-argument Python callable once, so that
+    # running the program never inspects node types or operators again.
+    # Variables are resolved to indexes into the `slots` list and builtins
+    # are bound as constants; the closures stay tied to both.
+    def __init__(self, slots, builtins):
+        self.slots = slots
+        self.builtins = builtins
+        self.scope = None
+
+    def compile(self, program):
+        if not isinstance(program, Program):
+            raise TypeError("Expected Program AST node")
+        self.scope = resolve(program, self.builtins)
+        self.slots[:] = [self.builtins.get(name, UNBOUND) for name in self.scope.names]
+        return self._block(program.statements)
+
+    def _unbound(self, index):
+        raise NameError(f"Undefined name: {self.scope.names[index]}")
+
+    def _statement(self, node):
+        # Compiles without recursion on nesting depth: a compound statement
+        # is pushed again as (node, chain) to be built once its nested
+        # statements are, which `built` holds in order. An else-if chain is
+        # built as one closure testing its conditions in turn, so running it
+        # does not nest a call per `else if` either.
+        pending = [node]
+        built = []
+        while pending:
+            node = pending.pop()
+            if type(node) is tuple:
+                node, chain = node
+                if isinstance(node, Block):
+                    built.append(self._sequence(self._take(built, len(node.statements))))
+                elif isinstance(node, If):
+                    else_branch = built.pop() if chain[-1].else_branch else None
+                    branches = self._take(built, len(chain))
+                    built.append(self._if([self._condition(link.condition) for link in chain], branches, else_branch))
+                elif isinstance(node, CountedWhile):
+                    increment = built.pop()
+                    built.append(self._counted_while(node, self._sequence(self._take(built, len(node.statements))),
+                                                     increment))
+                else:
+                    built.append(self._while(node, built.pop()))
+            elif isinstance(node, Assign):
+                built.append(self._assign(node))
+            elif isinstance(node, Block):
+                pending.append((node, None))
+                pending.extend(reversed(node.statements))
+            elif isinstance(node, If):
+                chain = [node]
+                while isinstance(chain[-1].else_branch, If):
+                    chain.append(chain[-1].else_branch)
+                pending.append((node, chain))
+                if chain[-1].else_branch:
+                    pending.append(chain[-1].else_branch)
+                pending.extend(reversed([link.then_branch for link in chain]))
+            elif isinstance(node, CountedWhile):
+                pending.append((node, None))
+                pending.append(node.body.statements[-1] if isinstance(node.body, Block) else node.body)
+                pending.extend(reversed(node.statements))
+            elif isinstance(node, While):
+                pending.append((node, None))
+                pending.append(node.body)
+            else:
+                built.append(self._expression(node))
+        return built[0]
+
+    def _take(self, built, count):
+        # The last `count` closures in `built`, removed from it
+        taken = tuple(built[len(built) - count:])
+        del built[len(built) - count:]
+        return taken
+
+    def _block(self, statements):
+        return self._sequence(tuple(self._statement(stmt) for stmt in statements))
+
+    def _sequence(self, compiled):
+        if len(compiled) == 1:
+            return compiled[0]
+
+        def run_block():
+            for stmt in compiled:
+                stmt()
+        return run_block
+
+    def _assign(self, node):
+        slots = self.slots
+        index = self.scope.slots[node.name]
+        value = node.value
+        if isinstance(value, (Number, String, Bool)):
+            const = value.value
+
+            def assign_const():
+                slots[index] = const
+            return assign_const
+
+        compute = self._expression(value)
+
+        def assign():
+            slots[index] = compute()
+        return assign
+
+    def _if(self, conditions, branches, else_branch):
+        if len(conditions) > 1:
+            arms = tuple(zip(conditions, branches))
+
+            def run_else_if():
+                for condition, branch in arms:
+                    if condition():
+                        branch()
+                        return
+                if else_branch is not None:
+                    else_branch()
+            return run_else_if
+
+        condition, then_branch = conditions[0], branches[0]
+        if else_branch is None:
+            def run_if():
+                if condition():
+                    then_branch()
+            return run_if
+
+        def run_if_else():
+            if condition():
+                then_branch()
+            else:
+                else_branch()
+        return run_if_else
+
+    def _while(self, node, body):
+        condition = self._condition(node.condition)
+
+        def run_while():
+            while condition():
+                body()
+        return run_while
+
+    def _counted_while(self, node, body, increment):
+        # The plain loop is only needed when the values are not ints; it
+        # reuses the compiled body and adds the increment back
+        slots = self.slots
+        slot_map = self.scope.slots
+        index = slot_map[node.var]
+        bound = self._expression(node.bound)
+        condition = self._condition(node.condition)
+        op, step = node.op, node.step
+        closed = node.accumulators is not None
+
+        def read(name):
+            return slots[slot_map[name]] if name in slot_map else UNBOUND
+
+        def run_counted():
+            start = slots[index]
+            if type(start) is int:
+                limit = bound()
+                if type(limit) is int:
+                    span = counted_range(op, start, limit, step)
+                    final = start + len(span) * step
+                    values = closed_form(node, span, read) if closed else None
+                    if values is not None:
+                        for name, value in values.items():
+                            slots[slot_map[name]] = value
+                    else:
+                        for value in span:
+                            slots[index] = value
+                            body()
+                    slots[index] = final
+                    return
+            while condition():
+                body()
+                increment()
+        return run_counted
+
+    def _expression(self, node):
+        if isinstance(node, (Number, String, Bool)):
+            const = node.value
+            return lambda: const
+        elif isinstance(node, Identifier):
+            return self._identifier(node.name)
+        elif isinstance(node, BinaryOp):
+            return self._binary(node)
+        elif isinstance(node, Call):
+            return self._call(node)
+        elif isinstance(node, Index):
+            value, index = self._expression(node.value), self._expression(node.index)
+            return lambda: subscript(value(), index())
+        elif isinstance(node, Array):
+            elements = tuple(self._expression(element) for element in node.elements)
+            return lambda: make_array([element() for element in elements])
+        raise RuntimeError(f"Unknown AST node: {type(node)}")
+
+    def _identifier(self, name):
+        if name not in self.scope.slots:
+            builtin = self.builtins[name]
+            return lambda: builtin
+        slots = self.slots
+        index = self.scope.slots[name]
+        unbound = self._unbound
+
+        def load():
+            value = slots[index]
+            if value is UNBOUND:
+                unbound(index)
+            return value
+        return load
+
+    def _condition(self, node):
+        # Conditions only need truthiness, so && and || chain the operand
+        # tests directly instead of building a bool first
+        if isinstance(node, BinaryOp) and node.op == TokenType.AND:
+            left, right = self._condition(node.left), self._condition(node.right)
+            return lambda: left() and right()
+        if isinstance(node, BinaryOp) and node.op == TokenType.OR:
+            left, right = self._condition(node.left), self._condition(node.right)
+            return lambda: left() or right()
+        return self._expression(node)
+
+    def _binary(self, node):
+        if node.op == TokenType.AND:
+            left, right = self._condition(node.left), self._condition(node.right)
+            return lambda: bool(left() and right())
+        if node.op == TokenType.OR:
+            left, right = self._condition(node.left), self._condition(node.right)
+            return lambda: bool(left() or right())
+        if node.op not in BINARY_FUNCS:
+            raise RuntimeError(f"Unsupported operator: {node.op}")
+        left, right = node.left, node.right
+        if self._is_variable(left) and isinstance(right, (Number, String, Bool)):
+            return self._binary_slot_const(node.op, self.scope.slots[left.name], right.value)
+        if self._is_variable(left) and self._is_variable(right):
+            return self._binary_slot_slot(node.op, self.scope.slots[left.name], self.scope.slots[right.name])
+        if isinstance(right, (Number, String, Bool)):
+            return self._binary_expr_const(node.op, self._expression(left), right.value)
+        return self._binary_expr_expr(node.op, self._expression(left), self._expression(right))
+
+    def _is_variable(self, node):
+        return isinstance(node, Identifier) and node.name in self.scope.slots
+
+    def _binary_slot_const(self, op, index, const):
+        slots = self.slots
+        unbound = self._unbound
+        if op == TokenType.PLUS and not isinstance(const, str):
+            def add_slot_const():
+                value = slots[index]
+                if value is UNBOUND:
+                    unbound(index)
+                if isinstance(value, str):
+                    return concat(value, const)
+                return value + const
+            return add_slot_const
+
+        func = BINARY_FUNCS[op]
+        if op == TokenType.PLUS:
+            func = concat
+
+        def binary_slot_const():
+            value = slots[index]
+            if value is UNBOUND:
+                unbound(index)
+            return func(value, const)
+        return binary_slot_const
+
+    def _binary_slot_slot(self, op, left_index, right_index):
+        slots = self.slots
+        unbound = self._unbound
+        func = BINARY_FUNCS[op]
+
+        def binary_slot_slot():
+            left = slots[left_index]
+            if left is UNBOUND:
+                unbound(left_index)
+            right = slots[right_index]
+            if right is UNBOUND:
+                unbound(right_index)
+            return func(left, right)
+        return binary_slot_slot
+
+    def _binary_expr_const(self, op, left, const):
+        func = BINARY_FUNCS[op]
+        return lambda: func(left(), const)
+
+    def _binary_expr_expr(self, op, left, right):
+        func = BINARY_FUNCS[op]
+        return lambda: func(left(), right())
+
+    def _call(self, node):
+        func = self._expression(node.func)
+        args = tuple(self._expression(arg) for arg in node.args)
+        callee = getattr(node.func, 'name', type(node.func).__name__)
+
+        def call():
+            target = func()
+            values = [arg() for arg in args]
+            if callable(target):
+                return target(*values)
+            raise RuntimeError(f"{callee} is not callable")
+        return call
+
+class ClosureVM:
+    def __init__(self, output=None):
+        self.output = make_output(output)
+        self.globals = dict(BUILTIN_FUNCS, print=self.output.print)
+        self.slots = []
+        self.scope = None
+
+    @property
+    def variables(self):
+        if self.scope is None:
+            return {}
+        return self.scope.variables(self.slots)
+
+    def compile(self, program):
+        compiler = ClosureCompiler(self.slots, self.globals)
+        run = compiler.compile(program)
+        self.scope = compiler.scope
+        return run
+
+    def execute(self, program):
+        run = self.compile(program)
+        try:
+            run()
+        finally:
+            self.output.flush()
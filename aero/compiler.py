@@ -1,10 +1,264 @@
-from .lexer import Lexer
+from .lexer import Lexer, TokenType, locate
 from .parser import Parser
+from .ast import *
+from .flat import FlatProgram
+from .bytecode import *
+from .resolver import resolve, Scope
+from .runtime import BUILTIN_NAMES
 
-def compile_file(filepath):
+def compile_source(source, filename=None, flat=False):
+    # With flat=True the result is a FlatProgram, built one top-level
+    # statement at a time
+    try:
+        parser = Parser(Lexer(source).tokenize())
+        if flat:
+            return FlatProgram(parser.parse_statements())
+        return parser.parse()
+    except SyntaxError as e:
+        raise locate(e, source, filename)
+
+def compile_file(filepath, flat=False):
     with open(filepath, 'r') as f:
         source = f.read()
-    lexer = Lexer(source)
-    tokens = lexer.tokenize()
-    parser = Parser(tokens)
-    return parser.parse()
+    return compile_source(source, filepath, flat)
+
+def compile_program(program, scope=None, inputs=(), builtins=BUILTIN_NAMES, cooperative=False):
+    return Compiler(scope, inputs, builtins, cooperative).compile(program)
+
+BINARY_OPCODES = {
+    TokenType.PLUS: BINARY_ADD,
+    TokenType.MINUS: BINARY_SUB,
+    TokenType.STAR: BINARY_MUL,
+    TokenType.SLASH: BINARY_DIV,
+    TokenType.PERCENT: BINARY_MOD,
+    TokenType.EQUAL: COMPARE_EQ,
+    TokenType.NOT_EQUAL: COMPARE_NE,
+    TokenType.LESS: COMPARE_LT,
+    TokenType.LESS_EQUAL: COMPARE_LE,
+    TokenType.GREATER: COMPARE_GT,
+    TokenType.GREATER_EQUAL: COMPARE_GE,
+}
+
+# Fused branch that is taken when the comparison does NOT hold
+COMPARE_JUMPS = {
+    TokenType.EQUAL: JUMP_IF_NOT_EQ,
+    TokenType.NOT_EQUAL: JUMP_IF_NOT_NE,
+    TokenType.LESS: JUMP_IF_NOT_LT,
+    TokenType.LESS_EQUAL: JUMP_IF_NOT_LE,
+    TokenType.GREATER: JUMP_IF_NOT_GT,
+    TokenType.GREATER_EQUAL: JUMP_IF_NOT_GE,
+}
+
+NEGATED_COMPARISONS = {
+    TokenType.EQUAL: TokenType.NOT_EQUAL,
+    TokenType.NOT_EQUAL: TokenType.EQUAL,
+    TokenType.LESS: TokenType.GREATER_EQUAL,
+    TokenType.LESS_EQUAL: TokenType.GREATER,
+    TokenType.GREATER: TokenType.LESS_EQUAL,
+    TokenType.GREATER_EQUAL: TokenType.LESS,
+}
+
+# What is left to emit once a nested statement has been compiled
+_ELSE, _PATCH, _LOOP_TEST, _RANGE_NEXT = range(4)
+
+class Compiler:
+    # Given a shared `scope`, programs are compiled incrementally: names get
+    # slots as they first appear and the Code refers to the live name lists,
+    # so a VM can keep running statement after statement in one slot array.
+    # `inputs` names variables the caller seeds before the program runs;
+    # they take the first slots, in order. `builtins` are the names the VM
+    # will provide. Cooperative code also has YIELD_POINT and AWAIT
+    # instructions, so that it can be suspended (see aero.asyncvm).
+    def __init__(self, scope=None, inputs=(), builtins=BUILTIN_NAMES, cooperative=False):
+        self.instructions = []
+        self.constants = []
+        self.calls = []
+        self.loops = []
+        self.scope = scope
+        self.inputs = tuple(inputs)
+        self.builtins = builtins
+        self.cooperative = cooperative
+        self._const_index = {}
+
+    def compile(self, program):
+        if not isinstance(program, Program):
+            raise TypeError("Expected Program AST node")
+        if self.scope is None:
+            self.scope = resolve(program, self.builtins, Scope(self.inputs))
+            names, builtins = tuple(self.scope.names), tuple(self.scope.builtins)
+        else:
+            resolve(program, self.builtins, self.scope, strict=False)
+            names, builtins = self.scope.names, self.scope.builtins
+        for stmt in program.statements:
+            self._compile_statement(stmt)
+        return Code(self.instructions, tuple(self.constants), names, builtins, tuple(self.calls), tuple(self.loops),
+                    self.cooperative)
+
+    def _emit(self, op, arg=0):
+        self.instructions.append(op)
+        self.instructions.append(arg)
+        return len(self.instructions) - 2
+
+    def _patch(self, pc, target):
+        self.instructions[pc + 1] = target
+
+    def _patch_here(self, jumps):
+        for pc in jumps:
+            self._patch(pc, len(self.instructions))
+
+    def _yield_point(self):
+        return self._emit(YIELD_POINT) if self.cooperative else None
+
+    def _patch_yield_point(self, pc):
+        # Charge the instructions from the yield point to the loop's end
+        if pc is not None:
+            self._patch(pc, (len(self.instructions) - pc) // 2)
+
+    def _constant(self, value):
+        # Key on the type as well so that 1, True and "1" stay distinct
+        key = (type(value), value)
+        if key not in self._const_index:
+            self._const_index[key] = len(self.constants)
+            self.constants.append(value)
+        return self._const_index[key]
+
+    def _compile_statement(self, node):
+        # Compiles without recursion on nesting depth: `pending` holds the
+        # statements still to compile, next one last, along with what has
+        # to be emitted once an if's branch or a loop's body is done, as
+        # (kind, ...) tuples, so else-if chains and nested blocks can be as
+        # deep as the parser lets them
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            if type(node) is tuple:
+                kind = node[0]
+                if kind == _ELSE:
+                    _, jumps_else, else_branch = node
+                    jump_end = self._emit(JUMP)
+                    self._patch_here(jumps_else)
+                    pending.append((_PATCH, [jump_end]))
+                    pending.append(else_branch)
+                elif kind == _PATCH:
+                    self._patch_here(node[1])
+                elif kind == _LOOP_TEST:
+                    _, jump_test, body, condition, yield_point = node
+                    self._patch_here([jump_test])
+                    for pc in self._compile_jump(condition, True):
+                        self._patch(pc, body)
+                    self._patch_yield_point(yield_point)
+                else:
+                    _, loop, index, yield_point = node
+                    loop.next_pc = self._emit(FOR_RANGE_NEXT, index)
+                    self._patch_yield_point(yield_point)
+            elif isinstance(node, Assign):
+                self._compile_expression(node.value)
+                self._emit(STORE_SLOT, self.scope.slots[node.name])
+            elif isinstance(node, Block):
+                pending.extend(reversed(node.statements))
+            elif isinstance(node, If):
+                jumps_else = self._compile_jump(node.condition, False)
+                if node.else_branch:
+                    pending.append((_ELSE, jumps_else, node.else_branch))
+                else:
+                    pending.append((_PATCH, jumps_else))
+                pending.append(node.then_branch)
+            elif isinstance(node, CountedWhile):
+                self._compile_counted_loop(node, pending)
+            elif isinstance(node, While):
+                # The test sits after the body so each iteration takes a single
+                # (fused) branch back to the top
+                jump_test = self._emit(JUMP)
+                body = len(self.instructions)
+                yield_point = self._yield_point()
+                pending.append((_LOOP_TEST, jump_test, body, node.condition, yield_point))
+                pending.append(node.body)
+            else:
+                self._compile_expression(node)
+                self._emit(POP_TOP)
+
+    def _compile_counted_loop(self, node, pending):
+        # The body is compiled once; FOR_RANGE_NEXT runs either the range
+        # iteration or, for values that are not ints, the increment and test
+        # of the original loop. The body's statements go on `pending`.
+        slots = self.scope.slots
+        self._emit(LOAD_SLOT, slots[node.var])
+        self._compile_expression(node.bound)
+        read_slots = {}
+        if node.accumulators is not None:
+            for name, _, operand in node.accumulators:
+                read_slots[name] = slots[name]
+                if isinstance(operand, Identifier) and operand.name in slots:
+                    read_slots[operand.name] = slots[operand.name]
+        loop = CountedLoop(slots[node.var], node.op, node.step, node.var, node.accumulators, read_slots)
+        index = len(self.loops)
+        self.loops.append(loop)
+        self._emit(FOR_RANGE_SETUP, index)
+        loop.body_pc = len(self.instructions)
+        yield_point = self._yield_point()
+        pending.append((_RANGE_NEXT, loop, index, yield_point))
+        pending.extend(reversed(node.statements))
+
+    def _compile_expression(self, node):
+        if isinstance(node, (Number, String, Bool)):
+            self._emit(LOAD_CONST, self._constant(node.value))
+        elif isinstance(node, Identifier):
+            if node.name in self.scope.slots:
+                self._emit(LOAD_SLOT, self.scope.slots[node.name])
+            else:
+                self._emit(LOAD_BUILTIN, self.scope.builtin_slots[node.name])
+        elif isinstance(node, BinaryOp):
+            if node.op in (TokenType.AND, TokenType.OR):
+                # Short-circuit: the right operand only runs when needed
+                self._compile_expression(node.left)
+                op = JUMP_IF_FALSE_OR_POP if node.op == TokenType.AND else JUMP_IF_TRUE_OR_POP
+                jump = self._emit(op)
+                self._compile_expression(node.right)
+                self._emit(TO_BOOL)
+                self._patch_here([jump])
+                return
+            if node.op not in BINARY_OPCODES:
+                raise RuntimeError(f"Unsupported operator: {node.op}")
+            self._compile_expression(node.left)
+            self._compile_expression(node.right)
+            self._emit(BINARY_OPCODES[node.op])
+        elif isinstance(node, Call):
+            self._compile_expression(node.func)
+            for arg in node.args:
+                self._compile_expression(arg)
+            callee = getattr(node.func, 'name', type(node.func).__name__)
+            self.calls.append((len(node.args), callee))
+            self._emit(CALL, len(self.calls) - 1)
+            if self.cooperative:
+                self._emit(AWAIT)
+        elif isinstance(node, Array):
+            for element in node.elements:
+                self._compile_expression(element)
+            self._emit(BUILD_ARRAY, len(node.elements))
+        elif isinstance(node, Index):
+            self._compile_expression(node.value)
+            self._compile_expression(node.index)
+            self._emit(BINARY_INDEX)
+        else:
+            raise RuntimeError(f"Unknown AST node: {type(node)}")
+
+    def _compile_jump(self, node, jump_if):
+        # Emit a test of `node` that jumps when its truthiness equals
+        # `jump_if` and falls through otherwise. Returns the jump
+        # instructions for the caller to patch with the target.
+        if isinstance(node, BinaryOp) and node.op in (TokenType.AND, TokenType.OR):
+            if (node.op == TokenType.AND) != jump_if:
+                # false && ... jumps on false, true || ... jumps on true:
+                # either operand can take the branch on its own
+                return self._compile_jump(node.left, jump_if) + self._compile_jump(node.right, jump_if)
+            skip = self._compile_jump(node.left, not jump_if)
+            jumps = self._compile_jump(node.right, jump_if)
+            self._patch_here(skip)
+            return jumps
+        if isinstance(node, BinaryOp) and node.op in COMPARE_JUMPS:
+            self._compile_expression(node.left)
+            self._compile_expression(node.right)
+            op = node.op if not jump_if else NEGATED_COMPARISONS[node.op]
+            return [self._emit(COMPARE_JUMPS[op])]
+        self._compile_expression(node)
+        return [self._emit(POP_JUMP_IF_TRUE if jump_if else POP_JUMP_IF_FALSE)]
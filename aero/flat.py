@@ -0,0 +1,288 @@
+from array import array
+from .ast import *
+from .lexer import TokenType
+from .loops import match_counted_loop
+
+# Node kinds of a FlatProgram and the meaning of their operands:
+#   NUMBER, STRING   a: index into constants
+#   BOOL             a: 0 or 1
+#   IDENTIFIER       a: index into names
+#   BINARY_OP        a: operator (index into OPERATORS), b: left, c: right
+#   CALL             a: callee, b: first argument in children, c: count
+#   ASSIGN           a: index into names, b: value
+#   BLOCK            b: first statement in children, c: count
+#   IF               a: condition, b: then branch, c: else branch or NONE
+#   WHILE            a: condition, b: body
+#   COUNTED_WHILE    as WHILE; rebuilt with match_counted_loop
+#   ARRAY            b: first element in children, c: count
+#   INDEX            a: value, b: index
+(NUMBER, STRING, BOOL, IDENTIFIER, BINARY_OP, CALL, ASSIGN, BLOCK, IF, WHILE, COUNTED_WHILE,
+ ARRAY, INDEX) = range(13)
+NONE = -1
+
+OPERATORS = tuple(TokenType)
+OPERATOR_CODES = {op: code for code, op in enumerate(OPERATORS)}
+
+class FlatProgram(Program):
+    # A Program stored as struct-of-arrays instead of one object per node:
+    # node i is kinds[i] with operands a[i], b[i] and c[i] (node indexes,
+    # table indexes or counts, see above) and source offsets starts[i] and
+    # ends[i] (NONE for expressions). Children always precede their parent.
+    # Literals and names are stored once each in `constants` and `names`.
+    #
+    # `statements` is a sequence view that builds the AST of a top-level
+    # statement each time it is read, so the engines, resolver and compiler
+    # run a FlatProgram unchanged while only one statement is ever held as
+    # objects. Rebuilt nodes are fresh copies: changing them does not change
+    # the program.
+    __slots__ = ('kinds', 'a', 'b', 'c', 'starts', 'ends', 'children', 'roots',
+                 'constants', 'names', '_constant_index', '_name_index')
+
+    def __init__(self, statements=()):
+        self.pos = self.end = None
+        self.kinds = array('B')
+        self.a = array('i')
+        self.b = array('i')
+        self.c = array('i')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.children = array('i')
+        self.roots = array('i')
+        self.constants = []
+        self.names = []
+        self._constant_index = {}
+        self._name_index = {}
+        self.extend(statements)
+
+    def __reduce__(self):
+        return (_rebuild, (self.kinds, self.a, self.b, self.c, self.starts, self.ends, self.children,
+                           self.roots, self.constants, self.names))
+
+    @property
+    def node_count(self):
+        return len(self.kinds)
+
+    @property
+    def statements(self):
+        return StatementView(self)
+
+    def append(self, stmt):
+        self.roots.append(self._add(stmt))
+
+    def extend(self, statements):
+        for stmt in statements:
+            self.append(stmt)
+
+    def _constant(self, value):
+        key = (type(value), value)
+        index = self._constant_index.get(key)
+        if index is None:
+            index = self._constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def _name(self, name):
+        index = self._name_index.get(name)
+        if index is None:
+            index = self._name_index[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+    def _node(self, kind, node, a=0, b=0, c=0):
+        self.kinds.append(kind)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+        if node.pos is None:
+            self.starts.append(NONE)
+            self.ends.append(NONE)
+        else:
+            self.starts.append(node.pos)
+            self.ends.append(node.end)
+        return len(self.kinds) - 1
+
+    def _add(self, node):
+        # Adds `node` and everything below it, children first, from an
+        # explicit stack so that deep trees need no deep recursion. A node
+        # with children is pushed again as (node, name) to be added once
+        # they are; `added` holds the indexes of finished nodes its parent
+        # has not taken yet.
+        pending = [node]
+        added = []
+        while pending:
+            node = pending.pop()
+            if type(node) is tuple:
+                node, name = node
+                added.append(self._add_parent(node, name, added))
+            elif isinstance(node, Number):
+                added.append(self._node(NUMBER, node, self._constant(node.value)))
+            elif isinstance(node, String):
+                added.append(self._node(STRING, node, self._constant(node.value)))
+            elif isinstance(node, Bool):
+                added.append(self._node(BOOL, node, int(node.value)))
+            elif isinstance(node, Identifier):
+                added.append(self._node(IDENTIFIER, node, self._name(node.name)))
+            else:
+                if isinstance(node, BinaryOp):
+                    children = (node.left, node.right)
+                elif isinstance(node, Call):
+                    children = [node.func] + node.args
+                elif isinstance(node, Array):
+                    children = node.elements
+                elif isinstance(node, Index):
+                    children = (node.value, node.index)
+                elif isinstance(node, Assign):
+                    children = (node.value,)
+                elif isinstance(node, Block):
+                    children = node.statements
+                elif isinstance(node, If):
+                    children = (node.condition, node.then_branch, node.else_branch)
+                    if node.else_branch is None:
+                        children = children[:2]
+                elif isinstance(node, While):
+                    children = (node.condition, node.body)
+                else:
+                    raise RuntimeError(f"Unknown AST node: {type(node)}")
+                pending.append((node, self._name(node.name) if isinstance(node, Assign) else None))
+                pending.extend(reversed(children))
+        return added[0]
+
+    def _add_parent(self, node, name, added):
+        # Adds a node whose children are the last indexes in `added`
+        if isinstance(node, BinaryOp):
+            right = added.pop()
+            return self._node(BINARY_OP, node, OPERATOR_CODES[node.op], added.pop(), right)
+        elif isinstance(node, Call):
+            start, count = self._sequence(added, len(node.args))
+            return self._node(CALL, node, added.pop(), start, count)
+        elif isinstance(node, Array):
+            start, count = self._sequence(added, len(node.elements))
+            return self._node(ARRAY, node, 0, start, count)
+        elif isinstance(node, Index):
+            index = added.pop()
+            return self._node(INDEX, node, added.pop(), index)
+        elif isinstance(node, Assign):
+            return self._node(ASSIGN, node, name, added.pop())
+        elif isinstance(node, Block):
+            start, count = self._sequence(added, len(node.statements))
+            return self._node(BLOCK, node, 0, start, count)
+        elif isinstance(node, If):
+            else_branch = added.pop() if node.else_branch is not None else NONE
+            then_branch = added.pop()
+            return self._node(IF, node, added.pop(), then_branch, else_branch)
+        body = added.pop()
+        return self._node(COUNTED_WHILE if isinstance(node, CountedWhile) else WHILE, node, added.pop(), body)
+
+    def _sequence(self, added, count):
+        # Moves the last `count` indexes in `added` to `children`
+        start = len(self.children)
+        if count:
+            self.children.extend(added[-count:])
+            del added[-count:]
+        return start, count
+
+    def node(self, index):
+        # The AST of node `index`, rebuilt from the columns; like _add, from
+        # an explicit stack, with `built` holding finished children
+        kinds, a, b, c, children = self.kinds, self.a, self.b, self.c, self.children
+        pending = [index]
+        built = []
+        while pending:
+            index = pending.pop()
+            if index < 0:
+                # All children of node ~index are built
+                index = ~index
+                kind = kinds[index]
+                if kind == BINARY_OP:
+                    right = built.pop()
+                    node = BinaryOp(OPERATORS[a[index]], built.pop(), right)
+                elif kind == CALL:
+                    args = self._built(built, c[index])
+                    node = Call(built.pop(), args)
+                elif kind == ARRAY:
+                    node = Array(self._built(built, c[index]))
+                elif kind == INDEX:
+                    key = built.pop()
+                    node = Index(built.pop(), key)
+                elif kind == ASSIGN:
+                    node = Assign(self.names[a[index]], built.pop())
+                elif kind == BLOCK:
+                    node = Block(self._built(built, c[index]))
+                elif kind == IF:
+                    else_branch = built.pop() if c[index] != NONE else None
+                    then_branch = built.pop()
+                    node = If(built.pop(), then_branch, else_branch)
+                else:
+                    body = built.pop()
+                    node = While(built.pop(), body)
+                    if kind == COUNTED_WHILE:
+                        node = match_counted_loop(node) or node
+            else:
+                kind = kinds[index]
+                if kind == NUMBER:
+                    node = Number(self.constants[a[index]])
+                elif kind == STRING:
+                    node = String(self.constants[a[index]])
+                elif kind == BOOL:
+                    node = Bool(bool(a[index]))
+                elif kind == IDENTIFIER:
+                    node = Identifier(self.names[a[index]])
+                else:
+                    pending.append(~index)
+                    if kind == CALL or kind == ARRAY or kind == BLOCK:
+                        pending.extend(reversed(children[b[index]:b[index] + c[index]]))
+                        if kind == CALL:
+                            pending.append(a[index])
+                    elif kind == ASSIGN:
+                        pending.append(b[index])
+                    elif kind == BINARY_OP:
+                        pending.append(c[index])
+                        pending.append(b[index])
+                    else:
+                        if kind == IF and c[index] != NONE:
+                            pending.append(c[index])
+                        pending.append(b[index])
+                        pending.append(a[index])
+                    continue
+            pos = self.starts[index]
+            if pos != NONE:
+                node.pos = pos
+                node.end = self.ends[index]
+            built.append(node)
+        return built[0]
+
+    def _built(self, built, count):
+        # Takes the last `count` nodes off `built`
+        if not count:
+            return []
+        nodes = built[-count:]
+        del built[-count:]
+        return nodes
+
+def _rebuild(kinds, a, b, c, starts, ends, children, roots, constants, names):
+    program = FlatProgram()
+    program.kinds, program.a, program.b, program.c = kinds, a, b, c
+    program.starts, program.ends, program.children, program.roots = starts, ends, children, roots
+    program.constants, program.names = constants, names
+    # Only needed to append to the program again
+    program._constant_index = {(type(value), value): i for i, value in enumerate(constants)}
+    program._name_index = {name: i for i, name in enumerate(names)}
+    return program
+
+class StatementView:
+    # The top-level statements of a FlatProgram, built on access
+    __slots__ = ('program',)
+
+    def __init__(self, program):
+        self.program = program
+
+    def __len__(self):
+        return len(self.program.roots)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.program.node(root) for root in self.program.roots[index]]
+        return self.program.node(self.program.roots[index])
+
+    def __iter__(self):
+        return map(self.program.node, self.program.roots)
@@ -0,0 +1,294 @@
+from .ast import Program, Block, If, While
+from .lexer import Lexer, TokenType
+from .parser import Parser
+from .compiler import compile_source
+
+# Characters lexed past an edit before the re-parsed statements are first
+# checked against the old ones; doubled until they line up again
+WINDOW = 4096
+# Block size in which diff() compares the two texts
+_CHUNK = 1 << 16
+
+class Edit:
+    # Replaces source[start:end] with `text`
+    __slots__ = ('start', 'end', 'text')
+
+    def __init__(self, start, end, text):
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def __repr__(self):
+        return f"Edit({self.start}, {self.end}, {self.text!r})"
+
+def diff(old, new):
+    # The single Edit that turns `old` into `new` by replacing everything
+    # between their common prefix and common suffix; None when they are equal
+    if old == new:
+        return None
+    limit = min(len(old), len(new))
+    prefix = _common_length(old, new, limit, lambda text, a, b: text[a:b])
+    suffix = _common_length(old, new, limit - prefix,
+                            lambda text, a, b: text[len(text) - b:len(text) - a])
+    return Edit(prefix, len(old) - suffix, new[prefix:len(new) - suffix])
+
+def _common_length(old, new, limit, part):
+    # How many leading characters of part(old, ...) and part(new, ...) are
+    # equal, up to `limit`: whole chunks first, then a binary search in the
+    # chunk that differs
+    low = 0
+    while low < limit:
+        high = min(low + _CHUNK, limit)
+        if part(old, low, high) != part(new, low, high):
+            break
+        low = high
+    else:
+        return limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if part(old, low, middle) == part(new, low, middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def _last_before(statements, offset):
+    # Index of the last statement that starts before `offset`, or None
+    low, high = 0, len(statements)
+    while low < high:
+        middle = (low + high) // 2
+        if statements[middle].pos < offset:
+            low = middle + 1
+        else:
+            high = middle
+    return low - 1 if low else None
+
+def _starting_at(statements, offset, low):
+    # Index of the statement from statements[low:] that starts at `offset`
+    high = len(statements)
+    while low < high:
+        middle = (low + high) // 2
+        if statements[middle].pos < offset:
+            low = middle + 1
+        else:
+            high = middle
+    if low < len(statements) and statements[low].pos == offset:
+        return low
+    return None
+
+def _shift(statements, delta):
+    # Moves the source offsets of statements that follow an edit, in place
+    if delta:
+        pending = [statements]
+        while pending:
+            for node in pending.pop():
+                node.pos += delta
+                node.end += delta
+                kind = type(node)
+                if kind is Block:
+                    pending.append(node.statements)
+                elif kind is If:
+                    pending.append((node.then_branch,) if node.else_branch is None
+                                   else (node.then_branch, node.else_branch))
+                elif kind is While:
+                    pending.append((node.body,))
+    return statements
+
+def _replace(parent, index, old, new, delta):
+    # A copy of `parent` with its child statement `old` (statements[index]
+    # of a Block) replaced by `new`
+    if isinstance(parent, Block):
+        statements = parent.statements
+        node = Block(statements[:index] + [new] + _shift(statements[index + 1:], delta))
+    elif isinstance(parent, If):
+        if parent.then_branch is old:
+            else_branch = parent.else_branch
+            if else_branch is not None:
+                _shift((else_branch,), delta)
+            node = If(parent.condition, new, else_branch)
+        else:
+            node = If(parent.condition, parent.then_branch, new)
+    else:
+        node = While(parent.condition, new)
+    node.pos = parent.pos
+    node.end = parent.end + delta
+    return node
+
+class IncrementalParser:
+    # Keeps the Program of a source text up to date as the text is edited.
+    # Only the statements around an edit are lexed and parsed again: from
+    # the last statement that starts before it until one starts after it
+    # where a statement of the previous parse started. From there on the
+    # old statements are reused, their offsets moved by the change in
+    # length. An edit is re-parsed within the innermost block around it,
+    # and within enclosing blocks or at the top level when the braces no
+    # longer line up. Reused nodes are shared with, and moved under, the
+    # previous Program, which is out of date after an update.
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.source = None
+        self.program = None
+
+    def parse(self, source):
+        # A full parse; like every update, leaves no Program on a SyntaxError
+        self.source = source
+        self.program = None
+        self.program = compile_source(source, self.filename)
+        return self.program
+
+    def update(self, source):
+        # Brings the Program up to date with a new version of the whole
+        # text; returns (program, changed) as apply() does
+        if self.program is None:
+            program = self.parse(source)
+            return program, list(program.statements)
+        edit = diff(self.source, source)
+        if edit is None:
+            return self.program, []
+        return self.apply(edit)
+
+    def apply(self, edit):
+        # Applies an Edit and returns (program, changed): `changed` lists
+        # the statements parsed anew, in source order, and then the
+        # statements rebuilt around them, innermost first
+        if not 0 <= edit.start <= edit.end <= len(self.source):
+            raise ValueError(f"Edit out of range: {edit!r}")
+        source = self.source[:edit.start] + edit.text + self.source[edit.end:]
+        if self.program is None:
+            program = self.parse(source)
+            return program, list(program.statements)
+        delta = len(edit.text) - (edit.end - edit.start)
+        chain, top = self._enclosing(edit)
+        for depth in range(len(chain) - 1, -1, -1):
+            block = chain[depth][0]
+            if not isinstance(block, Block):
+                continue
+            try:
+                result = self._reparse(source, edit, delta, block.statements, block.pos + 1, block.end)
+            except SyntaxError:
+                result = None
+            if result is None:
+                continue
+            first, parsed, rest = result
+            statements = block.statements
+            node = Block(statements[:first] + parsed + _shift(statements[rest:], delta))
+            node.pos = block.pos
+            node.end = block.end + delta
+            changed = parsed + [node]
+            for level in range(depth - 1, -1, -1):
+                node = _replace(chain[level][0], chain[level + 1][1], chain[level + 1][0], node, delta)
+                changed.append(node)
+            statements = self.program.statements
+            program = Program(statements[:top] + [node] + _shift(statements[top + 1:], delta))
+            return self._updated(source, program, changed)
+        statements = self.program.statements
+        try:
+            first, parsed, rest = self._reparse(source, edit, delta, statements, 0, None)
+        except SyntaxError:
+            # Fail the way a full parse does: it reports errors from lexing
+            # the whole text before any from parsing
+            program = self.parse(source)
+            return program, list(program.statements)
+        program = Program(statements[:first] + parsed + _shift(statements[rest:], delta))
+        return self._updated(source, program, parsed)
+
+    def _updated(self, source, program, changed):
+        self.source = source
+        self.program = program
+        return program, changed
+
+    def _enclosing(self, edit):
+        # The statements from the top level down to the innermost Block
+        # with the edit strictly between its braces, each with its index in
+        # the enclosing block (None below an If or While), and the index of
+        # the first of them at the top level
+        chain = []
+        top = None
+        statements = self.program.statements
+        while True:
+            index = _last_before(statements, edit.start)
+            if index is None:
+                return chain, top
+            node = statements[index]
+            steps = [(node, index)]
+            while not isinstance(node, Block):
+                if isinstance(node, If):
+                    else_branch = node.else_branch
+                    if else_branch is not None and else_branch.pos < edit.start:
+                        node = else_branch
+                    else:
+                        node = node.then_branch
+                elif isinstance(node, While):
+                    node = node.body
+                else:
+                    return chain, top
+                steps.append((node, None))
+            if not (node.pos < edit.start and edit.end <= node.end):
+                return chain, top
+            if top is None:
+                top = index
+            chain.extend(steps)
+            statements = node.statements
+
+    def _reparse(self, source, edit, delta, statements, opening, closing):
+        # Parses the statements of a block (or of the top level, where
+        # `closing` is None) again from the last one before the edit.
+        # Returns (first, parsed, rest): statements[first:rest] are replaced
+        # by `parsed`, or None when the block's braces no longer line up.
+        # The tokens are lexed a window at a time; a parser running off the
+        # end of one raises IndexError, as the StreamParser's does.
+        first = _last_before(statements, edit.start)
+        if first is None:
+            first = 0
+            restart = opening
+        else:
+            restart = statements[first].pos
+        edit_end = edit.start + len(edit.text)
+        window = WINDOW
+        while True:
+            stop = min(edit_end + window, len(source))
+            window *= 2
+            lexer = Lexer(source)
+            lexer.pos = restart
+            try:
+                tokens = lexer.scan(stop)
+            except SyntaxError:
+                if stop == len(source):
+                    raise
+                continue  # Maybe a string cut off at the window's end
+            if stop == len(source):
+                tokens.types.append(TokenType.EOF)
+                tokens.values.append(None)
+                tokens.positions.append(stop)
+            elif tokens.types:
+                # Possibly cut off
+                tokens.types.pop()
+                tokens.values.pop()
+                tokens.positions.pop()
+            try:
+                return self._resync(tokens, statements, first, closing, edit_end, delta)
+            except IndexError:
+                continue
+
+    def _resync(self, tokens, statements, first, closing, edit_end, delta):
+        parser = Parser(tokens)
+        types = tokens.types
+        positions = tokens.positions
+        parsed = []
+        while True:
+            token_type = types[parser.pos]
+            offset = positions[parser.pos]
+            if token_type == TokenType.EOF:
+                return (first, parsed, len(statements)) if closing is None else None
+            if token_type == TokenType.RBRACE and closing is not None:
+                if offset >= edit_end and offset - delta == closing:
+                    return first, parsed, len(statements)
+                return None
+            if offset >= edit_end:
+                # The text from here on is the old text from offset - delta
+                rest = _starting_at(statements, offset - delta, first)
+                if rest is not None:
+                    return first, parsed, rest
+            parsed.append(parser._parse_statement())
+            if types[parser.pos] == TokenType.SEMICOLON:
+                parser.pos += 1
@@ -1,3 +1,6 @@
+import re
+from array import array
+from bisect import bisect_right
 from enum import Enum
 
 class TokenType(Enum):
@@ -36,6 +39,8 @@ class TokenType(Enum):
     RPAREN = "RPAREN"
     LBRACE = "LBRACE"
     RBRACE = "RBRACE"
+    LBRACKET = "LBRACKET"
+    RBRACKET = "RBRACKET"
     COMMA = "COMMA"
     SEMICOLON = "SEMICOLON"
 
@@ -49,152 +54,325 @@ class TokenType(Enum):
     EOF = "EOF"
 
 class Token:
-    def __init__(self, type_, value):
+    __slots__ = ('type', 'value', 'pos')
+
+    def __init__(self, type_, value, pos=None):
         self.type = type_
         self.value = value
+        self.pos = pos
 
     def __repr__(self):
         return f"Token({self.type}, {self.value})"
 
+class TokenList:
+    # Tokens stored as parallel arrays (type, value, source offset) instead of
+    # one object per token. Indexing still hands out Token records for code
+    # that wants them.
+    __slots__ = ('types', 'values', 'positions')
+
+    def __init__(self, types=None, values=None, positions=None):
+        self.types = types if types is not None else []
+        self.values = values if values is not None else []
+        self.positions = positions if positions is not None else []
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        return cls([t.type for t in tokens], [t.value for t in tokens], [t.pos for t in tokens])
+
+    def append(self, token):
+        self.types.append(token.type)
+        self.values.append(token.value)
+        self.positions.append(token.pos)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return Token(self.types[index], self.values[index], self.positions[index])
+
+    def __iter__(self):
+        return map(Token, self.types, self.values, self.positions)
+
+KEYWORDS = {
+    'if': TokenType.IF,
+    'else': TokenType.ELSE,
+    'while': TokenType.WHILE,
+    'true': TokenType.BOOL,
+    'false': TokenType.BOOL,
+}
+
+OPERATORS = {
+    '+': TokenType.PLUS,
+    '-': TokenType.MINUS,
+    '*': TokenType.STAR,
+    '/': TokenType.SLASH,
+    '%': TokenType.PERCENT,
+    '==': TokenType.EQUAL,
+    '!=': TokenType.NOT_EQUAL,
+    '<': TokenType.LESS,
+    '<=': TokenType.LESS_EQUAL,
+    '>': TokenType.GREATER,
+    '>=': TokenType.GREATER_EQUAL,
+    '&&': TokenType.AND,
+    '||': TokenType.OR,
+    '=': TokenType.ASSIGN,
+    '(': TokenType.LPAREN,
+    ')': TokenType.RPAREN,
+    '{': TokenType.LBRACE,
+    '}': TokenType.RBRACE,
+    '[': TokenType.LBRACKET,
+    ']': TokenType.RBRACKET,
+    ',': TokenType.COMMA,
+    ';': TokenType.SEMICOLON,
+}
+
+# Leading whitespace and comments are consumed by the same match as the
+# token after them; the group that matched (match.lastindex) selects how
+# the token is built. An empty match at the end of input has no group.
+_NUMBER, _NAME, _STRING, _OPERATOR, _ERROR = range(1, 6)
+
+TOKEN_PATTERN = re.compile(r'''
+    (?:\s+|//[^\n]*)*                       # whitespace and comments
+    (?:
+        (\d+)                               # numbers
+      | ([^\W\d]\w*)                         # identifiers, keywords, booleans
+      | "((?:[^"\\]|\\.)*)"                 # strings (escapes kept verbatim)
+      | (==|!=|<=|>=|&&|\|\||[-+*/%=<>(){}\[\],;])  # operators and delimiters
+      | (.)                                 # anything else is an error
+      | $
+    )
+''', re.VERBOSE | re.DOTALL)
+
+class SourceMap:
+    # Translates source offsets (Token.pos, ASTNode.pos/end) into 1-based
+    # (line, column) pairs. Built on demand, so lexing itself stays offset-only.
+    def __init__(self, source):
+        self.source = source
+        self.line_starts = [0]
+        self.line_starts.extend(match.end() for match in re.finditer('\n', source))
+
+    def location(self, offset):
+        line = bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
+
+    def line(self, number):
+        start = self.line_starts[number - 1]
+        end = self.source.find('\n', start)
+        return self.source[start:end if end != -1 else len(self.source)]
+
+def syntax_error(message, pos):
+    # Lexer and parser errors only know the source offset; locate() fills in
+    # the line once the source text is at hand
+    error = SyntaxError(message)
+    error.pos = pos
+    return error
+
+def locate(error, source, filename=None):
+    pos = getattr(error, 'pos', None)
+    if pos is not None and error.lineno is None:
+        source_map = SourceMap(source)
+        error.lineno, error.offset = source_map.location(pos)
+        error.text = source_map.line(error.lineno)
+    if filename is not None:
+        error.filename = filename
+    return error
+
+def locate_stream(error, stream, filename=None):
+    # locate() for source that was read from a stream: the stream is
+    # rewound and read again a line at a time up to the error, so the
+    # source never has to be held in memory. An error from a stream that
+    # cannot seek keeps only its offset.
+    pos = getattr(error, 'pos', None)
+    if pos is not None and error.lineno is None:
+        try:
+            stream.seek(0)
+        except (AttributeError, OSError):
+            pos = None
+    if pos is not None and error.lineno is None:
+        lineno = 1
+        start = 0
+        text = ''
+        for text in stream:
+            if start + len(text) > pos or not text.endswith('\n'):
+                break
+            lineno += 1
+            start += len(text)
+            text = ''
+        error.lineno, error.offset = lineno, pos - start + 1
+        error.text = text.rstrip('\n')
+    if filename is not None:
+        error.filename = filename
+    return error
+
 class Lexer:
     def __init__(self, source):
         self.source = source
         self.pos = 0
-        self.keywords = {
-            'if': TokenType.IF,
-            'else': TokenType.ELSE,
-            'while': TokenType.WHILE,
-            'true': TokenType.TRUE,
-            'false': TokenType.FALSE,
-        }
-
-    def _peek(self):
-        if self.pos + 1 < len(self.source):
-            return self.source[self.pos + 1]
-        return '\0'
 
     def tokenize(self):
-        tokens = []
-        while self.pos < len(self.source):
-            char = self.source[self.pos]
-
-            if char.isspace():
-                self.pos += 1
-            elif char == '/':
-                if self._peek() == '/':
-                    while self.pos < len(self.source) and self.source[self.pos] != '\n':
-                        self.pos += 1
-                else:
-                    raise SyntaxError(f"Unexpected character: {char}")
-            elif char.isdigit():
-                tokens.append(self._read_number())
-            elif char.isalpha() or char == '_':
-                tokens.append(self._read_identifier())
-            elif char == '"':
-                tokens.append(self._read_string())
-            elif char == '+':
-                tokens.append(Token(TokenType.PLUS, '+'))
-                self.pos += 1
-            elif char == '-':
-                tokens.append(Token(TokenType.MINUS, '-'))
-                self.pos += 1
-            elif char == '*':
-                tokens.append(Token(TokenType.STAR, '*'))
-                self.pos += 1
-            elif char == '/':
-                tokens.append(Token(TokenType.SLASH, '/'))
-                self.pos += 1
-            elif char == '%':
-                tokens.append(Token(TokenType.PERCENT, '%'))
-                self.pos += 1
-            elif char == '=':
-                if self._peek() == '=':
-                    tokens.append(Token(TokenType.EQUAL, '=='))
-                    self.pos += 2
-                else:
-                    tokens.append(Token(TokenType.ASSIGN, '='))
-                    self.pos += 1
-            elif char == '!':
-                if self._peek() == '=':
-                    tokens.append(Token(TokenType.NOT_EQUAL, '!='))
-                    self.pos += 2
-                else:
-                    raise SyntaxError(f"Unexpected character: {char}")
-            elif char == '<':
-                if self._peek() == '=':
-                    tokens.append(Token(TokenType.LESS_EQUAL, '<='))
-                    self.pos += 2
-                else:
-                    tokens.append(Token(TokenType.LESS, '<'))
-                    self.pos += 1
-            elif char == '>':
-                if self._peek() == '=':
-                    tokens.append(Token(TokenType.GREATER_EQUAL, '>='))
-                    self.pos += 2
-                else:
-                    tokens.append(Token(TokenType.GREATER, '>'))
-                    self.pos += 1
-            elif char == '&':
-                if self._peek() == '&':
-                    tokens.append(Token(TokenType.AND, '&&'))
-                    self.pos += 2
-                else:
-                    raise SyntaxError(f"Unexpected character: {char}")
-            elif char == '|':
-                if self._peek() == '|':
-                    tokens.append(Token(TokenType.OR, '||'))
-                    self.pos += 2
-                else:
-                    raise SyntaxError(f"Unexpected character: {char}")
-            elif char == '(':
-                tokens.append(Token(TokenType.LPAREN, '('))
-                self.pos += 1
-            elif char == ')':
-                tokens.append(Token(TokenType.RPAREN, ')'))
-                self.pos += 1
-            elif char == '{':
-                tokens.append(Token(TokenType.LBRACE, '{'))
-                self.pos += 1
-            elif char == '}':
-                tokens.append(Token(TokenType.RBRACE, '}'))
-                self.pos += 1
-            elif char == ',':
-                tokens.append(Token(TokenType.COMMA, ','))
-                self.pos += 1
-            elif char == ';':
-                tokens.append(Token(TokenType.SEMICOLON, ';'))
-                self.pos += 1
-            else:
-                raise SyntaxError(f"Unexpected character: {char}")
-        tokens.append(Token(TokenType.EOF, None))
+        tokens = self.scan(len(self.source))
+        tokens.types.append(TokenType.EOF)
+        tokens.values.append(None)
+        tokens.positions.append(self.pos)
         return tokens
 
-    def _read_number(self):
-        start = self.pos
-        while self.pos < len(self.source) and self.source[self.pos].isdigit():
-            self.pos += 1
-        return Token(TokenType.NUMBER, int(self.source[start:self.pos]))
-
-    def _read_identifier(self):
-        start = self.pos
-        while self.pos < len(self.source) and self.source[self.pos].isalnum() or self.source[self.pos] == '_':
-            self.pos += 1
-        name = self.source[start:self.pos]
-        token_type = self.keywords.get(name, TokenType.IDENTIFIER)
-        if token_type in (TokenType.TRUE, TokenType.FALSE):
-            return Token(TokenType.BOOL, name == 'true')
-        return Token(token_type, name)
-
-    def _read_string(self):
-        self.pos += 1
-        start = self.pos
-        while self.pos < len(self.source) and self.source[self.pos] != '"':
-            if self.source[self.pos] == '\\':
-                self.pos += 2
+    def scan(self, end):
+        # The tokens from self.pos up to offset `end`, without an EOF token;
+        # a token that runs on past `end` comes out cut short there.
+        # Positions go in an array and repeated names, operators and numbers
+        # share one object each, which keeps large token lists compact
+        types = []
+        values = []
+        positions = array('q')
+        add_type = types.append
+        add_value = values.append
+        add_pos = positions.append
+        keywords = KEYWORDS
+        operators = OPERATORS
+        identifier = TokenType.IDENTIFIER
+        strings = {}
+        shared = strings.setdefault
+        numbers = {}
+        for match in TOKEN_PATTERN.finditer(self.source, self.pos, end):
+            kind = match.lastindex
+            if kind == _NAME:
+                text = match.group(_NAME)
+                add_pos(match.start(_NAME))
+                token_type = keywords.get(text, identifier)
+                add_type(token_type)
+                add_value(text == 'true' if token_type is TokenType.BOOL else shared(text, text))
+            elif kind == _OPERATOR:
+                text = match.group(_OPERATOR)
+                add_pos(match.start(_OPERATOR))
+                add_type(operators[text])
+                add_value(shared(text, text))
+            elif kind == _NUMBER:
+                text = match.group(_NUMBER)
+                add_pos(match.start(_NUMBER))
+                add_type(TokenType.NUMBER)
+                value = numbers.get(text)
+                if value is None:
+                    value = numbers[text] = int(text)
+                add_value(value)
+            elif kind == _STRING:
+                add_pos(match.start(_STRING) - 1)
+                add_type(TokenType.STRING)
+                add_value(match.group(_STRING))
+            elif kind == _ERROR:
+                char = match.group(_ERROR)
+                if char == '"':
+                    raise syntax_error("Unterminated string", match.start(_ERROR))
+                raise syntax_error(f"Unexpected character: {char}", match.start(_ERROR))
             else:
-                self.pos += 1
-        if self.pos >= len(self.source):
-            raise SyntaxError("Unterminated string")
-        value = self.source[start:self.pos]
-        self.pos += 1
-        return Token(TokenType.STRING, value)
+                break
+        self.pos = end
+        return TokenList(types, values, positions)
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+class StreamLexer:
+    # Tokenizes a text stream a chunk at a time, so memory stays bounded by
+    # the chunk size plus the longest token. A match that touches the end of
+    # the buffered text may continue in the next chunk, so it is held back
+    # and rescanned once more text arrives.
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        for types, values, positions in self.batches():
+            yield from map(Token, types, values, positions)
+
+    def batches(self):
+        # Yields (types, values, positions) columns per chunk; the last
+        # batch ends with the EOF token
+        buffer = ''
+        base = 0
+        keywords = KEYWORDS
+        operators = OPERATORS
+        identifier = TokenType.IDENTIFIER
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            final = not chunk
+            buffer += chunk
+            end = len(buffer)
+            consumed = 0
+            types = []
+            values = []
+            positions = []
+            add_type = types.append
+            add_value = values.append
+            add_pos = positions.append
+            for match in TOKEN_PATTERN.finditer(buffer):
+                kind = match.lastindex
+                if not final and (match.end() == end or (kind == _ERROR and match.group(_ERROR) == '"')):
+                    break
+                if kind == _NAME:
+                    text = match.group(_NAME)
+                    add_pos(base + match.start(_NAME))
+                    token_type = keywords.get(text, identifier)
+                    add_type(token_type)
+                    add_value(text == 'true' if token_type is TokenType.BOOL else text)
+                elif kind == _OPERATOR:
+                    text = match.group(_OPERATOR)
+                    add_pos(base + match.start(_OPERATOR))
+                    add_type(operators[text])
+                    add_value(text)
+                elif kind == _NUMBER:
+                    add_pos(base + match.start(_NUMBER))
+                    add_type(TokenType.NUMBER)
+                    add_value(int(match.group(_NUMBER)))
+                elif kind == _STRING:
+                    add_pos(base + match.start(_STRING) - 1)
+                    add_type(TokenType.STRING)
+                    add_value(match.group(_STRING))
+                elif kind == _ERROR:
+                    char = match.group(_ERROR)
+                    if char == '"':
+                        raise syntax_error("Unterminated string", base + match.start(_ERROR))
+                    raise syntax_error(f"Unexpected character: {char}", base + match.start(_ERROR))
+                else:
+                    break
+                consumed = match.end()
+            if final:
+                add_type(TokenType.EOF)
+                add_value(None)
+                add_pos(base + end)
+                yield types, values, positions
+                return
+            yield types, values, positions
+            buffer = buffer[consumed:]
+            base += consumed
+
+class TokenStream:
+    # Token columns like TokenList's, but filled one lexer batch at a time.
+    # fill() drops the tokens before a given index, shifting the rest down,
+    # and appends the next batch in place so readers keep their references.
+    def __init__(self, lexer):
+        self._batches = lexer.batches()
+        self.types = []
+        self.values = []
+        self.positions = []
+        self.exhausted = False
+
+    def fill(self, keep_from=0):
+        if keep_from:
+            del self.types[:keep_from]
+            del self.values[:keep_from]
+            del self.positions[:keep_from]
+        for types, values, positions in self._batches:
+            self.types.extend(types)
+            self.values.extend(values)
+            self.positions.extend(positions)
+            if types:
+                return True
+        self.exhausted = True
+        return False
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        return Token(self.types[index], self.values[index], self.positions[index])
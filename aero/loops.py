@@ -0,0 +1,130 @@
+from .lexer import TokenType
+from .ast import *
+
+# Comparisons a counted loop may test, and the sign its step must have for
+# the loop to make progress towards the bound
+COUNTING_UP = frozenset({TokenType.LESS, TokenType.LESS_EQUAL})
+COUNTING_DOWN = frozenset({TokenType.GREATER, TokenType.GREATER_EQUAL})
+
+def _assigned_names(statements, names):
+    pending = list(statements)
+    while pending:
+        stmt = pending.pop()
+        if isinstance(stmt, Assign):
+            names.add(stmt.name)
+        elif isinstance(stmt, Block):
+            pending.extend(stmt.statements)
+        elif isinstance(stmt, If):
+            pending.append(stmt.then_branch)
+            if stmt.else_branch:
+                pending.append(stmt.else_branch)
+        elif isinstance(stmt, While):
+            pending.append(stmt.body)
+    return names
+
+def _is_invariant(node, assigned):
+    # Pure expressions over names the loop never assigns: no calls, so
+    # evaluating one once gives the value every iteration would see
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, BinaryOp):
+            pending.append(node.right)
+            pending.append(node.left)
+        elif isinstance(node, Identifier):
+            if node.name in assigned:
+                return False
+        elif not isinstance(node, (Number, String, Bool)):
+            return False
+    return True
+
+def _step(stmt, var):
+    # `var = var + c` or `var = var - c` with a literal int c
+    if not (isinstance(stmt, Assign) and stmt.name == var and isinstance(stmt.value, BinaryOp)):
+        return None
+    value = stmt.value
+    if value.op not in (TokenType.PLUS, TokenType.MINUS):
+        return None
+    if not (isinstance(value.left, Identifier) and value.left.name == var):
+        return None
+    if type(value.right) is not Number or type(value.right.value) is not int:
+        return None
+    return value.right.value if value.op == TokenType.PLUS else -value.right.value
+
+def _accumulators(statements, var, assigned):
+    accumulators = []
+    for stmt in statements:
+        if not (isinstance(stmt, Assign) and isinstance(stmt.value, BinaryOp)):
+            return None
+        value = stmt.value
+        if value.op not in (TokenType.PLUS, TokenType.MINUS):
+            return None
+        if not (isinstance(value.left, Identifier) and value.left.name == stmt.name):
+            return None
+        operand = value.right
+        if type(operand) is Number and type(operand.value) is int:
+            pass
+        elif isinstance(operand, Identifier) and (operand.name == var or operand.name not in assigned):
+            pass
+        else:
+            return None
+        accumulators.append((stmt.name, 1 if value.op == TokenType.PLUS else -1, operand))
+    # Each accumulator must be assigned exactly once
+    if len({name for name, _, _ in accumulators}) != len(accumulators):
+        return None
+    return tuple(accumulators)
+
+def match_counted_loop(node):
+    # Returns a CountedWhile equivalent to the While `node`, or None
+    condition = node.condition
+    if not (isinstance(condition, BinaryOp) and isinstance(condition.left, Identifier)):
+        return None
+    if condition.op not in COUNTING_UP and condition.op not in COUNTING_DOWN:
+        return None
+    var = condition.left.name
+    statements = node.body.statements if isinstance(node.body, Block) else [node.body]
+    if not statements:
+        return None
+    step = _step(statements[-1], var)
+    if not step or (step > 0) != (condition.op in COUNTING_UP):
+        return None
+    body = statements[:-1]
+    assigned = _assigned_names(body, set())
+    if var in assigned:
+        return None
+    assigned.add(var)
+    if not _is_invariant(condition.right, assigned):
+        return None
+    return CountedWhile(condition, node.body, var, condition.op, condition.right, step, body,
+                        _accumulators(body, var, assigned))
+
+def counted_range(op, start, bound, step):
+    # The values the loop variable takes on entry to each iteration
+    if op == TokenType.LESS_EQUAL:
+        bound += 1
+    elif op == TokenType.GREATER_EQUAL:
+        bound -= 1
+    return range(start, bound, step)
+
+def closed_form(loop, span, read):
+    # New values of the accumulators after running the whole loop, or None
+    # when a value is not a plain int and the loop has to run normally.
+    # `read(name)` returns the current value of a variable or UNBOUND.
+    trips = len(span)
+    series = trips * (span[0] + span[-1]) // 2 if trips else 0
+    results = {}
+    for name, sign, operand in loop.accumulators:
+        current = read(name)
+        if type(current) is not int:
+            return None
+        if isinstance(operand, Number):
+            amount = operand.value * trips
+        elif operand.name == loop.var:
+            amount = series
+        else:
+            value = read(operand.name)
+            if type(value) is not int:
+                return None
+            amount = value * trips
+        results[name] = current + sign * amount
+    return results
@@ -0,0 +1,333 @@
+from .lexer import TokenType
+from .ast import *
+from .runtime import BINARY_FUNCS, BUILTIN_NAMES, materialize
+from .loops import match_counted_loop
+from .flat import FlatProgram
+from .resolver import Scope, resolve
+
+ARITHMETIC_OPS = frozenset({
+    TokenType.MINUS, TokenType.STAR, TokenType.SLASH, TokenType.PERCENT,
+})
+BOOL_OPS = frozenset({
+    TokenType.EQUAL, TokenType.NOT_EQUAL,
+    TokenType.LESS, TokenType.LESS_EQUAL,
+    TokenType.GREATER, TokenType.GREATER_EQUAL,
+    TokenType.AND, TokenType.OR,
+})
+
+LITERALS = (Number, String, Bool)
+
+# Lattice for the flow-insensitive type inference used at -O2: every name
+# starts at _UNASSIGNED and can only move up to a concrete type or to None
+# (unknown).
+_UNASSIGNED = object()
+_NUMERIC = (int, bool, _UNASSIGNED)
+
+def optimize(program, level=1, inputs=(), builtins=BUILTIN_NAMES):
+    # `inputs` names variables the caller may seed before a run. Names that
+    # can never be defined are reported first, on the unoptimized tree, so
+    # that dropping a dead branch cannot hide one: the diagnostic is the
+    # same at every level. `builtins=None` skips the check, for code
+    # compiled one statement at a time.
+    if level <= 0:
+        return program
+    if builtins is not None:
+        resolve(program, builtins, Scope(inputs))
+    return Optimizer(level, inputs).optimize(program)
+
+def infer_types(program):
+    # The variable types -O2 relies on; a name missing from the result may
+    # hold anything
+    return Optimizer(2)._infer_types(program)
+
+def expression_type(node, types):
+    return Optimizer(2)._type_of(node, types)
+
+def _literal(value):
+    value = materialize(value)
+    if isinstance(value, bool):
+        return Bool(value)
+    elif isinstance(value, int):
+        return Number(value)
+    elif isinstance(value, str):
+        return String(value)
+    return None
+
+# Kinds of statement the optimizer can be in the middle of rewriting
+_BLOCK, _THEN, _ELSE, _LOOP = range(4)
+
+def _spanned(result, node):
+    # Gives a rewritten statement the source span of the one it replaces
+    if result is not None and result.pos is None:
+        result.pos, result.end = node.pos, node.end
+    return result
+
+def _walk_assignments(statements, assignments):
+    # In source order, from an explicit stack
+    pending = list(reversed(statements))
+    while pending:
+        stmt = pending.pop()
+        if isinstance(stmt, Assign):
+            assignments.setdefault(stmt.name, []).append(stmt.value)
+        elif isinstance(stmt, Block):
+            pending.extend(reversed(stmt.statements))
+        elif isinstance(stmt, If):
+            if stmt.else_branch:
+                pending.append(stmt.else_branch)
+            pending.append(stmt.then_branch)
+        elif isinstance(stmt, While):
+            pending.append(stmt.body)
+
+class Optimizer:
+    # -O1: fold constant BinaryOp subtrees, drop unreachable If/While branches
+    #      and statements that are bare literals, and mark counted loops
+    #      (see CountedWhile).
+    # -O2: additionally infer variable types and remove identities such as
+    #      x + 0, x * 1 and s + "" where they provably cannot change the
+    #      result, and merge constants in chains like x + 1 + 2.
+    def __init__(self, level=1, inputs=()):
+        self.level = level
+        self.inputs = tuple(inputs)
+        self.types = {}
+
+    def optimize(self, program):
+        if self.level >= 2:
+            self.types = self._infer_types(program)
+        if isinstance(program, FlatProgram):
+            # Stays flat, rewriting one top-level statement at a time
+            return FlatProgram(stmt for node in program.statements for stmt in self._statements([node]))
+        return Program(self._statements(program.statements))
+
+    def _infer_types(self, program):
+        assignments = {}
+        _walk_assignments(program.statements, assignments)
+        # A read of a builtin name can observe the builtin instead of an
+        # assigned value, and a read of an input the value it was seeded
+        # with, so their types are never known
+        for name in BUILTIN_NAMES + self.inputs:
+            assignments.pop(name, None)
+        types = {name: _UNASSIGNED for name in assignments}
+        changed = True
+        while changed:
+            changed = False
+            for name, values in assignments.items():
+                current = _UNASSIGNED
+                for value in values:
+                    current = self._join(current, self._type_of(value, types))
+                if current != types[name]:
+                    types[name] = current
+                    changed = True
+        # A name that never leaves _UNASSIGNED can only ever raise NameError
+        return {name: t for name, t in types.items() if t is not _UNASSIGNED}
+
+    def _join(self, a, b):
+        if a is _UNASSIGNED:
+            return b
+        if b is _UNASSIGNED or a == b:
+            return a
+        return None
+
+    def _type_of(self, node, types=None):
+        if types is None:
+            types = self.types
+        if isinstance(node, Bool):
+            return bool
+        elif isinstance(node, Number):
+            return int
+        elif isinstance(node, String):
+            return str
+        elif isinstance(node, Identifier):
+            return types.get(node.name)
+        elif isinstance(node, BinaryOp):
+            if node.op in (TokenType.AND, TokenType.OR):
+                return bool
+            left = self._type_of(node.left, types)
+            right = self._type_of(node.right, types)
+            if node.op in BOOL_OPS:
+                # Comparing arrays gives an array
+                return bool if left is not None and right is not None else None
+            if node.op == TokenType.PLUS and (left is str or right is str):
+                return str
+            if node.op == TokenType.PLUS or node.op in ARITHMETIC_OPS:
+                if left in _NUMERIC and right in _NUMERIC:
+                    if left is _UNASSIGNED and right is _UNASSIGNED:
+                        return _UNASSIGNED
+                    return int
+        return None
+
+    def _statements(self, statements):
+        # Statements are rewritten without recursion, as the parser builds
+        # them: `frames` holds the blocks, ifs and whiles whose nested
+        # statement is being rewritten, [kind, node, state], where state is
+        # a block's rewritten statements so far or an if's or while's
+        # condition. Blocks do not introduce a scope, so nested ones are
+        # inlined into the enclosing list.
+        root = [_BLOCK, None, []]
+        frames = [root]
+        remaining = [iter(statements)]
+        while True:
+            # Take the next statement of the innermost block; a finished
+            # block hands its statements to the frame waiting for it
+            node = next(remaining[-1], None)
+            if node is None:
+                remaining.pop()
+                frame = frames.pop()
+                if frame is root:
+                    return root[2]
+                result = _spanned(Block(frame[2]), frame[1]) if frame[2] else None
+            else:
+                result = self._descend(node, frames, remaining)
+                if result is frames:
+                    continue
+            # Hand the finished statement to the frames waiting for it
+            while True:
+                frame = frames[-1]
+                kind = frame[0]
+                if kind == _BLOCK:
+                    if isinstance(result, Block):
+                        frame[2].extend(result.statements)
+                    elif result is not None:
+                        frame[2].append(result)
+                    break
+                node = frame[1]
+                if kind == _LOOP:
+                    frames.pop()
+                    loop = While(frame[2], result if result is not None else Block([]))
+                    result = _spanned(match_counted_loop(loop) or loop, node)
+                    continue
+                if kind == _THEN:
+                    then_branch = result if result is not None else Block([])
+                    if node.else_branch:
+                        frame[0] = _ELSE
+                        frame.append(then_branch)
+                        result = self._descend(node.else_branch, frames, remaining)
+                        if result is frames:
+                            break
+                        continue
+                    else_branch = None
+                else:
+                    then_branch, else_branch = frame[3], result
+                frames.pop()
+                if else_branch is None and isinstance(then_branch, Block) and not then_branch.statements:
+                    # The condition may still fail at runtime, so keep evaluating it
+                    result = _spanned(frame[2], node)
+                else:
+                    result = _spanned(If(frame[2], then_branch, else_branch), node)
+
+    def _descend(self, node, frames, remaining):
+        # Rewrites a simple statement, or opens frames down to the first
+        # one nested in a compound statement and returns `frames`. A
+        # constant condition picks its branch in place of the if.
+        while True:
+            if isinstance(node, Assign):
+                return _spanned(Assign(node.name, self._expression(node.value)), node)
+            elif isinstance(node, Block):
+                frames.append([_BLOCK, node, []])
+                remaining.append(iter(node.statements))
+                return frames
+            elif isinstance(node, If):
+                condition = self._expression(node.condition)
+                if isinstance(condition, LITERALS):
+                    node = node.then_branch if condition.value else node.else_branch
+                    if node is None:
+                        return None
+                    continue
+                frames.append([_THEN, node, condition])
+                node = node.then_branch
+            elif isinstance(node, While):
+                condition = self._expression(node.condition)
+                if isinstance(condition, LITERALS) and not condition.value:
+                    return None
+                frames.append([_LOOP, node, condition])
+                node = node.body
+            else:
+                expr = self._expression(node)
+                if isinstance(expr, LITERALS):
+                    return None
+                return _spanned(expr, node)
+
+    def _expression(self, node):
+        if isinstance(node, BinaryOp):
+            left = self._expression(node.left)
+            right = self._expression(node.right)
+            if isinstance(left, LITERALS) and isinstance(right, LITERALS):
+                folded = self._fold(node.op, left, right)
+                if folded is not None:
+                    return folded
+            if node.op in (TokenType.AND, TokenType.OR) and isinstance(left, LITERALS):
+                # false && x and true || x never evaluate x
+                if bool(left.value) == (node.op == TokenType.OR):
+                    return Bool(node.op == TokenType.OR)
+                if self._type_of(right) is bool:
+                    return right
+            if self.level >= 2:
+                return self._simplify(node.op, left, right)
+            return BinaryOp(node.op, left, right)
+        elif isinstance(node, Call):
+            return Call(self._expression(node.func), [self._expression(arg) for arg in node.args])
+        elif isinstance(node, Array):
+            return Array([self._expression(element) for element in node.elements])
+        elif isinstance(node, Index):
+            return Index(self._expression(node.value), self._expression(node.index))
+        return node
+
+    def _fold(self, op, left, right):
+        # Only fold arithmetic over integers; "ab" * 3 and "%d" % 5 are left
+        # to the runtime so their result types stay engine-defined.
+        if op in ARITHMETIC_OPS and (isinstance(left, String) or isinstance(right, String)):
+            return None
+        try:
+            value = BINARY_FUNCS[op](left.value, right.value)
+        except Exception:
+            # Errors such as division by zero must surface when the
+            # expression actually runs, not at compile time
+            return None
+        return _literal(value)
+
+    def _simplify(self, op, left, right):
+        left_type = self._type_of(left)
+        right_type = self._type_of(right)
+        if op == TokenType.PLUS:
+            if left_type is int and self._is_const(right, 0):
+                return left
+            if right_type is int and self._is_const(left, 0):
+                return right
+            if left_type is str and self._is_const(right, ""):
+                return left
+            if right_type is str and self._is_const(left, ""):
+                return right
+        elif op == TokenType.MINUS:
+            if left_type is int and self._is_const(right, 0):
+                return left
+        elif op == TokenType.STAR:
+            if left_type in (int, str) and self._is_const(right, 1):
+                return left
+            if right_type in (int, str) and self._is_const(left, 1):
+                return right
+        elif op == TokenType.SLASH:
+            if left_type is int and self._is_const(right, 1):
+                return left
+
+        merged = self._reassociate(op, left, right)
+        if merged is not None:
+            return merged
+        return BinaryOp(op, left, right)
+
+    def _is_const(self, node, value):
+        return type(node) is (String if isinstance(value, str) else Number) and node.value == value
+
+    def _reassociate(self, op, left, right):
+        # (e + c1) + c2 => e + (c1 + c2), and the same for -, * on integers
+        if not (isinstance(right, Number) and isinstance(left, BinaryOp)):
+            return None
+        if not isinstance(left.right, Number) or self._type_of(left.left) is not int:
+            return None
+        inner, c1, c2 = left.op, left.right.value, right.value
+        if inner in (TokenType.PLUS, TokenType.MINUS) and op in (TokenType.PLUS, TokenType.MINUS):
+            offset = (c1 if inner == TokenType.PLUS else -c1) + (c2 if op == TokenType.PLUS else -c2)
+            if offset >= 0:
+                return self._simplify(TokenType.PLUS, left.left, Number(offset))
+            return self._simplify(TokenType.MINUS, left.left, Number(-offset))
+        if inner == TokenType.STAR and op == TokenType.STAR:
+            return self._simplify(TokenType.STAR, left.left, Number(c1 * c2))
+        return None
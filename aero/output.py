@@ -0,0 +1,65 @@
+import sys
+
+DEFAULT_BUFFER_SIZE = 1 << 16
+
+class Output:
+    # Buffered sink behind the print builtin. `writer` is a file-like object
+    # or a callable that receives chunks of text; by default it is whatever
+    # sys.stdout is when the buffer is flushed, so redirect_stdout() keeps
+    # working. Output is block-buffered unless the target is a terminal, in
+    # which case every print is flushed as it happens. VMs flush when a
+    # program finishes or fails.
+    def __init__(self, writer=None, line_buffered=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.writer = writer
+        if writer is None:
+            self._write = None
+            self._flush = None
+        elif hasattr(writer, 'write'):
+            self._write = writer.write
+            self._flush = getattr(writer, 'flush', None)
+        elif callable(writer):
+            self._write = writer
+            self._flush = None
+        else:
+            raise TypeError("Output writer must have a write() method or be callable")
+        if line_buffered is None:
+            target = sys.stdout if writer is None else writer
+            isatty = getattr(target, 'isatty', None)
+            line_buffered = bool(isatty and isatty())
+        self.line_buffered = line_buffered
+        self.buffer_size = buffer_size
+        self._chunks = []
+        self._size = 0
+
+    def print(self, *args):
+        text = " ".join(map(str, args)) + "\n"
+        self._chunks.append(text)
+        self._size += len(text)
+        if self.line_buffered or self._size >= self.buffer_size:
+            self.flush()
+
+    def write(self, text):
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= self.buffer_size or (self.line_buffered and "\n" in text):
+            self.flush()
+
+    def flush(self):
+        if self._chunks:
+            text = "".join(self._chunks)
+            self._chunks = []
+            self._size = 0
+            if self._write is None:
+                sys.stdout.write(text)
+            else:
+                self._write(text)
+        if self._write is None:
+            sys.stdout.flush()
+        elif self._flush is not None:
+            self._flush()
+
+def make_output(output):
+    # VMs accept an Output, any writer Output accepts, or None for stdout
+    if isinstance(output, Output):
+        return output
+    return Output(output)
@@ -1,164 +1,254 @@
 from .ast import *
-from .lexer import TokenType
+from .lexer import TokenType, TokenList, TokenStream, syntax_error
+
+# Binding power of each binary operator, loosest first
+BINARY_PRECEDENCE = {
+    TokenType.OR: 1,
+    TokenType.AND: 2,
+    TokenType.EQUAL: 3, TokenType.NOT_EQUAL: 3,
+    TokenType.LESS: 4, TokenType.LESS_EQUAL: 4, TokenType.GREATER: 4, TokenType.GREATER_EQUAL: 4,
+    TokenType.PLUS: 5, TokenType.MINUS: 5,
+    TokenType.STAR: 6, TokenType.SLASH: 6, TokenType.PERCENT: 6,
+}
+ATOMS = {TokenType.NUMBER: Number, TokenType.STRING: String, TokenType.BOOL: Bool, TokenType.IDENTIFIER: Identifier}
+
+# Kinds of group an expression can be nested in
+_PAREN, _CALL, _INDEX, _ARRAY = range(4)
 
 class Parser:
     def __init__(self, tokens):
+        if not isinstance(tokens, (TokenList, TokenStream)):
+            tokens = TokenList.from_tokens(tokens)
         self.tokens = tokens
+        self.types = tokens.types
+        self.values = tokens.values
+        self.positions = tokens.positions
         self.pos = 0
 
     def _current(self):
         return self.tokens[self.pos]
 
+    def _type(self):
+        return self.types[self.pos]
+
     def _consume(self, expected_type=None):
-        if expected_type and self._current().type != expected_type:
-            raise SyntaxError(f"Expected {expected_type}, got {self._current().type}")
-        token = self.tokens[self.pos]
+        if expected_type and self.types[self.pos] != expected_type:
+            raise syntax_error(f"Expected {expected_type}, got {self.types[self.pos]}", self.positions[self.pos])
+        value = self.values[self.pos]
         self.pos += 1
-        return token
+        return value
 
     def _match(self, token_type):
-        if self._current().type == token_type:
+        if self.types[self.pos] == token_type:
             self.pos += 1
             return True
         return False
 
     def parse(self):
-        statements = []
-        while self._current().type != TokenType.EOF:
-            statements.append(self._parse_statement())
-            if self._current().type == TokenType.SEMICOLON:
+        return Program(list(self.parse_statements()))
+
+    def parse_statements(self):
+        # Yields the top-level statements one at a time
+        while self._type() != TokenType.EOF:
+            yield self._parse_statement()
+            if self._type() == TokenType.SEMICOLON:
                 self.pos += 1
-        return Program(statements)
 
     def _parse_statement(self):
-        if self._match(TokenType.IF):
-            self._consume(TokenType.LPAREN)
-            condition = self._parse_expression()
-            self._consume(TokenType.RPAREN)
-            then_branch = self._parse_statement()
-            else_branch = None
-            if self._match(TokenType.ELSE):
-                else_branch = self._parse_statement()
-            return If(condition, then_branch, else_branch)
-        elif self._match(TokenType.WHILE):
-            self._consume(TokenType.LPAREN)
-            condition = self._parse_expression()
-            self._consume(TokenType.RPAREN)
-            body = self._parse_statement()
-            return While(condition, body)
-        elif self._current().type == TokenType.LBRACE:
-            return self._parse_block()
-        elif (self._current().type == TokenType.IDENTIFIER and
-              self._peek_type(1) == TokenType.ASSIGN):
-            name = self._consume().value
-            self._consume(TokenType.ASSIGN)
-            value = self._parse_expression()
-            return Assign(name, value)
-        else:
-            return self._parse_expression()
-
-    def _parse_block(self):
-        self._consume(TokenType.LBRACE)
-        statements = []
-        while self._current().type != TokenType.RBRACE and self._current().type != TokenType.EOF:
-            statements.append(self._parse_statement())
-            if self._current().type == TokenType.SEMICOLON:
+        # Compound statements are parsed without recursion: `frames` holds
+        # the ifs, whiles and blocks still waiting for a nested statement,
+        # [kind, start, condition or statements, then branch], so else-if
+        # chains and nested blocks can be as deep as the source makes them
+        types = self.types
+        frames = []
+        while True:
+            start = self.positions[self.pos]
+            token_type = types[self.pos]
+            if token_type == TokenType.IF or token_type == TokenType.WHILE:
                 self.pos += 1
-        self._consume(TokenType.RBRACE)
-        return Block(statements)
+                self._consume(TokenType.LPAREN)
+                condition = self._parse_expression()
+                self._consume(TokenType.RPAREN)
+                frames.append([token_type, start, condition, None])
+                continue
+            if token_type == TokenType.LBRACE:
+                self.pos += 1
+                frames.append([TokenType.LBRACE, start, [], None])
+                if types[self.pos] != TokenType.RBRACE and types[self.pos] != TokenType.EOF:
+                    continue
+                node = None
+            else:
+                if token_type == TokenType.IDENTIFIER and self._peek_type(1) == TokenType.ASSIGN:
+                    name = self._consume()
+                    self.pos += 1
+                    node = Assign(name, self._parse_expression())
+                else:
+                    node = self._parse_expression()
+                node.pos = start
+                node.end = self.positions[self.pos - 1]
+            # Hand the finished statement to the frames waiting for it
+            while frames:
+                frame = frames[-1]
+                kind = frame[0]
+                if kind == TokenType.LBRACE:
+                    if node is not None:
+                        frame[2].append(node)
+                        if types[self.pos] == TokenType.SEMICOLON:
+                            self.pos += 1
+                        if types[self.pos] != TokenType.RBRACE and types[self.pos] != TokenType.EOF:
+                            break
+                    self._consume(TokenType.RBRACE)
+                    node = Block(frame[2])
+                elif kind == TokenType.IF:
+                    if self._match(TokenType.ELSE):
+                        frame[0] = TokenType.ELSE
+                        frame[3] = node
+                        break
+                    node = If(frame[2], node, None)
+                elif kind == TokenType.ELSE:
+                    node = If(frame[2], frame[3], node)
+                else:
+                    node = While(frame[2], node)
+                frames.pop()
+                node.pos = frame[1]
+                node.end = self.positions[self.pos - 1]
+            if not frames:
+                return node
 
     def _parse_expression(self):
-        return self._parse_logical_or()
-
-    def _parse_logical_or(self):
-        left = self._parse_logical_and()
-        while self._match(TokenType.OR):
-            right = self._parse_logical_and()
-            left = BinaryOp(TokenType.OR, left, right)
-        return left
-
-    def _parse_logical_and(self):
-        left = self._parse_equality()
-        while self._match(TokenType.AND):
-            right = self._parse_equality()
-            left = BinaryOp(TokenType.AND, left, right)
-        return left
-
-    def _parse_equality(self):
-        left = self._parse_comparison()
-        while self._current().type in (TokenType.EQUAL, TokenType.NOT_EQUAL):
-            op = self._consume()
-            right = self._parse_comparison()
-            left = BinaryOp(op.type, left, right)
-        return left
-
-    def _parse_comparison(self):
-        left = self._parse_term()
-        while self._current().type in (
-            TokenType.LESS, TokenType.LESS_EQUAL,
-            TokenType.GREATER, TokenType.GREATER_EQUAL
-        ):
-            op = self._consume()
-            right = self._parse_term()
-            left = BinaryOp(op.type, left, right)
-        return left
-
-    def _parse_term(self):
-        left = self._parse_factor()
-        while self._current().type in (TokenType.PLUS, TokenType.MINUS):
-            op = self._consume()
-            right = self._parse_factor()
-            left = BinaryOp(op.type, left, right)
-        return left
-
-    def _parse_factor(self):
-        left = self._parse_unary()
-        while self._current().type in (TokenType.STAR, TokenType.SLASH, TokenType.PERCENT):
-            op = self._consume()
-            right = self._parse_unary()
-            left = BinaryOp(op.type, left, right)
-        return left
-
-    def _parse_unary(self):
-        # No unary operators in v0.0.3a
-        return self._parse_call()
-
-    def _parse_call(self):
-        expr = self._parse_primary()
-        while self._match(TokenType.LPAREN):
-            args = []
-            if self._current().type != TokenType.RPAREN:
-                args.append(self._parse_expression())
-                while self._match(TokenType.COMMA):
-                    args.append(self._parse_expression())
-            self._consume(TokenType.RPAREN)
-            expr = Call(expr, args)
-        return expr
-
-    def _parse_primary(self):
-        token = self._current()
-        if token.type == TokenType.NUMBER:
-            self.pos += 1
-            return Number(token.value)
-        elif token.type == TokenType.STRING:
-            self.pos += 1
-            return String(token.value)
-        elif token.type == TokenType.BOOL:
-            self.pos += 1
-            return Bool(token.value)
-        elif token.type == TokenType.IDENTIFIER:
-            self.pos += 1
-            return Identifier(token.value)
-        elif token.type == TokenType.LPAREN:
-            self.pos += 1
-            expr = self._parse_expression()
-            self._consume(TokenType.RPAREN)
-            return expr
-        else:
-            raise SyntaxError(f"Unexpected token: {token.type}")
+        # Operator precedence parsing over explicit stacks rather than one
+        # recursive call per precedence level: a literal costs one table
+        # lookup, and parentheses, arguments, elements and indexes can nest
+        # to any depth. `operands` and `operators` belong to the innermost
+        # open group; `groups` saves the enclosing ones with the group's
+        # kind, callee or indexed value, and items parsed so far.
+        types = self.types
+        values = self.values
+        pos = self.pos
+        operands = []
+        operators = []
+        groups = []
+        operand = None
+        while True:
+            if operand is None:
+                token_type = types[pos]
+                atom = ATOMS.get(token_type)
+                if atom is not None:
+                    operand = atom(values[pos])
+                    pos += 1
+                elif token_type == TokenType.LPAREN:
+                    pos += 1
+                    groups.append((_PAREN, None, None, operands, operators))
+                    operands = []
+                    operators = []
+                    continue
+                elif token_type == TokenType.LBRACKET:
+                    pos += 1
+                    if types[pos] == TokenType.RBRACKET:
+                        pos += 1
+                        operand = Array([])
+                    else:
+                        groups.append((_ARRAY, None, [], operands, operators))
+                        operands = []
+                        operators = []
+                        continue
+                else:
+                    raise syntax_error(f"Unexpected token: {token_type}", self.positions[pos])
+            token_type = types[pos]
+            # Calls and indexing bind tightest: f(x)[i](y)
+            if token_type == TokenType.LPAREN:
+                pos += 1
+                if types[pos] == TokenType.RPAREN:
+                    pos += 1
+                    operand = Call(operand, [])
+                    continue
+                groups.append((_CALL, operand, [], operands, operators))
+            elif token_type == TokenType.LBRACKET:
+                pos += 1
+                groups.append((_INDEX, operand, None, operands, operators))
+            else:
+                precedence = BINARY_PRECEDENCE.get(token_type)
+                if precedence is not None:
+                    # Every operator is left-associative
+                    pos += 1
+                    while operators and BINARY_PRECEDENCE[operators[-1]] >= precedence:
+                        operand = BinaryOp(operators.pop(), operands.pop(), operand)
+                    operands.append(operand)
+                    operators.append(token_type)
+                    operand = None
+                    continue
+                while operators:
+                    operand = BinaryOp(operators.pop(), operands.pop(), operand)
+                if not groups:
+                    self.pos = pos
+                    return operand
+                kind, target, items, operands, operators = groups.pop()
+                if items is not None:
+                    items.append(operand)
+                    if token_type == TokenType.COMMA:
+                        pos += 1
+                        groups.append((kind, target, items, operands, operators))
+                        operands = []
+                        operators = []
+                        operand = None
+                        continue
+                closing = TokenType.RBRACKET if kind == _ARRAY or kind == _INDEX else TokenType.RPAREN
+                if token_type != closing:
+                    self.pos = pos
+                    self._consume(closing)
+                pos += 1
+                if kind == _CALL:
+                    operand = Call(target, items)
+                elif kind == _ARRAY:
+                    operand = Array(items)
+                elif kind == _INDEX:
+                    operand = Index(target, operand)
+                continue
+            operands = []
+            operators = []
+            operand = None
 
     def _peek_type(self, n):
         idx = self.pos + n
-        if idx < len(self.tokens):
-            return self.tokens[idx].type
+        if idx < len(self.types):
+            return self.types[idx]
+        if self.types and self.types[-1] != TokenType.EOF:
+            # A TokenStream buffer ran out; StreamParser refills and retries
+            raise IndexError("token buffer exhausted")
         return TokenType.EOF
+
+class StreamParser(Parser):
+    # Parses from a TokenStream one top-level statement at a time. Running
+    # off the end of the buffered tokens raises IndexError; the statement
+    # is then parsed again from its first token after more batches have
+    # been appended, so the parser itself never needs to know about chunks.
+    # Each retry at least doubles the tokens buffered for the statement, so
+    # one that spans many chunks is parsed a logarithmic number of times
+    # and costs linear time overall.
+    def __init__(self, stream):
+        if not isinstance(stream, TokenStream):
+            raise TypeError("Expected a TokenStream")
+        super().__init__(stream)
+
+    def parse_statements(self):
+        tokens = self.tokens
+        tokens.fill()
+        while True:
+            start = self.pos
+            try:
+                if self.types[self.pos] == TokenType.EOF:
+                    return
+                stmt = self._parse_statement()
+                if self.types[self.pos] == TokenType.SEMICOLON:
+                    self.pos += 1
+            except IndexError:
+                if tokens.exhausted:
+                    raise
+                # Tokens before this statement are no longer needed
+                pending = len(tokens) - start
+                tokens.fill(start)
+                while len(tokens) < 2 * pending and tokens.fill():
+                    pass
+                self.pos = 0
+                continue
+            yield stmt
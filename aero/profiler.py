@@ -0,0 +1,200 @@
+import json
+import time
+from .ast import Program, Block, Assign, If, While
+from .lexer import SourceMap
+from .vm import VirtualMachine
+
+class NodeStats:
+    __slots__ = ('node', 'parent', 'count', 'total', 'own', 'iterations')
+
+    def __init__(self, node, parent):
+        self.node = node
+        self.parent = parent
+        self.count = 0
+        self.total = 0.0
+        self.own = 0.0
+        self.iterations = 0
+
+class ProfilingVM(VirtualMachine):
+    # Tree walker that times every statement it executes. Only nodes the
+    # parser gave a source span (statements) are measured; expressions are
+    # charged to the statement that evaluates them. The plain VMs carry no
+    # profiling hooks at all, so profiling costs nothing when it is off.
+    def __init__(self, output=None):
+        super().__init__(output)
+        self.stats = {}
+        self.stacks = {}
+        self.elapsed = 0.0
+        self._path = ()
+        self._child_times = []
+
+    def execute(self, program):
+        start = time.perf_counter()
+        try:
+            super().execute(program)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def _execute(self, statements):
+        # Statements nest through _eval here rather than on the plain VM's
+        # work stack, so that each one is timed on its way through
+        for stmt in statements:
+            self._eval(stmt)
+
+    def _eval(self, node):
+        if node.pos is None:
+            return self._walk(node, None)
+        stats = self.stats.get(node)
+        if stats is None:
+            stats = self.stats[node] = NodeStats(node, self._path[-1] if self._path else None)
+        parent_path = self._path
+        self._path = parent_path + (node,)
+        child_times = self._child_times
+        child_times.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._walk(node, stats)
+        finally:
+            elapsed = time.perf_counter() - start
+            own = elapsed - child_times.pop()
+            if child_times:
+                child_times[-1] += elapsed
+            stats.count += 1
+            stats.total += elapsed
+            stats.own += own
+            self.stacks[self._path] = self.stacks.get(self._path, 0.0) + own
+            self._path = parent_path
+
+    def _walk(self, node, stats):
+        if isinstance(node, (Program, Block)):
+            self._execute(node.statements)
+        elif isinstance(node, Assign):
+            self.variables[node.name] = self._evaluate(node.value)
+        elif isinstance(node, If):
+            if self._eval(node.condition):
+                self._eval(node.then_branch)
+            elif node.else_branch:
+                self._eval(node.else_branch)
+        elif isinstance(node, While):
+            iterations = 0
+            try:
+                while self._eval(node.condition):
+                    self._eval(node.body)
+                    iterations += 1
+            finally:
+                if stats is not None:
+                    stats.iterations += iterations
+        else:
+            return self._evaluate(node)
+
+class Profile:
+    # Aggregates ProfilingVM measurements per statement, per source line and
+    # per node type, and renders them as text, JSON or collapsed stacks
+    # (the input format of flamegraph.pl and speedscope).
+    def __init__(self, vm, source, name="<program>"):
+        self.vm = vm
+        self.source_map = SourceMap(source)
+        self.name = name
+
+    def _line(self, node):
+        return self.source_map.location(node.pos)[0]
+
+    def _label(self, node):
+        return f"{type(node).__name__}:{self._line(node)}"
+
+    def nodes(self):
+        result = []
+        for stats in self.vm.stats.values():
+            node = stats.node
+            line, col = self.source_map.location(node.pos)
+            end_line, end_col = self.source_map.location(node.end)
+            result.append({
+                'type': type(node).__name__,
+                'line': line, 'col': col, 'end_line': end_line, 'end_col': end_col,
+                'count': stats.count, 'cumulative': stats.total, 'self': stats.own,
+                'iterations': stats.iterations,
+            })
+        result.sort(key=lambda entry: (entry['line'], entry['col']))
+        return result
+
+    def lines(self):
+        # A statement nested in another one on the same line is already part
+        # of the outer one's cumulative time
+        lines = {}
+        for stats in self.vm.stats.values():
+            line = self._line(stats.node)
+            entry = lines.get(line)
+            if entry is None:
+                entry = lines[line] = {'line': line, 'count': 0, 'cumulative': 0.0, 'self': 0.0, 'iterations': 0}
+            entry['count'] += stats.count
+            entry['self'] += stats.own
+            entry['iterations'] += stats.iterations
+            if stats.parent is None or self._line(stats.parent) != line:
+                entry['cumulative'] += stats.total
+        return [lines[line] for line in sorted(lines)]
+
+    def types(self):
+        types = {}
+        for stats in self.vm.stats.values():
+            name = type(stats.node).__name__
+            entry = types.get(name)
+            if entry is None:
+                entry = types[name] = {'type': name, 'count': 0, 'cumulative': 0.0, 'self': 0.0, 'iterations': 0}
+            entry['count'] += stats.count
+            entry['self'] += stats.own
+            entry['iterations'] += stats.iterations
+            if not self._nested_in_same_type(stats):
+                entry['cumulative'] += stats.total
+        return sorted(types.values(), key=lambda entry: -entry['self'])
+
+    def _nested_in_same_type(self, stats):
+        kind = type(stats.node)
+        parent = stats.parent
+        while parent is not None:
+            if type(parent) is kind:
+                return True
+            parent = self.vm.stats[parent].parent
+        return False
+
+    def collapsed(self):
+        lines = []
+        for path, own in self.vm.stacks.items():
+            micros = int(round(own * 1e6))
+            if micros <= 0:
+                continue
+            frames = [self.name] + [self._label(node) for node in path]
+            lines.append(f"{';'.join(frames)} {micros}")
+        lines.sort()
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        return json.dumps({
+            'name': self.name,
+            'elapsed': self.vm.elapsed,
+            'lines': self.lines(),
+            'types': self.types(),
+            'nodes': self.nodes(),
+        }, indent=2)
+
+    def report(self):
+        executed = sum(stats.count for stats in self.vm.stats.values())
+        out = [f"Profile of {self.name}: {executed:,} statements in {self.vm.elapsed:.6f}s", ""]
+        out.append(f"{'line':>6} {'count':>10} {'loops':>10} {'cum ms':>10} {'self ms':>10}  source")
+        for entry in self.lines():
+            source = self.source_map.line(entry['line']).strip()
+            if len(source) > 40:
+                source = source[:37] + "..."
+            loops = entry['iterations'] or ""
+            out.append(f"{entry['line']:>6} {entry['count']:>10,} {loops:>10} "
+                       f"{entry['cumulative'] * 1e3:>10.3f} {entry['self'] * 1e3:>10.3f}  {source}")
+        out.append("")
+        out.append(f"{'node':<10} {'count':>6} {'loops':>10} {'cum ms':>10} {'self ms':>10}")
+        for entry in self.types():
+            loops = entry['iterations'] or ""
+            out.append(f"{entry['type']:<10} {entry['count']:>6,} {loops:>10} "
+                       f"{entry['cumulative'] * 1e3:>10.3f} {entry['self'] * 1e3:>10.3f}")
+        return "\n".join(out)
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            f.write(self.to_json() if path.endswith('.json') else self.collapsed())
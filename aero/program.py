@@ -0,0 +1,96 @@
+from .bytecode import Code
+from .compiler import compile_source, compile_program
+from .optimizer import optimize
+from .cache import compile_cached
+from .output import Output
+from .vm import BytecodeVM
+from .runtime import make_array
+
+INPUT_TYPES = (int, str, bool)
+
+class RunResult:
+    __slots__ = ('output', 'variables', 'error')
+
+    def __init__(self, output, variables, error=None):
+        self.output = output
+        self.variables = variables
+        self.error = error
+
+    def __repr__(self):
+        if self.error is not None:
+            return f"RunResult(error={self.error!r})"
+        return f"RunResult({len(self.output)} chars of output, {len(self.variables)} variables)"
+
+    def __reduce__(self):
+        return (RunResult, (self.output, self.variables, self.error))
+
+class CompiledProgram:
+    # A script compiled once to bytecode, to be run any number of times.
+    # Every run starts from fresh variables; names listed in `inputs` may be
+    # seeded per run and are the only names a script may read without
+    # assigning them first. Instances are immutable and pickle to plain
+    # tuples, so they can be shipped to worker processes (see aero.batch).
+    __slots__ = ('name', 'inputs', 'code', '_input_slots')
+
+    def __init__(self, name, inputs, code):
+        code = Code(tuple(code.instructions), tuple(code.constants), tuple(code.names),
+                    tuple(code.builtins), tuple(code.calls), tuple(code.loops), code.cooperative)
+        inputs = tuple(inputs)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'inputs', inputs)
+        object.__setattr__(self, 'code', code)
+        object.__setattr__(self, '_input_slots', {input_name: code.names.index(input_name) for input_name in inputs})
+
+    @classmethod
+    def from_ast(cls, program, name="<program>", inputs=()):
+        return cls(name, inputs, compile_program(program, inputs=inputs))
+
+    @classmethod
+    def from_source(cls, source, name="<string>", inputs=(), opt_level=1):
+        return cls.from_ast(optimize(compile_source(source, name), opt_level, inputs), name, inputs)
+
+    @classmethod
+    def from_file(cls, filepath, inputs=(), opt_level=1, use_cache=True):
+        return cls.from_ast(compile_cached(filepath, opt_level, use_cache, inputs=inputs), filepath, inputs)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledProgram is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CompiledProgram is immutable")
+
+    def __reduce__(self):
+        return (CompiledProgram, (self.name, self.inputs, self.code))
+
+    def __repr__(self):
+        return f"CompiledProgram({self.name!r}, inputs={self.inputs})"
+
+    def _preset(self, inputs):
+        preset = {}
+        for name, value in inputs.items():
+            if name not in self._input_slots:
+                raise NameError(f"Unknown input: {name}")
+            if isinstance(value, (list, tuple)):
+                # Sequences of ints come in as arrays
+                value = make_array(value)
+            elif not isinstance(value, INPUT_TYPES):
+                raise TypeError(f"Input {name} must be an int, str, bool or list of ints, not {type(value).__name__}")
+            preset[self._input_slots[name]] = value
+        return preset
+
+    def run(self, inputs=None, output=None):
+        # Returns the variables left at the end of the run; printed text
+        # goes to `output` (anything BytecodeVM accepts, stdout by default)
+        vm = BytecodeVM(output)
+        vm.execute(self.code, self._preset(inputs) if inputs else None)
+        return vm.variables
+
+    def capture(self, inputs=None):
+        # Runs once and reports the outcome instead of raising
+        chunks = []
+        variables = {}
+        try:
+            variables = self.run(inputs, Output(chunks.append, line_buffered=False))
+        except Exception as e:
+            return RunResult("".join(chunks), variables, str(e))
+        return RunResult("".join(chunks), variables)
@@ -0,0 +1,197 @@
+import operator
+import weakref
+from .bytecode import *
+from .runtime import StringBuilder, add, concat
+
+# Operation sites whose operands are two loads: a slot and a constant, two
+# slots, or a constant and a slot. Quickening rewrites the first load into a
+# single QUICK_* instruction that reads both operands, applies the operation
+# and either pushes the result or, for a fused compare-and-branch, jumps.
+# The original loads stay in place behind it, so a jump into the middle of
+# the sequence still runs the unquickened instructions.
+#
+# `+` is the one operation whose generic path depends on the operand types.
+# An add site starts out generic and counts its executions; after WARMUP of
+# them it specializes on the types it last saw, to int+int or str+any, and
+# guards the slot operands from then on. A failed guard de-specializes the
+# site back to the generic path, and after MAX_DEOPTS failures it stays
+# there. The other operations map directly onto Python's operators and need
+# no guard.
+
+WARMUP = 8
+MAX_DEOPTS = 4
+
+# Generic function and the symbol reported in statistics per operation
+OPERATIONS = {
+    BINARY_ADD: (add, "+"),
+    BINARY_SUB: (operator.sub, "-"),
+    BINARY_MUL: (operator.mul, "*"),
+    BINARY_DIV: (operator.floordiv, "/"),  # Integer division
+    BINARY_MOD: (operator.mod, "%"),
+    COMPARE_EQ: (operator.eq, "=="),
+    COMPARE_NE: (operator.ne, "!="),
+    COMPARE_LT: (operator.lt, "<"),
+    COMPARE_LE: (operator.le, "<="),
+    COMPARE_GT: (operator.gt, ">"),
+    COMPARE_GE: (operator.ge, ">="),
+    JUMP_IF_NOT_EQ: (operator.eq, "=="),
+    JUMP_IF_NOT_NE: (operator.ne, "!="),
+    JUMP_IF_NOT_LT: (operator.lt, "<"),
+    JUMP_IF_NOT_LE: (operator.le, "<="),
+    JUMP_IF_NOT_GT: (operator.gt, ">"),
+    JUMP_IF_NOT_GE: (operator.ge, ">="),
+}
+
+class Site:
+    # `left` and `right` are slot indexes or constant values depending on
+    # the QUICK_* op. The VM checks `left_type`/`right_type` against slot
+    # operands only; a constant's type is checked once, when specializing.
+    __slots__ = ('op', 'func', 'left', 'right', 'left_type', 'right_type',
+                 'jump', 'resume', 'kind', 'warmup', 'specializations', 'deopts')
+
+    def __init__(self, op, left, right, jump, resume):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.left_type = None
+        self.right_type = None
+        self.jump = jump
+        self.resume = resume
+        self.specializations = 0
+        self.deopts = 0
+        if op == BINARY_ADD:
+            self._generic(WARMUP)
+        else:
+            self.func, self.kind = OPERATIONS[op]
+            self.warmup = 0
+
+    def _generic(self, warmup):
+        self.left_type = None
+        self.right_type = None
+        self.warmup = warmup
+        self.kind = "+"
+        self.func = self._observe if warmup else add
+
+    def _observe(self, left, right):
+        self.warmup -= 1
+        if not self.warmup:
+            self._specialize(left, right)
+        return add(left, right)
+
+    def _specialize(self, left, right):
+        if type(left) is int and type(right) is int:
+            self.func = operator.add
+            self.kind = "int+int"
+            self.left_type = self.right_type = int
+        elif type(left) is str or type(left) is StringBuilder:
+            self.func = concat
+            self.kind = "str+any"
+            self.left_type = type(left)
+        else:
+            self.func = add
+            return
+        self.specializations += 1
+
+    def deopt(self):
+        # Called by the VM when a guard fails; the VM then calls `func`,
+        # which is generic again
+        self.deopts += 1
+        self._generic(WARMUP << self.deopts if self.deopts < MAX_DEOPTS else 0)
+
+OPERAND_LOADS = {
+    (LOAD_SLOT, LOAD_CONST): QUICK_SLOT_CONST,
+    (LOAD_SLOT, LOAD_SLOT): QUICK_SLOT_SLOT,
+    (LOAD_CONST, LOAD_SLOT): QUICK_CONST_SLOT,
+}
+
+def quicken(code):
+    # Returns (instructions, sites) for the VM to run in place of
+    # code.instructions, building them on first use
+    if code.adaptive is not None:
+        return code.adaptive
+    original = code.instructions
+    constants = code.constants
+    instructions = list(original)
+    sites = []
+    pc = 0
+    end = len(original) - 4
+    while pc < end:
+        quick_op = OPERAND_LOADS.get((original[pc], original[pc + 2]))
+        op = original[pc + 4]
+        if quick_op is None or op not in OPERATIONS:
+            pc += 2
+            continue
+        left = original[pc + 1]
+        right = original[pc + 3]
+        if quick_op == QUICK_SLOT_CONST:
+            right = constants[right]
+        elif quick_op == QUICK_CONST_SLOT:
+            left = constants[left]
+        jump = original[pc + 5] if op in JUMP_OPS else None
+        instructions[pc] = quick_op
+        instructions[pc + 1] = len(sites)
+        sites.append(Site(op, left, right, jump, pc + 6))
+        pc += 6
+    code.adaptive = (instructions, sites)
+    return code.adaptive
+
+class QuickeningStats:
+    # Totals over the operation sites of quickened code objects
+    def __init__(self):
+        self.sites = 0
+        self.specialized = 0
+        self.specializations = 0
+        self.deopts = 0
+        self.kinds = {}
+        # What each live Code added last, taken back when it is added again
+        self._counted = weakref.WeakKeyDictionary()
+
+    def add_code(self, code):
+        # Sites live on their Code and keep counting when it runs again, so
+        # a Code added again replaces its earlier figures
+        if code.adaptive is not None:
+            previous = self._counted.get(code)
+            if previous is not None:
+                self._merge(previous, -1)
+            counted = QuickeningStats()
+            for site in code.adaptive[1]:
+                counted.add(site)
+            self._merge(counted, 1)
+            self._counted[code] = counted
+
+    def add(self, site):
+        self.sites += 1
+        if site.left_type is not None:
+            self.specialized += 1
+        self.specializations += site.specializations
+        self.deopts += site.deopts
+        self.kinds[site.kind] = self.kinds.get(site.kind, 0) + 1
+
+    def _merge(self, other, sign):
+        self.sites += sign * other.sites
+        self.specialized += sign * other.specialized
+        self.specializations += sign * other.specializations
+        self.deopts += sign * other.deopts
+        for kind, count in other.kinds.items():
+            total = self.kinds.get(kind, 0) + sign * count
+            if total:
+                self.kinds[kind] = total
+            else:
+                del self.kinds[kind]
+
+    def to_dict(self):
+        return {
+            'sites': self.sites,
+            'specialized': self.specialized,
+            'specializations': self.specializations,
+            'deopts': self.deopts,
+            'kinds': dict(self.kinds),
+        }
+
+    def report(self):
+        lines = [f"quickened sites: {self.sites}",
+                 f"specialized now: {self.specialized} "
+                 f"({self.specializations} specializations, {self.deopts} de-specializations)"]
+        for kind, count in sorted(self.kinds.items(), key=lambda item: (-item[1], item[0])):
+            lines.append(f"  {kind:<10} {count}")
+        return "\n".join(lines)
@@ -0,0 +1,106 @@
+from .ast import *
+from .runtime import BUILTIN_NAMES, UNBOUND, materialize
+
+def resolve(program, builtins=BUILTIN_NAMES, scope=None, strict=True):
+    return Resolver(builtins, scope, strict).resolve(program)
+
+class Scope:
+    # Aero has a single global scope. Every assigned name gets a fixed slot
+    # index; names that are only ever read must be builtins and are bound
+    # by index into `builtins` instead. A scope only ever grows, so code
+    # compiled against it earlier stays valid.
+    def __init__(self, names=(), builtins=()):
+        self.names = []
+        self.builtins = []
+        self.slots = {}
+        self.builtin_slots = {}
+        for name in names:
+            self.add(name)
+        for name in builtins:
+            self.add_builtin(name)
+
+    def __repr__(self):
+        return f"Scope({len(self.names)} slots, builtins={self.builtins})"
+
+    def add(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.names)
+            self.names.append(name)
+        return self.slots[name]
+
+    def add_builtin(self, name):
+        if name not in self.builtin_slots:
+            self.builtin_slots[name] = len(self.builtins)
+            self.builtins.append(name)
+        return self.builtin_slots[name]
+
+    def variables(self, slots):
+        return {name: materialize(value) for name, value in zip(self.names, slots) if value is not UNBOUND}
+
+class Resolver:
+    # With strict=False a name that is neither assigned nor a builtin gets a
+    # slot anyway and fails at runtime if it is still unbound when read;
+    # this is what code compiled one statement at a time needs, since a
+    # later statement may still assign it.
+    def __init__(self, builtins=BUILTIN_NAMES, scope=None, strict=True):
+        self.known_builtins = frozenset(builtins)
+        self.scope = scope if scope is not None else Scope()
+        self.strict = strict
+        self.assigned = {}
+        self.reads = {}
+
+    def resolve(self, program):
+        if not isinstance(program, Program):
+            raise TypeError("Expected Program AST node")
+        self._visit_all(program.statements)
+        scope = self.scope
+        for name in self.assigned:
+            scope.add(name)
+        for name in self.reads:
+            if name in scope.slots:
+                continue
+            if name in self.known_builtins:
+                scope.add_builtin(name)
+            elif self.strict:
+                raise NameError(f"Undefined name: {name}")
+            else:
+                scope.add(name)
+        return scope
+
+    def _visit_all(self, nodes):
+        # Visits the nodes in source order from an explicit stack, so that
+        # deep trees need no deep recursion; an Assign leaves its name on
+        # the stack to be recorded once its value has been visited
+        assigned = self.assigned
+        reads = self.reads
+        pending = list(reversed(nodes))
+        while pending:
+            node = pending.pop()
+            if isinstance(node, str):
+                assigned[node] = None
+            elif isinstance(node, Identifier):
+                reads[node.name] = None
+            elif isinstance(node, BinaryOp):
+                pending.append(node.right)
+                pending.append(node.left)
+            elif isinstance(node, Assign):
+                pending.append(node.name)
+                pending.append(node.value)
+            elif isinstance(node, (Program, Block)):
+                pending.extend(reversed(node.statements))
+            elif isinstance(node, If):
+                if node.else_branch:
+                    pending.append(node.else_branch)
+                pending.append(node.then_branch)
+                pending.append(node.condition)
+            elif isinstance(node, While):
+                pending.append(node.body)
+                pending.append(node.condition)
+            elif isinstance(node, Call):
+                pending.extend(reversed(node.args))
+                pending.append(node.func)
+            elif isinstance(node, Array):
+                pending.extend(reversed(node.elements))
+            elif isinstance(node, Index):
+                pending.append(node.index)
+                pending.append(node.value)
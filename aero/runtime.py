@@ -0,0 +1,130 @@
+import operator
+from .lexer import TokenType
+from .strings import StringBuilder, concat
+from .arrays import IntArray, make_array, arange, type_name
+
+# Operator semantics shared by every engine. Values are plain Python ints,
+# strs and bools, plus StringBuilders standing in for long strs and
+# IntArrays; `+` concatenates as soon as either side is a string and `/` is
+# integer division.
+
+def materialize(value):
+    # The plain value: a str in place of a StringBuilder and a list of ints
+    # in place of an IntArray
+    if type(value) is StringBuilder:
+        return str(value)
+    if type(value) is IntArray:
+        return value.tolist()
+    return value
+
+def add(left, right):
+    if isinstance(left, (str, StringBuilder)) or isinstance(right, (str, StringBuilder)):
+        return concat(left, right)
+    return left + right
+
+# Engines short-circuit && and || themselves; these only serve callers that
+# already hold both operand values, such as constant folding
+def logical_and(left, right):
+    return bool(left) and bool(right)
+
+def logical_or(left, right):
+    return bool(left) or bool(right)
+
+BINARY_FUNCS = {
+    TokenType.PLUS: add,
+    TokenType.MINUS: operator.sub,
+    TokenType.STAR: operator.mul,
+    TokenType.SLASH: operator.floordiv,  # Integer division
+    TokenType.PERCENT: operator.mod,
+    TokenType.EQUAL: operator.eq,
+    TokenType.NOT_EQUAL: operator.ne,
+    TokenType.LESS: operator.lt,
+    TokenType.LESS_EQUAL: operator.le,
+    TokenType.GREATER: operator.gt,
+    TokenType.GREATER_EQUAL: operator.ge,
+    TokenType.AND: logical_and,
+    TokenType.OR: logical_or,
+}
+
+def _int_args(name, args):
+    for value in args:
+        if type(value) is not int and type(value) is not bool:
+            raise TypeError(f"{name}() arguments must be ints, not '{type_name(value)}'")
+
+def builtin_range(*args):
+    # range(stop), range(start, stop) or range(start, stop, step), as an array
+    if not 1 <= len(args) <= 3:
+        raise TypeError(f"range() takes 1 to 3 arguments ({len(args)} given)")
+    _int_args("range", args)
+    start, stop, step = (0, args[0], 1) if len(args) == 1 else (args + (1,))[:3]
+    if step == 0:
+        raise ValueError("range() step must not be zero")
+    return arange(int(start), int(stop), int(step))
+
+def builtin_len(*args):
+    if len(args) != 1:
+        raise TypeError(f"len() takes exactly one argument ({len(args)} given)")
+    value = args[0]
+    if not isinstance(value, (IntArray, str, StringBuilder)):
+        raise TypeError(f"Value of type '{type_name(value)}' has no len()")
+    return len(value)
+
+def builtin_sum(*args):
+    if len(args) != 1 or type(args[0]) is not IntArray:
+        raise TypeError("sum() takes exactly one array")
+    return args[0].total()
+
+def _extreme(name, args):
+    # min() and max() of one array's elements, or of two or more values
+    if len(args) == 1:
+        if type(args[0]) is not IntArray:
+            raise TypeError(f"{name}() takes an array or at least two values")
+        return args[0].minimum() if name == "min" else args[0].maximum()
+    if not args:
+        raise TypeError(f"{name}() takes an array or at least two values")
+    for value in args:
+        if type(value) is IntArray:
+            raise TypeError(f"{name}() of several values cannot take an array")
+    return (min if name == "min" else max)(args)
+
+def builtin_min(*args):
+    return _extreme("min", args)
+
+def builtin_max(*args):
+    return _extreme("max", args)
+
+def subscript(value, index):
+    # value[index] for arrays and strings; negative indexes count from the end
+    if type(index) is not int and type(index) is not bool:
+        raise TypeError(f"Indexes must be ints, not '{type_name(index)}'")
+    index = int(index)
+    if type(value) is IntArray:
+        return value.item(index)
+    if isinstance(value, (str, StringBuilder)):
+        text = str(value)
+        if not -len(text) <= index < len(text):
+            raise IndexError("string index out of range")
+        return text[index]
+    raise TypeError(f"Value of type '{type_name(value)}' cannot be indexed")
+
+# Builtin functions every VM provides next to print, which writes to the
+# VM's own output
+BUILTIN_FUNCS = {
+    'range': builtin_range,
+    'len': builtin_len,
+    'sum': builtin_sum,
+    'min': builtin_min,
+    'max': builtin_max,
+}
+
+# Names every VM provides before any assignment
+BUILTIN_NAMES = ('print',) + tuple(BUILTIN_FUNCS)
+
+class _Unbound:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<unbound>"
+
+# Marks a variable slot that has not been assigned yet
+UNBOUND = _Unbound()
@@ -0,0 +1,377 @@
+import io
+import os
+import stat
+import time
+import pickle
+import signal
+import socket
+import selectors
+from contextlib import redirect_stdout, redirect_stderr
+from . import __version__
+from .cache import source_hash, compile_cached
+from .compiler import compile_program
+from .client import (FRAME_HEADER, REQUEST, ACCEPTED, STDOUT, STDERR, EXIT, REFUSED, runs_locally,
+                     default_socket_path, shared_socket_directory)
+
+DEFAULT_MAX_PROGRAMS = 256
+# Seconds a client has to send its request
+REQUEST_TIMEOUT = 5
+# Largest piece of a request read at a time
+RECV_SIZE = 1 << 16
+# Seconds between checks for finished workers
+REAP_INTERVAL = 1
+
+class CachedProgram:
+    def __init__(self, digest, ast):
+        self.digest = digest
+        self.ast = ast
+        self._code = None
+
+    @property
+    def code(self):
+        return self.compile()
+
+    @property
+    def compiled(self):
+        return self._code is not None
+
+    def compile(self):
+        # Compiles on first use and keeps the bytecode, so later runs skip
+        # compiling
+        if self._code is None:
+            self._code = compile_program(self.ast)
+        return self._code
+
+class ProgramCache:
+    # Optimized ASTs and bytecode by (path, optimization level, flat AST).
+    # Entries are checked against the source hash on every load and the
+    # least recently used are dropped past max_programs.
+    def __init__(self, max_programs=DEFAULT_MAX_PROGRAMS):
+        self.max_programs = max_programs
+        self._programs = {}
+
+    def key(self, filepath, opt_level=1, flat=False):
+        return (os.path.abspath(filepath), opt_level, flat)
+
+    def get(self, key):
+        # The entry as it is, whether or not its source has changed since
+        return self._programs.get(key)
+
+    def load(self, filepath, opt_level=1, flat=False):
+        key = self.key(filepath, opt_level, flat)
+        with open(filepath, 'r') as f:
+            digest = source_hash(f.read())
+        program = self._programs.get(key)
+        if program is None or program.digest != digest:
+            program = CachedProgram(digest, compile_cached(filepath, opt_level, flat=flat))
+        self.add(key, program)
+        return program
+
+    def add(self, key, program):
+        # Stores the entry as the most recently used one
+        self._programs.pop(key, None)
+        self._programs[key] = program
+        if len(self._programs) > self.max_programs:
+            del self._programs[next(iter(self._programs))]
+
+def _send(sock, kind, text=""):
+    data = text.encode()
+    sock.sendall(FRAME_HEADER.pack(kind, len(data)) + data)
+
+class _Channel:
+    # Stands in for sys.stdout or sys.stderr while a request runs, sending
+    # every write to the client as one frame
+    def __init__(self, sock, kind, tty):
+        self.sock = sock
+        self.kind = kind
+        self.tty = tty
+
+    def write(self, text):
+        if text:
+            _send(self.sock, self.kind, text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.tty
+
+class _PendingRequest:
+    # A connection whose request frame is still arriving. It is read as the
+    # socket turns readable, so a slow client holds up no other client.
+    __slots__ = ('conn', 'deadline', 'data')
+
+    def __init__(self, conn, deadline):
+        self.conn = conn
+        self.deadline = deadline
+        self.data = b''
+
+    def read(self):
+        # Returns (kind, payload) once the whole frame is in, None before
+        chunk = self.conn.recv(RECV_SIZE)
+        if not chunk:
+            raise ConnectionError("client closed the connection")
+        self.data += chunk
+        if len(self.data) < FRAME_HEADER.size:
+            return None
+        kind, size = FRAME_HEADER.unpack_from(self.data)
+        end = FRAME_HEADER.size + size
+        if len(self.data) < end:
+            return None
+        return kind, self.data[FRAME_HEADER.size:end].decode()
+
+class _WorkerResult:
+    # The daemon's end of the pipe a worker sends what `prepare` returned
+    # through, and what has arrived of it so far
+    __slots__ = ('fd', 'data')
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.data = b''
+
+class Server:
+    # Runs scripts for `aero` clients over a Unix domain socket. Every
+    # request runs in a worker forked for it, so runs proceed in parallel,
+    # and the worker is killed when its client disconnects: a script that
+    # never finishes holds up no one and stops with its caller. `run(argv)`
+    # runs one command line in the worker and returns its exit status (see
+    # cli.serve_main); it runs in the client's working directory with
+    # sys.stdout and sys.stderr sent to the client. `prepare(argv)`, when
+    # given, runs in the worker just before `run`, in the same directory
+    # and with its output discarded. Whatever it returns other than None
+    # is pickled back to the daemon and handed to `adopt(value)` there, so
+    # slow work such as compiling a large script never stalls the daemon
+    # while the runs after it still benefit. Modules stay imported between
+    # runs, and so does whatever `adopt` keeps; what `run` caches is lost
+    # with its worker.
+    def __init__(self, run, path=None, prepare=None, adopt=None):
+        self.run = run
+        self.path = path or default_socket_path()
+        self.prepare = prepare
+        self.adopt = adopt
+        self.requests = 0
+        # Connection per running worker's pid
+        self.workers = {}
+        # _PendingRequest per connection whose request is still arriving
+        self.pending = {}
+        # _WorkerResult per pipe a worker has not finished sending through
+        self.results = {}
+
+    def serve_forever(self):
+        self._make_directory()
+        self._remove_stale_socket()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only the owner may connect: runs read files as the server's user
+        old_umask = os.umask(0o177)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        sock.listen(64)
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        try:
+            while True:
+                timeout = REAP_INTERVAL
+                if self.pending:
+                    deadline = min(pending.deadline for pending in self.pending.values())
+                    timeout = max(0, min(timeout, deadline - time.monotonic()))
+                for key, _ in selector.select(timeout):
+                    if key.fileobj is sock:
+                        conn, _ = sock.accept()
+                        conn.setblocking(False)
+                        pending = _PendingRequest(conn, time.monotonic() + REQUEST_TIMEOUT)
+                        self.pending[conn] = pending
+                        selector.register(conn, selectors.EVENT_READ, pending)
+                    elif isinstance(key.data, _PendingRequest):
+                        self._read_request(key.data, sock, selector)
+                    elif isinstance(key.data, _WorkerResult):
+                        self._read_result(key.data, selector)
+                    else:
+                        # A client sends nothing after its request, so its
+                        # connection turns readable when it goes away
+                        selector.unregister(key.fileobj)
+                        self._kill(key.data)
+                self._expire(selector)
+                self._reap(selector)
+        finally:
+            for conn in self.pending:
+                conn.close()
+            for fd in self.results:
+                os.close(fd)
+            for pid in list(self.workers):
+                self._kill(pid)
+            self._reap(selector, block=True)
+            selector.close()
+            sock.close()
+            os.unlink(self.path)
+
+    def _make_directory(self):
+        # The default directory under /tmp is created private, and must
+        # have stayed private, before the socket goes in it
+        directory = os.path.dirname(self.path)
+        if directory != shared_socket_directory():
+            return
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise RuntimeError(f"{directory} is not a directory private to this user")
+
+    def _remove_stale_socket(self):
+        try:
+            info = os.lstat(self.path)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(info.st_mode):
+            raise RuntimeError(f"{self.path} exists and is not a socket")
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.unlink(self.path)
+        else:
+            raise RuntimeError(f"an aero daemon is already listening on {self.path}")
+        finally:
+            probe.close()
+
+    def _kill(self, pid):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self, selector, block=False):
+        # Closes the connections of workers that have exited
+        while self.workers:
+            pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+            if not pid:
+                return
+            conn = self.workers.pop(pid, None)
+            if conn is not None:
+                if conn in selector.get_map():
+                    selector.unregister(conn)
+                conn.close()
+
+    def _read_request(self, pending, listener, selector):
+        # Reads what has arrived of a request and, once it is complete,
+        # starts a worker for it
+        conn = pending.conn
+        try:
+            frame = pending.read()
+        except BlockingIOError:
+            return
+        except (OSError, UnicodeDecodeError):
+            frame = ()  # The client went away or sent garbage
+        if frame is None:
+            return
+        selector.unregister(conn)
+        del self.pending[conn]
+        pid = self._start(conn, *frame, listener, selector) if frame else None
+        if pid is None:
+            conn.close()
+        else:
+            self.workers[pid] = conn
+            selector.register(conn, selectors.EVENT_READ, pid)
+
+    def _read_result(self, result, selector):
+        # Collects what a worker's `prepare` returned and adopts it once the
+        # worker has closed its end
+        try:
+            chunk = os.read(result.fd, RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = result.data = b''
+        if chunk:
+            result.data += chunk
+            return
+        selector.unregister(result.fd)
+        del self.results[result.fd]
+        os.close(result.fd)
+        if result.data:
+            try:
+                value = pickle.loads(result.data)
+            except Exception:
+                return  # The worker was killed halfway through sending it
+            self.adopt(value)
+
+    def _expire(self, selector):
+        # Drops the clients that did not send their request in time
+        now = time.monotonic()
+        for conn, pending in list(self.pending.items()):
+            if pending.deadline <= now:
+                selector.unregister(conn)
+                del self.pending[conn]
+                conn.close()
+
+    def _start(self, conn, kind, request, listener, selector):
+        # Answers a complete request and forks a worker to run it; returns
+        # the worker's pid, or None when there is nothing to run
+        try:
+            conn.settimeout(REQUEST_TIMEOUT)
+            fields = request.split("\0")
+            if kind != REQUEST or len(fields) < 3 or fields[0] != __version__ or runs_locally(fields[3:]):
+                _send(conn, REFUSED)
+                return None
+            _send(conn, ACCEPTED)
+        except OSError:
+            return None  # The client went away
+        client_cwd, tty = fields[1:3]
+        argv = fields[3:]
+        self.requests += 1
+        result_fd = None
+        if self.prepare is not None and self.adopt is not None:
+            read_fd, result_fd = os.pipe()
+        pid = os.fork()
+        if pid:
+            if result_fd is not None:
+                os.close(result_fd)
+                os.set_blocking(read_fd, False)
+                result = _WorkerResult(read_fd)
+                self.results[read_fd] = result
+                selector.register(read_fd, selectors.EVENT_READ, result)
+            return pid
+        try:
+            selector.close()
+            listener.close()
+            for other in self.workers.values():
+                other.close()
+            for other in self.pending:
+                other.close()
+            for fd in self.results:
+                os.close(fd)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            conn.settimeout(None)
+            os.chdir(client_cwd)
+            if self.prepare is not None:
+                if result_fd is not None:
+                    os.close(read_fd)
+                self._prepare(argv, result_fd)
+            with redirect_stdout(_Channel(conn, STDOUT, bool(tty))), redirect_stderr(_Channel(conn, STDERR, bool(tty))):
+                status = self.run(argv)
+            _send(conn, EXIT, str(status))
+        finally:
+            os._exit(0)
+
+    def _prepare(self, argv, result_fd):
+        # Runs in the worker. What `prepare` returns is sent through
+        # result_fd, when there is one; closing it without data sends nothing.
+        discarded = io.StringIO()
+        data = b''
+        try:
+            with redirect_stdout(discarded), redirect_stderr(discarded):
+                value = self.prepare(argv)
+            if value is not None and result_fd is not None:
+                data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except (Exception, SystemExit):
+            pass  # `run` runs into it again and reports it
+        if result_fd is not None:
+            try:
+                with os.fdopen(result_fd, 'wb') as f:
+                    f.write(data)
+            except OSError:
+                pass
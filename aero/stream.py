@@ -0,0 +1,35 @@
+from .ast import Program
+from .lexer import StreamLexer, TokenStream, DEFAULT_CHUNK_SIZE, locate_stream
+from .parser import StreamParser
+from .resolver import Scope
+from .compiler import compile_program
+from .optimizer import optimize
+from .vm import BytecodeVM
+
+def iter_statements(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    parser = StreamParser(TokenStream(StreamLexer(stream, chunk_size)))
+    return parser.parse_statements()
+
+def run_stream(stream, vm=None, opt_level=1, chunk_size=DEFAULT_CHUNK_SIZE, filename=None):
+    # Executes each top-level statement as soon as it has been parsed. Peak
+    # memory is one chunk of source plus up to twice the tokens of the
+    # largest top-level statement (see StreamParser), and output starts
+    # before the rest of the file has been read.
+    # Whole-program passes are unavailable here: names are resolved
+    # incrementally and -O2 type inference degrades to -O1.
+    if vm is None:
+        vm = BytecodeVM()
+    scope = Scope()
+    try:
+        for stmt in iter_statements(stream, chunk_size):
+            program = optimize(Program([stmt]), min(opt_level, 1), builtins=None)
+            vm.execute_more(compile_program(program, scope))
+    except SyntaxError as e:
+        raise locate_stream(e, stream, filename)
+    finally:
+        vm.output.flush()
+    return vm
+
+def run_stream_file(filepath, vm=None, opt_level=1, chunk_size=DEFAULT_CHUNK_SIZE):
+    with open(filepath, 'r') as f:
+        return run_stream(f, vm, opt_level, chunk_size, filepath)
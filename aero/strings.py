@@ -0,0 +1,109 @@
+# Appending to a str at least this long makes a StringBuilder
+BUILDER_THRESHOLD = 1024
+
+class StringBuilder:
+    # A long string built by `+`, kept as the list of its parts and joined
+    # only when the text is needed: to print, compare or hash it. Appending
+    # to the newest value built on a list of parts adds to that list in
+    # place, so a loop like `s = s + line` takes linear time instead of
+    # copying `s` on every step. An older value sees only its first `count`
+    # parts and appends to a copy of them. Everything Aero code can do with
+    # a str gives the same result on a StringBuilder; `length` keeps `==`,
+    # len() and truth tests from joining the parts.
+    __slots__ = ('parts', 'count', 'length', 'text')
+
+    def __init__(self, parts, count, length):
+        self.parts = parts
+        self.count = count
+        self.length = length
+        self.text = None
+
+    def append(self, text):
+        parts = self.parts
+        if len(parts) != self.count:
+            parts = parts[:self.count]
+        parts.append(text)
+        return StringBuilder(parts, self.count + 1, self.length + len(text))
+
+    def __str__(self):
+        if self.text is None:
+            parts = self.parts
+            self.text = "".join(parts if len(parts) == self.count else parts[:self.count])
+        return self.text
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (str, StringBuilder)):
+            return self.length == len(other) and str(self) == str(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, (str, StringBuilder)):
+            return self.length != len(other) or str(self) != str(other)
+        return NotImplemented
+
+    # Everything else behaves as the joined str does, including the errors
+    def __lt__(self, other):
+        return str(self) < _text(other)
+
+    def __le__(self, other):
+        return str(self) <= _text(other)
+
+    def __gt__(self, other):
+        return str(self) > _text(other)
+
+    def __ge__(self, other):
+        return str(self) >= _text(other)
+
+    def __add__(self, other):
+        return self.append(str(other))
+
+    def __radd__(self, other):
+        return concat(other, self)
+
+    def __sub__(self, other):
+        return str(self) - other
+
+    def __rsub__(self, other):
+        return other - str(self)
+
+    def __mul__(self, other):
+        return str(self) * other
+
+    def __rmul__(self, other):
+        return other * str(self)
+
+    def __floordiv__(self, other):
+        return str(self) // other
+
+    def __rfloordiv__(self, other):
+        return other // str(self)
+
+    def __mod__(self, other):
+        return str(self) % other
+
+    def __rmod__(self, other):
+        return other % str(self)
+
+def _text(value):
+    return str(value) if type(value) is StringBuilder else value
+
+def concat(left, right):
+    # `+` once either side is known to be a string
+    if type(left) is StringBuilder:
+        return left.append(str(right))
+    left = str(left)
+    if len(left) < BUILDER_THRESHOLD:
+        return left + str(right)
+    return StringBuilder([left], 1, len(left)).append(str(right))
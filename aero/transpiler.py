@@ -0,0 +1,308 @@
+import re
+from .lexer import TokenType, SourceMap
+from .ast import *
+from .runtime import BINARY_FUNCS, BUILTIN_FUNCS, BUILTIN_NAMES, add, concat, materialize, make_array, subscript
+from .resolver import resolve
+from .loops import counted_range
+from .optimizer import infer_types, expression_type
+from .output import make_output
+
+# Python operator and precedence per Aero operator. Every BinaryOp becomes
+# one Python expression whose operands are parenthesized only where
+# Python's precedence or comparison chaining would change the meaning.
+PY_OPERATORS = {
+    TokenType.MINUS: ("-", 5),
+    TokenType.STAR: ("*", 6),
+    TokenType.SLASH: ("//", 6),  # Integer division
+    TokenType.PERCENT: ("%", 6),
+    TokenType.EQUAL: ("==", 4),
+    TokenType.NOT_EQUAL: ("!=", 4),
+    TokenType.LESS: ("<", 4),
+    TokenType.LESS_EQUAL: ("<=", 4),
+    TokenType.GREATER: (">", 4),
+    TokenType.GREATER_EQUAL: (">=", 4),
+}
+COMPARISONS = frozenset({op for op, (_, level) in PY_OPERATORS.items() if level == 4})
+ATOM = 9
+
+MAIN = "_aero_main"
+UNBOUND_LOCAL = re.compile(r"'v_(\w+)'")
+
+def _call(func, callee, *args):
+    if not callable(func):
+        raise RuntimeError(f"{callee} is not callable")
+    return func(*args)
+
+class CountedSpan:
+    # The values a CountedWhile's variable takes, and the value it is left
+    # with once the loop is over: a range when the start and bound are
+    # ints, otherwise a generator stepping with the generic operators
+    __slots__ = ('values', 'final')
+
+    def __init__(self, op_name, start, bound, step):
+        op = TokenType[op_name]
+        if type(start) is int and type(bound) is int:
+            self.values = counted_range(op, start, bound, step)
+            self.final = start + len(self.values) * step
+        else:
+            self.values = self._generic(BINARY_FUNCS[op], start, bound, step)
+            self.final = start
+
+    def _generic(self, compare, value, bound, step):
+        while compare(value, bound):
+            yield value
+            value = add(value, step) if step > 0 else value - -step
+            self.final = value
+
+class PythonCompiler:
+    # Translates a Program into the source of a Python function that runs
+    # it. Aero variables become locals prefixed with v_, so CPython keeps
+    # them in fast slots; `lines` maps each generated line (1-based) to the
+    # source offset of the Aero statement it came from.
+    def __init__(self, program):
+        resolve(program)
+        self.program = program
+        self.types = infer_types(program)
+        self.assigned = set()
+        self._collect_assigned(program.statements)
+        self.source = []
+        self.lines = [None]
+        self.temps = 0
+
+    def _collect_assigned(self, statements):
+        pending = list(statements)
+        while pending:
+            stmt = pending.pop()
+            if isinstance(stmt, Assign):
+                self.assigned.add(stmt.name)
+            elif isinstance(stmt, Block):
+                pending.extend(stmt.statements)
+            elif isinstance(stmt, If):
+                pending.append(stmt.then_branch)
+                if stmt.else_branch:
+                    pending.append(stmt.else_branch)
+            elif isinstance(stmt, While):
+                pending.append(stmt.body)
+
+    def compile(self):
+        self._emit(0, f"def {MAIN}(_builtins, _call, _span, _add, _concat, _array, _index):")
+        for name in BUILTIN_NAMES:
+            # A builtin the program assigns reads as the builtin until then
+            if name in self.assigned:
+                self._emit(1, f"v_{name} = _builtins[{name!r}]")
+            else:
+                self._emit(1, f"_{name} = _builtins[{name!r}]")
+        self._statements(self.program.statements, 1)
+        self._emit(1, "return locals()")
+        return "\n".join(self.source) + "\n"
+
+    def _emit(self, depth, text, node=None):
+        self.source.append("    " * depth + text)
+        self.lines.append(node.pos if node is not None else None)
+
+    def _temp(self):
+        self.temps += 1
+        return f"_t{self.temps}"
+
+    def _statements(self, statements, depth):
+        if not statements:
+            self._emit(depth, "pass")
+        for stmt in statements:
+            self._statement(stmt, depth)
+
+    def _body(self, node, depth):
+        self._statements(node.statements if isinstance(node, Block) else [node], depth)
+
+    def _statement(self, node, depth):
+        if isinstance(node, Assign):
+            self._emit(depth, f"v_{node.name} = {self._expression(node.value)[0]}", node)
+        elif isinstance(node, Block):
+            self._statements(node.statements, depth)
+        elif isinstance(node, If):
+            keyword = "if"
+            while True:
+                self._emit(depth, f"{keyword} {self._condition(node.condition)[0]}:", node)
+                self._body(node.then_branch, depth + 1)
+                else_branch = node.else_branch
+                if isinstance(else_branch, Block) and len(else_branch.statements) == 1:
+                    else_branch = else_branch.statements[0]
+                if not isinstance(else_branch, If):
+                    break
+                # else-if chains stay flat
+                node = else_branch
+                keyword = "elif"
+            if else_branch:
+                self._emit(depth, "else:")
+                self._body(else_branch, depth + 1)
+        elif isinstance(node, CountedWhile):
+            span = self._temp()
+            var = f"v_{node.var}"
+            bound = self._expression(node.bound)[0]
+            self._emit(depth, f"{span} = _span({node.op.name!r}, {var}, {bound}, {node.step})", node)
+            self._emit(depth, f"for {var} in {span}.values:", node)
+            self._statements(node.statements, depth + 1)
+            self._emit(depth, f"{var} = {span}.final", node)
+        elif isinstance(node, While):
+            self._emit(depth, f"while {self._condition(node.condition)[0]}:", node)
+            self._body(node.body, depth + 1)
+        else:
+            self._emit(depth, self._expression(node)[0], node)
+
+    def _condition(self, node):
+        # Like _expression, but for a value only tested for truth: && and ||
+        # then need no bool() around them
+        if isinstance(node, BinaryOp) and node.op in (TokenType.AND, TokenType.OR):
+            keyword, level = ("and", 2) if node.op == TokenType.AND else ("or", 1)
+            left, left_level = self._condition(node.left)
+            right, right_level = self._condition(node.right)
+            if left_level < level:
+                left = f"({left})"
+            if right_level <= level:
+                right = f"({right})"
+            return f"{left} {keyword} {right}", level
+        return self._expression(node)
+
+    def _wrap(self, node, minimum):
+        text, level = self._expression(node)
+        return f"({text})" if level < minimum else text
+
+    def _type(self, node):
+        result = expression_type(node, self.types)
+        return result if result in (int, str, bool) else None
+
+    def _expression(self, node):
+        # Returns (Python source, precedence level)
+        if isinstance(node, Number):
+            return repr(node.value), (ATOM if node.value >= 0 else 7)
+        elif isinstance(node, (String, Bool)):
+            return repr(node.value), ATOM
+        elif isinstance(node, Identifier):
+            if node.name in BUILTIN_NAMES and node.name not in self.assigned:
+                return f"_{node.name}", ATOM
+            return f"v_{node.name}", ATOM
+        elif isinstance(node, Call):
+            args = [self._expression(arg)[0] for arg in node.args]
+            if isinstance(node.func, Identifier) and node.func.name in BUILTIN_NAMES \
+                    and node.func.name not in self.assigned:
+                return f"_{node.func.name}({', '.join(args)})", ATOM
+            callee = getattr(node.func, 'name', type(node.func).__name__)
+            return f"_call({', '.join([self._expression(node.func)[0], repr(callee)] + args)})", ATOM
+        elif isinstance(node, Array):
+            return f"_array([{', '.join(self._expression(element)[0] for element in node.elements)}])", ATOM
+        elif isinstance(node, Index):
+            return f"_index({self._expression(node.value)[0]}, {self._expression(node.index)[0]})", ATOM
+        elif isinstance(node, BinaryOp):
+            if node.op in (TokenType.AND, TokenType.OR):
+                return f"bool({self._condition(node)[0]})", ATOM
+            if node.op == TokenType.PLUS:
+                return self._add(node)
+            symbol, level = PY_OPERATORS[node.op]
+            # Left-associative: the right operand binds tighter. Comparisons
+            # never chain, so both of their operands bind tighter.
+            left = self._wrap(node.left, level + 1 if node.op in COMPARISONS else level)
+            right = self._wrap(node.right, level + 1)
+            return f"{left} {symbol} {right}", level
+        raise RuntimeError(f"Unknown AST node: {type(node)}")
+
+    def _add(self, node):
+        left_type = self._type(node.left)
+        right_type = self._type(node.right)
+        if left_type in (int, bool) and right_type in (int, bool):
+            return f"{self._wrap(node.left, 5)} + {self._wrap(node.right, 6)}", 5
+        if left_type is str and isinstance(node.left, Identifier):
+            # Appending to a variable, as in `s = s + x`: _concat turns a
+            # long str into a StringBuilder instead of copying it
+            return f"_concat({self._expression(node.left)[0]}, {self._expression(node.right)[0]})", ATOM
+        # Python's + works on a StringBuilder as Aero's does
+        if left_type is str:
+            right = self._wrap(node.right, 6) if right_type is str else f"str({self._expression(node.right)[0]})"
+            return f"{self._wrap(node.left, 5)} + {right}", 5
+        if right_type is str:
+            return f"str({self._expression(node.left)[0]}) + {self._wrap(node.right, 6)}", 5
+        return f"_add({self._expression(node.left)[0]}, {self._expression(node.right)[0]})", ATOM
+
+class PythonProgram:
+    # A Program compiled to a Python code object. `source` is the generated
+    # Python; errors raised while running it get `lineno` (and `filename`)
+    # set to the Aero line of the statement that failed when the Aero
+    # source was given.
+    def __init__(self, program, source=None, filename=None):
+        compiler = PythonCompiler(program)
+        self.python_source = compiler.compile()
+        self.offsets = compiler.lines
+        self.source_map = SourceMap(source) if source is not None else None
+        self.filename = filename or "<aero>"
+        try:
+            code = compile(self.python_source, f"<aero:{self.filename}>", "exec")
+        except (SyntaxError, RecursionError, MemoryError):
+            raise RuntimeError("Program is nested too deeply for the py engine")
+        namespace = {}
+        exec(code, namespace)
+        self.function = namespace[MAIN]
+
+    def line_of(self, python_line):
+        if self.source_map is None or not 0 < python_line < len(self.offsets):
+            return None
+        offset = self.offsets[python_line]
+        return self.source_map.location(offset)[0] if offset is not None else None
+
+    def annotated_source(self):
+        # The generated Python with each line's Aero line number
+        lines = []
+        for number, text in enumerate(self.python_source.splitlines(), 1):
+            line = self.line_of(number)
+            lines.append(text if line is None else f"{text}  # line {line}")
+        return "\n".join(lines) + "\n"
+
+    def run(self, builtins):
+        # Returns the final variables; on error the variables assigned so
+        # far are left in the exception's `variables` attribute
+        try:
+            return _variables(self.function(builtins, _call, CountedSpan, add, concat, make_array, subscript))
+        except Exception as e:
+            frame_locals, python_line = _failing_frame(e.__traceback__, self.function.__code__)
+            e.variables = _variables(frame_locals)
+            if isinstance(e, UnboundLocalError):
+                match = UNBOUND_LOCAL.search(str(e))
+                error = NameError(f"Undefined name: {match.group(1) if match else '?'}")
+                error.variables = e.variables
+                e = error
+            line = self.line_of(python_line)
+            if line is not None:
+                e.lineno = line
+                e.filename = self.filename
+            raise e from None
+
+def _failing_frame(tb, code):
+    # The locals and line of the generated function's frame in a traceback
+    frame_locals, line = {}, 0
+    while tb is not None:
+        if tb.tb_frame.f_code is code:
+            frame_locals, line = tb.tb_frame.f_locals, tb.tb_lineno
+        tb = tb.tb_next
+    return frame_locals, line
+
+def _variables(frame_locals):
+    return {name[2:]: materialize(value) for name, value in frame_locals.items() if name.startswith("v_")}
+
+class PythonVM:
+    def __init__(self, output=None):
+        self.output = make_output(output)
+        self.globals = dict(BUILTIN_FUNCS, print=self.output.print)
+        self.variables = {}
+
+    def compile(self, program, source=None, filename=None):
+        if not isinstance(program, Program):
+            raise TypeError("Expected Program AST node")
+        return PythonProgram(program, source, filename)
+
+    def execute(self, program, source=None, filename=None):
+        if not isinstance(program, PythonProgram):
+            program = self.compile(program, source, filename)
+        try:
+            self.variables = program.run(self.globals)
+        except Exception as e:
+            self.variables = getattr(e, 'variables', {})
+            raise
+        finally:
+            self.output.flush()
@@ -1,114 +1,504 @@
+import math
+from inspect import isawaitable
 from .lexer import TokenType
 from .ast import *
+from .bytecode import *
+from .compiler import compile_program
+from .runtime import BINARY_FUNCS, BUILTIN_FUNCS, UNBOUND, add, concat, materialize, make_array, subscript
+from .loops import counted_range, closed_form
+from .quicken import quicken, QuickeningStats
+from .resolver import resolve
+from .output import make_output
 
 class VirtualMachine:
-    def __init__(self):
+    def __init__(self, output=None):
         self.variables = {}
-        self.globals = {
-            'print': self._builtin_print
-        }
+        self.output = make_output(output)
+        self.globals = dict(BUILTIN_FUNCS, print=self.output.print)
 
     def execute(self, program):
         if not isinstance(program, Program):
             raise TypeError("Expected Program AST node")
-        for stmt in program.statements:
-            self._eval(stmt)
+        # Only for its diagnostics: names that can never be defined are
+        # reported before anything runs, as in the compiling engines
+        resolve(program, self.globals)
+        try:
+            self._execute(program.statements)
+        finally:
+            self.output.flush()
 
     def _eval(self, node):
-        if isinstance(node, Program):
-            for stmt in node.statements:
-                self._eval(stmt)
-        elif isinstance(node, Block):
-            for stmt in node.statements:
-                self._eval(stmt)
-        elif isinstance(node, Assign):
-            value = self._eval(node.value)
-            self.variables[node.name] = value
-            return value
-        elif isinstance(node, If):
-            cond = self._eval(node.condition)
-            if self._is_truthy(cond):
-                return self._eval(node.then_branch)
-            elif node.else_branch:
-                return self._eval(node.else_branch)
-        elif isinstance(node, While):
-            while self._is_truthy(self._eval(node.condition)):
-                self._eval(node.body)
-        elif isinstance(node, Call):
-            func = self._eval(node.func)
-            args = [self._eval(arg) for arg in node.args]
-            if callable(func):
-                return func(*args)
-            raise RuntimeError(f"{node.func.name} is not callable")
-        elif isinstance(node, Identifier):
-            if node.name in self.variables:
-                return self.variables[node.name]
-            elif node.name in self.globals:
-                return self.globals[node.name]
-            raise NameError(f"Undefined name: {node.name}")
-        elif isinstance(node, Number):
-            return node
-        elif isinstance(node, String):
-            return node
-        elif isinstance(node, Bool):
-            return node
-        elif isinstance(node, BinaryOp):
-            left = self._eval(node.left)
-            right = self._eval(node.right)
-            return self._eval_binary_op(node.op, left, right)
+        if isinstance(node, (Program, Block)):
+            self._execute(node.statements)
+        elif isinstance(node, (Assign, If, While)):
+            self._execute((node,))
         else:
-            raise RuntimeError(f"Unknown AST node: {type(node)}")
+            return self._evaluate(node)
+
+    def _execute(self, statements):
+        # Runs statements from an explicit stack of iterators instead of by
+        # recursion, so that nesting (long else-if chains above all) is not
+        # limited by Python's stack: a Block pushes its statements and a
+        # While a generator yielding its body for as long as it loops
+        variables = self.variables
+        evaluate = self._evaluate
+        pending = [iter(statements)]
+        while pending:
+            node = next(pending[-1], None)
+            if node is None:
+                pending.pop()
+                continue
+            while type(node) is If:
+                node = node.then_branch if evaluate(node.condition) else node.else_branch
+            if node is None:
+                continue
+            kind = type(node)
+            if kind is Assign:
+                variables[node.name] = evaluate(node.value)
+            elif kind is Block:
+                pending.append(iter(node.statements))
+            elif kind is CountedWhile:
+                pending.append(self._counted_loop(node))
+            elif kind is While:
+                pending.append(self._loop(node))
+            else:
+                evaluate(node)
+
+    def _loop(self, node):
+        condition = node.condition
+        body = node.body
+        evaluate = self._evaluate
+        while evaluate(condition):
+            yield body
+
+    def _counted_loop(self, node):
+        # Runs a CountedWhile over a range when its variable and bound are
+        # ints, and as a plain While otherwise
+        variables = self.variables
+        start = variables.get(node.var)
+        bound = self._evaluate(node.bound) if type(start) is int else None
+        if type(bound) is not int:
+            yield from self._loop(node)
+            return
+        span = counted_range(node.op, start, bound, node.step)
+        final = start + len(span) * node.step
+        if node.accumulators is not None:
+            values = closed_form(node, span, lambda name: variables.get(name, UNBOUND))
+            if values is not None:
+                variables.update(values)
+                variables[node.var] = final
+                return
+        statements = node.statements
+        for value in span:
+            variables[node.var] = value
+            yield from statements
+        variables[node.var] = final
+
+    def _evaluate(self, node):
+        # Expressions are evaluated from explicit stacks as well: `work`
+        # holds the nodes still to evaluate, each above the operation that
+        # will combine its value with its siblings' (an operator token, or
+        # a tuple for && and || and for calls, indexing and arrays), and
+        # `values` holds the results so far
+        kind = type(node)
+        if kind is Number or kind is String or kind is Bool:
+            # Literals carry native Python values; evaluating one allocates nothing
+            return node.value
+        variables = self.variables
+        values = []
+        work = [node]
+        while work:
+            node = work.pop()
+            kind = type(node)
+            if kind is Identifier:
+                name = node.name
+                if name in variables:
+                    values.append(variables[name])
+                elif name in self.globals:
+                    values.append(self.globals[name])
+                else:
+                    raise NameError(f"Undefined name: {name}")
+            elif kind is Number or kind is String or kind is Bool:
+                values.append(node.value)
+            elif kind is BinaryOp:
+                op = node.op
+                if op == TokenType.AND or op == TokenType.OR:
+                    work.append((op, node.right))
+                else:
+                    work.append(op)
+                    work.append(node.right)
+                work.append(node.left)
+            elif kind is TokenType:
+                right = values.pop()
+                values[-1] = self._eval_binary_op(node, values[-1], right)
+            elif kind is tuple:
+                operation, operand = node
+                if operation == TokenType.AND or operation == TokenType.OR:
+                    # && and || only evaluate the right operand when it decides the result
+                    truth = bool(values[-1])
+                    values[-1] = truth
+                    if truth is (operation == TokenType.AND):
+                        values.pop()
+                        work.append((bool, None))
+                        work.append(operand)
+                elif operation is bool:
+                    values[-1] = bool(values[-1])
+                elif operation is Call:
+                    count = len(operand.args)
+                    args = values[len(values) - count:]
+                    del values[len(values) - count:]
+                    func = values.pop()
+                    if not callable(func):
+                        raise RuntimeError(f"{getattr(operand.func, 'name', type(operand.func).__name__)} is not callable")
+                    values.append(func(*args))
+                elif operation is Index:
+                    index = values.pop()
+                    values[-1] = subscript(values[-1], index)
+                else:
+                    count = len(operand.elements)
+                    elements = values[len(values) - count:]
+                    del values[len(values) - count:]
+                    values.append(make_array(elements))
+            elif kind is Call:
+                work.append((Call, node))
+                work.extend(reversed(node.args))
+                work.append(node.func)
+            elif kind is Index:
+                work.append((Index, node))
+                work.append(node.index)
+                work.append(node.value)
+            elif kind is Array:
+                work.append((Array, node))
+                work.extend(reversed(node.elements))
+            else:
+                raise RuntimeError(f"Unknown AST node: {kind}")
+        return values[0]
 
     def _eval_binary_op(self, op, left, right):
-        # Unwrap values
-        lval = left.value if hasattr(left, 'value') else left
-        rval = right.value if hasattr(right, 'value') else right
-
-        if op == TokenType.PLUS:
-            if isinstance(left, String) or isinstance(right, String):
-                return String(str(lval) + str(rval))
-            return Number(lval + rval)
-        elif op == TokenType.MINUS:
-            return Number(lval - rval)
-        elif op == TokenType.STAR:
-            return Number(lval * rval)
-        elif op == TokenType.SLASH:
-            return Number(lval // rval)  # Integer division
-        elif op == TokenType.PERCENT:
-            return Number(lval % rval)
-        elif op == TokenType.EQUAL:
-            return Bool(lval == rval)
-        elif op == TokenType.NOT_EQUAL:
-            return Bool(lval != rval)
-        elif op == TokenType.LESS:
-            return Bool(lval < rval)
-        elif op == TokenType.LESS_EQUAL:
-            return Bool(lval <= rval)
-        elif op == TokenType.GREATER:
-            return Bool(lval > rval)
-        elif op == TokenType.GREATER_EQUAL:
-            return Bool(lval >= rval)
-        elif op == TokenType.AND:
-            return Bool(self._is_truthy(left) and self._is_truthy(right))
-        elif op == TokenType.OR:
-            return Bool(self._is_truthy(left) or self._is_truthy(right))
-        else:
+        if op not in BINARY_FUNCS:
             raise RuntimeError(f"Unsupported operator: {op}")
+        return BINARY_FUNCS[op](left, right)
+
+class BytecodeVM:
+    def __init__(self, output=None, quickening=True):
+        self.output = make_output(output)
+        self.quickening = quickening
+        self.stats = QuickeningStats()
+        self.globals = dict(BUILTIN_FUNCS, print=self.output.print)
+        self.names = ()
+        self.slots = []
+        self.builtin_values = []
+        # Instructions left before cooperative code stops (see YIELD_POINT)
+        self.ticks = math.inf
+
+    @property
+    def variables(self):
+        return {name: materialize(value) for name, value in zip(self.names, self.slots) if value is not UNBOUND}
+
+    def execute(self, code, preset=None):
+        # `preset` maps slot indexes to values stored before the first
+        # instruction runs (see Compiler's inputs)
+        if isinstance(code, Program):
+            code = compile_program(code)
+        if not isinstance(code, Code):
+            raise TypeError("Expected Program AST node or Code object")
+        self._bind(code)
+        if preset:
+            for index, value in preset.items():
+                self.slots[index] = value
+        try:
+            self._run(code)
+        finally:
+            self.output.flush()
+
+    def execute_more(self, code):
+        # Run code compiled against the same growing scope as the code
+        # executed before it, keeping all variables (see Compiler). Output
+        # is left buffered; the caller flushes when the run is over.
+        slots = self.slots
+        for name in code.names[len(slots):]:
+            slots.append(self.globals.get(name, UNBOUND))
+        for name in code.builtins[len(self.builtin_values):]:
+            self.builtin_values.append(self.globals[name])
+        self.names = code.names
+        self._run(code)
+
+    def _bind(self, code):
+        # A builtin name that the program also assigns still reads as the
+        # builtin until its first assignment
+        self.names = code.names
+        self.slots = [self.globals.get(name, UNBOUND) for name in code.names]
+        self.builtin_values = [self.globals[name] for name in code.builtins]
+
+    def _run(self, code):
+        # Only an AsyncVM's builtins return awaitables and only it limits
+        # ticks, so the dispatch loop always runs to the end here
+        if not self.quickening:
+            self._dispatch(code, code.instructions, ())
+        else:
+            instructions, sites = quicken(code)
+            try:
+                self._dispatch(code, instructions, sites)
+            finally:
+                # Sites live on the Code, so code run again keeps its
+                # specializations; stats add up the sites as each run leaves them
+                self.stats.add_code(code)
+
+    def _dispatch(self, code, instructions, sites, pc=0, stack=None):
+        # Runs until the end of the instructions and returns None, or until
+        # cooperative code stops and returns the pc to resume at with the
+        # same `stack`
+        constants = code.constants
+        names = code.names
+        loops = code.loops
+        builtins = self.builtin_values
+        slots = self.slots
+        if stack is None:
+            stack = []
+        push = stack.append
+        pop = stack.pop
+        end = len(instructions)
+
+        # The opcodes, bound to locals: every instruction compares against
+        # them until one matches, so the hottest come first in the chain
+        (load_slot, load_const, store_slot, quick_slot_const, quick_slot_slot, quick_const_slot,
+         jump_if_not_lt, jump_if_not_le, jump_if_not_eq, jump_if_not_ne, jump_if_not_gt,
+         jump_if_not_ge, jump, pop_jump_if_false, load_builtin, call, pop_top, for_range_next,
+         binary_add, binary_sub, binary_mul, binary_div, binary_mod, compare_eq, compare_ne,
+         compare_lt, compare_le, compare_gt, compare_ge, pop_jump_if_true, jump_if_false_or_pop,
+         jump_if_true_or_pop, to_bool, for_range_setup, binary_index, build_array, yield_point,
+         await_) = (
+            LOAD_SLOT, LOAD_CONST, STORE_SLOT, QUICK_SLOT_CONST, QUICK_SLOT_SLOT, QUICK_CONST_SLOT,
+            JUMP_IF_NOT_LT, JUMP_IF_NOT_LE, JUMP_IF_NOT_EQ, JUMP_IF_NOT_NE, JUMP_IF_NOT_GT,
+            JUMP_IF_NOT_GE, JUMP, POP_JUMP_IF_FALSE, LOAD_BUILTIN, CALL, POP_TOP, FOR_RANGE_NEXT,
+            BINARY_ADD, BINARY_SUB, BINARY_MUL, BINARY_DIV, BINARY_MOD, COMPARE_EQ, COMPARE_NE,
+            COMPARE_LT, COMPARE_LE, COMPARE_GT, COMPARE_GE, POP_JUMP_IF_TRUE, JUMP_IF_FALSE_OR_POP,
+            JUMP_IF_TRUE_OR_POP, TO_BOOL, FOR_RANGE_SETUP, BINARY_INDEX, BUILD_ARRAY, YIELD_POINT,
+            AWAIT)
 
-    def _is_truthy(self, val):
-        if isinstance(val, Bool):
-            return val.value
-        if isinstance(val, Number):
-            return val.value != 0
-        if isinstance(val, String):
-            return len(val.value) > 0
-        return bool(val)
-
-    def _builtin_print(self, *args):
-        py_args = []
-        for arg in args:
-            if hasattr(arg, 'value'):
-                py_args.append(arg.value)
+        while pc < end:
+            op = instructions[pc]
+            arg = instructions[pc + 1]
+            pc += 2
+            if op == load_slot:
+                value = slots[arg]
+                if value is UNBOUND:
+                    raise NameError(f"Undefined name: {names[arg]}")
+                push(value)
+            elif op == load_const:
+                push(constants[arg])
+            elif op == store_slot:
+                slots[arg] = pop()
+            elif op == quick_slot_const:
+                site = sites[arg]
+                left = slots[site.left]
+                if left is UNBOUND:
+                    raise NameError(f"Undefined name: {names[site.left]}")
+                if site.left_type is not None and type(left) is not site.left_type:
+                    site.deopt()
+                value = site.func(left, site.right)
+                if site.jump is None:
+                    push(value)
+                    pc = site.resume
+                elif value:
+                    pc = site.resume
+                else:
+                    pc = site.jump
+            elif op == quick_slot_slot:
+                site = sites[arg]
+                left = slots[site.left]
+                if left is UNBOUND:
+                    raise NameError(f"Undefined name: {names[site.left]}")
+                right = slots[site.right]
+                if right is UNBOUND:
+                    raise NameError(f"Undefined name: {names[site.right]}")
+                if site.left_type is not None and (type(left) is not site.left_type or
+                                                   site.right_type is not None and type(right) is not site.right_type):
+                    site.deopt()
+                value = site.func(left, right)
+                if site.jump is None:
+                    push(value)
+                    pc = site.resume
+                elif value:
+                    pc = site.resume
+                else:
+                    pc = site.jump
+            elif op == quick_const_slot:
+                site = sites[arg]
+                right = slots[site.right]
+                if right is UNBOUND:
+                    raise NameError(f"Undefined name: {names[site.right]}")
+                if site.right_type is not None and type(right) is not site.right_type:
+                    site.deopt()
+                value = site.func(site.left, right)
+                if site.jump is None:
+                    push(value)
+                    pc = site.resume
+                elif value:
+                    pc = site.resume
+                else:
+                    pc = site.jump
+            elif op == jump_if_not_lt:
+                right = pop()
+                if not pop() < right:
+                    pc = arg
+            elif op == jump_if_not_le:
+                right = pop()
+                if not pop() <= right:
+                    pc = arg
+            elif op == jump_if_not_eq:
+                right = pop()
+                if not pop() == right:
+                    pc = arg
+            elif op == jump_if_not_ne:
+                right = pop()
+                if not pop() != right:
+                    pc = arg
+            elif op == jump_if_not_gt:
+                right = pop()
+                if not pop() > right:
+                    pc = arg
+            elif op == jump_if_not_ge:
+                right = pop()
+                if not pop() >= right:
+                    pc = arg
+            elif op == jump:
+                pc = arg
+            elif op == pop_jump_if_false:
+                if not pop():
+                    pc = arg
+            elif op == load_builtin:
+                push(builtins[arg])
+            elif op == call:
+                argc, callee = code.calls[arg]
+                if argc:
+                    args = stack[-argc:]
+                    del stack[-argc:]
+                else:
+                    args = []
+                func = pop()
+                if not callable(func):
+                    raise RuntimeError(f"{callee} is not callable")
+                push(func(*args))
+            elif op == pop_top:
+                pop()
+            elif op == for_range_next:
+                iterator = stack[-1]
+                loop = loops[arg]
+                if iterator is not None:
+                    value = next(iterator, UNBOUND)
+                    if value is UNBOUND:
+                        pop()
+                        slots[loop.slot] = pop()
+                    else:
+                        slots[loop.slot] = value
+                        pc = loop.body_pc
+                else:
+                    value = slots[loop.slot]
+                    if loop.step > 0:
+                        value = add(value, loop.step)
+                    else:
+                        value = value - -loop.step
+                    slots[loop.slot] = value
+                    if BINARY_FUNCS[loop.op](value, stack[-2]):
+                        pc = loop.body_pc
+                    else:
+                        del stack[-2:]
+            elif op == binary_add:
+                right = pop()
+                left = stack[-1]
+                if isinstance(left, str) or isinstance(right, str):
+                    stack[-1] = concat(left, right)
+                else:
+                    stack[-1] = left + right  # A StringBuilder concatenates itself
+            elif op == binary_sub:
+                right = pop()
+                stack[-1] = stack[-1] - right
+            elif op == binary_mul:
+                right = pop()
+                stack[-1] = stack[-1] * right
+            elif op == binary_div:
+                right = pop()
+                stack[-1] = stack[-1] // right  # Integer division
+            elif op == binary_mod:
+                right = pop()
+                stack[-1] = stack[-1] % right
+            elif op == compare_eq:
+                right = pop()
+                stack[-1] = stack[-1] == right
+            elif op == compare_ne:
+                right = pop()
+                stack[-1] = stack[-1] != right
+            elif op == compare_lt:
+                right = pop()
+                stack[-1] = stack[-1] < right
+            elif op == compare_le:
+                right = pop()
+                stack[-1] = stack[-1] <= right
+            elif op == compare_gt:
+                right = pop()
+                stack[-1] = stack[-1] > right
+            elif op == compare_ge:
+                right = pop()
+                stack[-1] = stack[-1] >= right
+            elif op == pop_jump_if_true:
+                if pop():
+                    pc = arg
+            elif op == jump_if_false_or_pop:
+                if stack[-1]:
+                    pop()
+                else:
+                    stack[-1] = False
+                    pc = arg
+            elif op == jump_if_true_or_pop:
+                if stack[-1]:
+                    stack[-1] = True
+                    pc = arg
+                else:
+                    pop()
+            elif op == to_bool:
+                stack[-1] = bool(stack[-1])
+            elif op == for_range_setup:
+                loop = loops[arg]
+                bound = pop()
+                start = pop()
+                if type(start) is int and type(bound) is int:
+                    span = counted_range(loop.op, start, bound, loop.step)
+                    final = start + len(span) * loop.step
+                    values = None
+                    if loop.accumulators is not None:
+                        read_slots = loop.slots
+                        values = closed_form(loop, span, lambda name: slots[read_slots[name]] if name in read_slots else UNBOUND)
+                    if values is not None:
+                        for name, value in values.items():
+                            slots[read_slots[name]] = value
+                        slots[loop.slot] = final
+                        pc = loop.next_pc + 2
+                    else:
+                        push(final)
+                        push(iter(span))
+                        pc = loop.next_pc
+                elif BINARY_FUNCS[loop.op](start, bound):
+                    push(bound)
+                    push(None)
+                else:
+                    pc = loop.next_pc + 2
+            elif op == binary_index:
+                index = pop()
+                stack[-1] = subscript(stack[-1], index)
+            elif op == build_array:
+                if arg:
+                    values = stack[-arg:]
+                    del stack[-arg:]
+                else:
+                    values = []
+                push(make_array(values))
+            elif op == yield_point:
+                self.ticks -= arg
+                if self.ticks < 0:
+                    return pc
+            elif op == await_:
+                if isawaitable(stack[-1]):
+                    return pc
             else:
-                py_args.append(arg)
-        print(*py_args, flush=True)
+                raise RuntimeError(f"Unknown opcode: {op}")
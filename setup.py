@@ -40,9 +40,12 @@ setup(
     ],
     python_requires=">=3.7",
     install_requires=[],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     entry_points={
         "console_scripts": [
-            "aero=aero.cli:main",
+            "aero=aero.client:main",
         ],
     },
     include_package_data=True,
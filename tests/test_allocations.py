@@ -0,0 +1,56 @@
+import unittest
+from aero import ast
+from aero.compiler import compile_source, compile_program
+from aero.vm import VirtualMachine, BytecodeVM
+from aero.closures import ClosureVM
+
+# Unoptimized, so the loop really runs `i = i + 1` once per iteration
+COUNTING_LOOP = "i = 0\nt = 0\nwhile (i < {n}) {{ i = i + 1\nt = t + i * 2 }}\n"
+
+def _node_classes(cls=ast.ASTNode):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from _node_classes(sub)
+
+def _run(engine, n):
+    # The number of AST nodes constructed while the loop runs, and the
+    # final variables. Boxed results are freed as soon as the next one
+    # replaces them, so neither live blocks nor the traced peak grow with
+    # n; counting constructions is what shows the per-iteration cost.
+    program = compile_source(COUNTING_LOOP.format(n=n))
+    if engine == "bytecode":
+        vm, program = BytecodeVM(), compile_program(program)
+    else:
+        vm = VirtualMachine() if engine == "tree" else ClosureVM()
+    created = 0
+    originals = {cls: cls.__dict__['__init__'] for cls in _node_classes()
+                 if '__init__' in cls.__dict__}
+    def counting(init):
+        def __init__(self, *args):
+            nonlocal created
+            created += 1
+            init(self, *args)
+        return __init__
+    for cls, init in originals.items():
+        cls.__init__ = counting(init)
+    try:
+        vm.execute(program)
+    finally:
+        for cls, init in originals.items():
+            cls.__init__ = init
+    return created, vm.variables
+
+class AllocationTest(unittest.TestCase):
+    def test_loop_allocates_no_nodes(self):
+        # Results are native values: nothing is boxed per iteration, so
+        # running the loop 10 times longer constructs no more nodes
+        for engine in ("tree", "closure", "bytecode"):
+            with self.subTest(engine=engine):
+                short, _ = _run(engine, 1000)
+                long, variables = _run(engine, 10000)
+                self.assertEqual(long, short)
+                self.assertEqual(variables, {'i': 10000, 't': 10000 * 10001})
+                self.assertIs(type(variables['t']), int)
+
+if __name__ == "__main__":
+    unittest.main()
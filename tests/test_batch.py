@@ -0,0 +1,25 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from aero.cli import run_many_main
+
+class RunManyTest(unittest.TestCase):
+    def test_json_with_builtin_values(self):
+        # A builtin held in a variable must not break the whole batch
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "f.aero")
+            with open(path, 'w') as f:
+                f.write("f = len\np = print\nn = f([1, 2])\np(n)\n")
+            out = io.StringIO()
+            with redirect_stdout(out):
+                status = run_many_main([path, "--json", "--no-cache", "-j", "1"])
+        self.assertEqual(status, 0)
+        result = json.loads(out.getvalue())
+        self.assertEqual(result["output"], "2\n")
+        self.assertEqual(result["variables"], {"f": "<builtin len>", "p": "<builtin print>", "n": 2})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import os
+import stat
+import tempfile
+import unittest
+from aero.build import build
+from aero.cache import cache_path
+
+class BuildTest(unittest.TestCase):
+    def test_artifacts_are_readable_by_others(self):
+        # Artifacts get the mode open() would give them, not mkstemp's 0600,
+        # so a shared build can be used by whoever runs the programs
+        with tempfile.TemporaryDirectory() as root:
+            sources = [os.path.join(root, name) for name in ("a.aero", "b.aero")]
+            for path in sources:
+                with open(path, 'w') as f:
+                    f.write('print("hi")\n')
+            umask = os.umask(0o022)
+            try:
+                result = build(root, max_workers=2)
+            finally:
+                os.umask(umask)
+            self.assertEqual(result.errors, [])
+            self.assertEqual(result.built, 2)
+            for path in sources:
+                mode = stat.S_IMODE(os.stat(cache_path(path, 1)).st_mode)
+                self.assertEqual(mode, 0o644)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import io
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from aero.cli import run_script, parse_script_args
+
+DEPTH = 5000
+
+class DepthTest(unittest.TestCase):
+    def test_deep_else_if_chain(self):
+        # Far deeper than Python's recursion limit, through the optimizer
+        # at -O1 and the compiler of the default engine
+        self.assertGreater(DEPTH, sys.getrecursionlimit())
+        arms = "".join(f"if (x == {n}) {{ print({n}) }} else " for n in range(DEPTH))
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "chain.aero")
+            with open(path, 'w') as f:
+                f.write(f"x = {DEPTH - 1}\n{arms}{{ print(\"none\") }}\n")
+            for engine in ("bytecode", "closure", "tree"):
+                with self.subTest(engine=engine):
+                    out = io.StringIO()
+                    with redirect_stdout(out):
+                        status = run_script(parse_script_args([path, "--engine", engine]))
+                    self.assertEqual(status, 0)
+                    self.assertEqual(out.getvalue(), f"{DEPTH - 1}\n")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import io
+import os
+import sys
+import time
+import socket
+import tempfile
+import unittest
+import subprocess
+from contextlib import redirect_stdout
+from aero.client import run_in_daemon
+from aero.serve import REQUEST_TIMEOUT
+
+@unittest.skipUnless(hasattr(socket, 'AF_UNIX') and hasattr(os, 'fork'), "needs Unix sockets and fork")
+class ServeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "aero.sock")
+        self.daemon = subprocess.Popen([sys.executable, "-m", "aero", "serve", "--socket", self.path],
+                                       stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while not os.path.exists(self.path):
+            if time.monotonic() > deadline:
+                self.fail("daemon did not start")
+            time.sleep(0.05)
+
+    def tearDown(self):
+        self.daemon.terminate()
+        self.daemon.wait()
+        self.directory.cleanup()
+
+    def test_stalled_client_does_not_block_others(self):
+        # A client that connects and never sends its request must not hold
+        # up the next one until the request timeout
+        script = os.path.join(self.directory.name, "hello.aero")
+        with open(script, 'w') as f:
+            f.write('print("hi")\n')
+        stalled = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stalled.connect(self.path)
+        try:
+            out = io.StringIO()
+            start = time.monotonic()
+            with redirect_stdout(out):
+                status = run_in_daemon([script, "--no-cache"], self.path)
+            elapsed = time.monotonic() - start
+        finally:
+            stalled.close()
+        self.assertEqual(status, 0)
+        self.assertEqual(out.getvalue(), "hi\n")
+        self.assertLess(elapsed, REQUEST_TIMEOUT / 2)
+
+if __name__ == "__main__":
+    unittest.main()
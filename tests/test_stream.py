@@ -0,0 +1,42 @@
+import io
+import unittest
+from aero.output import Output
+from aero.parser import Parser, StreamParser
+from aero.stream import run_stream
+from aero.vm import BytecodeVM
+
+def _run(source, chunk_size):
+    chunks = []
+    vm = BytecodeVM(Output(chunks.append, line_buffered=False))
+    run_stream(io.StringIO(source), vm, chunk_size=chunk_size)
+    return "".join(chunks), vm
+
+class StreamTest(unittest.TestCase):
+    def test_syntax_error_has_location(self):
+        # As when the whole file is compiled at once
+        source = "x = 1\nprint(x)\ny = (2 +\n"
+        with self.assertRaises(SyntaxError) as raised:
+            _run(source, 4)
+        self.assertEqual((raised.exception.lineno, raised.exception.offset), (4, 1))
+
+    def test_statement_spanning_many_chunks(self):
+        # A top-level loop hundreds of chunks long is parsed again from its
+        # start only a few times, not once per chunk
+        body = "".join(f"    t = t + {n}\n" for n in range(2000))
+        source = f"t = 0\ni = 0\nwhile (i < 3) {{\n{body}    i = i + 1\n}}\nprint(t)\n"
+        attempts = 0
+        def parse_statement(self):
+            nonlocal attempts
+            attempts += 1
+            return Parser._parse_statement(self)
+        StreamParser._parse_statement = parse_statement
+        try:
+            output, _ = _run(source, 64)
+        finally:
+            del StreamParser._parse_statement
+        self.assertGreater(len(source) // 64, 500)
+        self.assertLess(attempts, 3 + 20)
+        self.assertEqual(output, f"{3 * sum(range(2000))}\n")
+
+if __name__ == "__main__":
+    unittest.main()